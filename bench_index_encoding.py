@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from squirrel_db import SquirrelDBPool
+from squirrel_server import SQUIRREL_ENCODER
+
+# Measures the serialization half of handleSquirrelsIndex: streaming the full
+# listing out of SQLite and turning it into response chunks, once through
+# dict_factory rows and json.dumps (the old path) and once through tuple rows
+# and the precomputed row encoder. Reports CPU time and peak traced memory.
+#
+#   python bench_index_encoding.py --rows 1000,100000
+
+SIZES = ("small", "medium", "large")
+
+def dictChunks(db):
+    version, batches = db.listSquirrels()
+    prefix = "["
+    for batch in batches:
+        yield bytes(prefix + ", ".join(json.dumps(squirrel) for squirrel in batch), "utf-8")
+        prefix = ", "
+
+def tupleChunks(db):
+    version, batches = db.listSquirrels(tuples=True)
+    prefix = "["
+    for batch in batches:
+        yield bytes(prefix + ", ".join(SQUIRREL_ENCODER.encode(batch)), "utf-8")
+        prefix = ", "
+
+def drain(pool, chunks):
+    with pool.connection() as db:
+        return sum(len(chunk) for chunk in chunks(db))
+
+def cpuSeconds(pool, chunks, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        drain(pool, chunks)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def peakBytes(pool, chunks):
+    tracemalloc.start()
+    try:
+        drain(pool, chunks)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def runOnce(rows, repeat, directory=None):
+    with tempfile.TemporaryDirectory(dir=directory) as directory:
+        path = os.path.join(directory, "squirrels.db")
+        pool = SquirrelDBPool(path, maxSize=1)
+        pool.warm()
+        conn = sqlite3.connect(path)
+        conn.executemany("INSERT INTO squirrels (name, size) VALUES (?, ?)",
+                         [(f"Squirrel{i}", SIZES[i % len(SIZES)]) for i in range(rows)])
+        conn.commit()
+        conn.close()
+        with pool.connection() as db:
+            assert b"".join(tupleChunks(db)) == b"".join(dictChunks(db))
+        result = {"rows": rows}
+        for name, chunks in (("dicts", dictChunks), ("tuples", tupleChunks)):
+            seconds = cpuSeconds(pool, chunks, repeat)
+            result[name] = {
+                "cpu_seconds": round(seconds, 4),
+                "rows_per_second": round(rows / seconds) if seconds else None,
+                "peak_kib": round(peakBytes(pool, chunks) / 1024, 1),
+            }
+        pool.close()
+    result["cpu_speedup"] = round(result["dicts"]["cpu_seconds"] / result["tuples"]["cpu_seconds"], 2)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare dict and tuple row serialization for GET /squirrels")
+    parser.add_argument("--rows", default="1000,100000", help="comma separated table sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="timed listings per path; the best is reported")
+    parser.add_argument("--dir", default=None, help="directory for the scratch database")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.rows.split(",")]
+    print(json.dumps({"runs": [runOnce(rows, args.repeat, args.dir) for rows in sizes]}, indent=2))
+
+if __name__ == '__main__':
+    main()
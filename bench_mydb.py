@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import pickle
+import tempfile
+import time
+from mydb import MyDB
+
+# Compares the MyDB string store with a plain pickle of the same list:
+# file size, save time and full load time, plus random access through get().
+#
+#   python bench_mydb.py --sizes 10000,1000000,10000000
+
+WORDS = ["acorn", "oak", "chestnut", "walnut", "hazel", "pine", "beech", "maple"]
+
+def makeStrings(count):
+    return [f"squirrel-{i}-{WORDS[i % len(WORDS)]}" for i in range(count)]
+
+def bestOf(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 4)
+
+def benchPickle(path, strings, repeat):
+    def save():
+        with open(path, "wb") as f:
+            pickle.dump(strings, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load():
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    saveSeconds = bestOf(1, save)
+    return {
+        "bytes": os.path.getsize(path),
+        "save_seconds": saveSeconds,
+        "load_seconds": bestOf(repeat, load),
+    }
+
+def benchMyDB(path, strings, repeat):
+    db = MyDB(path)
+    saveSeconds = bestOf(1, lambda: db.saveStrings(strings))
+    assert db.loadStrings() == strings
+    step = max(1, len(strings) // 1000)
+    indexes = range(0, len(strings), step)
+
+    def lookups():
+        for i in indexes:
+            db.get(i)
+
+    # Without cache every loadStrings reads the file, which is what pickle.load is up against
+    reader = MyDB(path, cache=False)
+    result = {
+        "bytes": os.path.getsize(path),
+        "save_seconds": saveSeconds,
+        "load_seconds": bestOf(repeat, reader.loadStrings),
+        "get_microseconds": round(bestOf(repeat, lookups) / len(indexes) * 1e6, 2),
+    }
+    reader.close()
+    db.close()
+    return result
+
+def ratio(numerator, denominator, digits):
+    # Timings are rounded, so a very fast run can come out as 0
+    return round(numerator / denominator, digits) if denominator else None
+
+def runOnce(count, repeat, directory=None):
+    strings = makeStrings(count)
+    with tempfile.TemporaryDirectory(dir=directory) as directory:
+        pickled = benchPickle(os.path.join(directory, "strings.pickle"), strings, repeat)
+        stored = benchMyDB(os.path.join(directory, "strings.db"), strings, repeat)
+    return {
+        "strings": count,
+        "pickle": pickled,
+        "mydb": stored,
+        "size_ratio": ratio(stored["bytes"], pickled["bytes"], 3),
+        "load_speedup": ratio(pickled["load_seconds"], stored["load_seconds"], 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the MyDB file format with pickle")
+    parser.add_argument("--sizes", default="10000,1000000,10000000", help="comma separated string counts")
+    parser.add_argument("--repeat", type=int, default=3, help="timed loads per format; the best is reported")
+    parser.add_argument("--dir", default=None, help="directory for the scratch files")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(json.dumps({"runs": [runOnce(count, args.repeat, args.dir) for count in sizes]}, indent=2))
+
+if __name__ == '__main__':
+    main()
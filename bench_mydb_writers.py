@@ -0,0 +1,70 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from mydb import MyDB
+
+# Stress test for MyDB under contention: several processes append to the
+# same file at once, then the result is checked for lost or reordered writes.
+#
+#   python bench_mydb_writers.py --processes 8 --appends 2000 --flush-every 50
+
+def writer(path, number, appends, flushEvery, start):
+    db = MyDB(path, writeBack=flushEvery > 1)
+    start.wait()
+    for i in range(appends):
+        db.saveString(f"{number}-{i}")
+        if flushEvery > 1 and (i + 1) % flushEvery == 0:
+            db.flush()
+    db.close()
+
+def check(strings, processes, appends):
+    lost = processes * appends - len(strings)
+    misordered = 0
+    for number in range(processes):
+        prefix = f"{number}-"
+        if [s for s in strings if s.startswith(prefix)] != [f"{prefix}{i}" for i in range(appends)]:
+            misordered += 1
+    return lost, misordered
+
+def runOnce(processes, appends, flushEvery, directory=None):
+    with tempfile.TemporaryDirectory(dir=directory) as directory:
+        path = os.path.join(directory, "writers.db")
+        MyDB(path)
+        start = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=writer, args=(path, n, appends, flushEvery, start))
+                   for n in range(processes)]
+        for worker in workers:
+            worker.start()
+        began = time.perf_counter()
+        start.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+        lost, misordered = check(MyDB(path).loadStrings(), processes, appends)
+        return {
+            "flush_every": flushEvery,
+            "appends": processes * appends,
+            "seconds": round(elapsed, 4),
+            "appends_per_second": round(processes * appends / elapsed, 1),
+            "lost": lost,
+            "misordered_writers": misordered,
+            "bytes": os.path.getsize(path),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure MyDB append throughput with concurrent writer processes")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--appends", type=int, default=2000, help="appends per process")
+    parser.add_argument("--flush-every", type=int, default=50,
+                        help="also run with write-back, flushing after this many appends")
+    parser.add_argument("--dir", default=None, help="directory for the scratch file; use the disk you serve from")
+    args = parser.parse_args()
+
+    runs = [runOnce(args.processes, args.appends, flushEvery, args.dir) for flushEvery in sorted({1, args.flush_every})]
+    print(json.dumps({"processes": args.processes, "runs": runs}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from squirrel_db import PROFILES, SquirrelDBPool, WriteBatcher, resolveProfile
+
+# Compares write throughput with and without group commit by running
+# concurrent createSquirrel calls straight against SquirrelDB (no HTTP).
+#
+#   python bench_write_batching.py --threads 16 --writes 200 --profile durable
+
+def createDatabase(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS squirrels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            size TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+def runOnce(threads, writesPerThread, profile, batched, batchSize, batchWindow, directory=None):
+    with tempfile.TemporaryDirectory(dir=directory) as directory:
+        path = os.path.join(directory, "bench.db")
+        createDatabase(path)
+        writer = WriteBatcher(path, profile=profile, maxBatch=batchSize, maxDelay=batchWindow) if batched else None
+        pool = SquirrelDBPool(path, maxSize=threads, profile=profile, writer=writer)
+
+        def worker(number):
+            with pool.connection() as db:
+                for i in range(writesPerThread):
+                    db.createSquirrel(f"Squirrel{number}-{i}", "small")
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        result = {
+            "batched": batched,
+            "writes": threads * writesPerThread,
+            "seconds": round(elapsed, 4),
+            "writes_per_second": round(threads * writesPerThread / elapsed, 1),
+        }
+        if writer is not None:
+            result["commits"] = writer.stats()["batches"]
+        pool.close()
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure group commit throughput")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200, help="writes per thread")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="durable")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--batch-window-ms", type=float, default=2.0)
+    parser.add_argument("--dir", default=None, help="directory for the scratch database; use the disk you serve from")
+    args = parser.parse_args()
+
+    profile = resolveProfile(args.profile)
+    results = [runOnce(args.threads, args.writes, profile, batched, args.batch_size, args.batch_window_ms / 1000, args.dir)
+               for batched in (False, True)]
+    report = {
+        "profile": args.profile,
+        "threads": args.threads,
+        "runs": results,
+        "speedup": round(results[1]["writes_per_second"] / results[0]["writes_per_second"], 2),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
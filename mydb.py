@@ -1,23 +1,710 @@
+import json
+import mmap
+import os
 import os.path
 import pickle
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+from array import array
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import accumulate
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): a single writer process is still safe
+    fcntl = None
+
+# File layout:
+#   header   HEADER: magic, string count, blob size in bytes, flags
+#   offsets  count + 1 little-endian byte offsets into the blob: u32, or u64
+#            when the blob is 4 GiB or more (WIDE_OFFSETS)
+#   blob     the UTF-8 strings, each followed by a NUL byte
+#   tail     strings appended since the last saveStrings, one record each:
+#            a little-endian u32 byte length followed by the UTF-8 bytes
+MAGIC = b'MYDBSTR\x02'
+# Earlier releases wrote a bare append log: LOG_MAGIC followed by tail records
+LOG_MAGIC = b'MYDBLOG\x01'
+# A segmented store: SEGMENTS_MAGIC followed by a JSON manifest of segment files
+SEGMENTS_MAGIC = b'MYDBSEG\x01'
+HEADER = struct.Struct('<8sQQQ')
+LENGTH = struct.Struct('<I')
+SPANS = {4: struct.Struct('<II'), 8: struct.Struct('<QQ')}
+# No string contains a NUL, so the blob can be decoded and split in one pass
+NUL_FREE = 1
+WIDE_OFFSETS = 2
+
+class StringUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        # A list of strings needs no globals; refuse anything that would import code
+        raise pickle.UnpicklingError(f'{module}.{name} is not allowed in a MyDB file')
+
+def encodeSnapshot(arr):
+    if not arr:
+        return [HEADER.pack(MAGIC, 0, 0, NUL_FREE), bytes(4)]
+    text = '\x00'.join(arr) + '\x00'
+    blob = text.encode('utf-8')
+    flags = NUL_FREE if text.count('\x00') == len(arr) else 0
+    if len(blob) == len(text):
+        lengths = map(len, arr)
+    else:
+        lengths = (len(s.encode('utf-8')) for s in arr)
+    if len(blob) < 2 ** 32:
+        offsets = array('I', accumulate((length + 1 for length in lengths), initial=0))
+    else:
+        offsets = array('Q', accumulate((length + 1 for length in lengths), initial=0))
+        flags |= WIDE_OFFSETS
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return [HEADER.pack(MAGIC, len(arr), len(blob), flags), offsets, blob]
+
+def readHeader(data):
+    magic, count, blobSize, flags = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('not a MyDB file')
+    blobStart = HEADER.size + offsetWidth(flags) * (count + 1)
+    tailStart = blobStart + blobSize
+    if tailStart > len(data):
+        raise ValueError('MyDB file is truncated')
+    return count, blobStart, tailStart, flags
+
+def offsetWidth(flags):
+    return 8 if flags & WIDE_OFFSETS else 4
+
+def decodeSnapshot(data):
+    count, blobStart, tailStart, flags = readHeader(data)
+    if count == 0:
+        return [], tailStart
+    view = memoryview(data)
+    if flags & NUL_FREE:
+        return str(view[blobStart:tailStart - 1], 'utf-8').split('\x00'), tailStart
+    offsets = array('Q' if flags & WIDE_OFFSETS else 'I')
+    offsets.frombytes(view[HEADER.size:blobStart])
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    blob = view[blobStart:tailStart]
+    return [str(blob[offsets[i]:offsets[i + 1] - 1], 'utf-8') for i in range(count)], tailStart
+
+def encodeRecord(s):
+    data = s.encode('utf-8')
+    return LENGTH.pack(len(data)) + data
+
+def recordSpans(data, pos):
+    end = len(data)
+    while pos + LENGTH.size <= end:
+        (length,) = LENGTH.unpack_from(data, pos)
+        start = pos + LENGTH.size
+        if start + length > end:
+            # A torn append from a crash: ignore the incomplete record
+            return
+        yield start, start + length
+        pos = start + length
+
+def iterRecords(data, pos):
+    for start, end in recordSpans(data, pos):
+        yield str(data[start:end], 'utf-8')
+
+def decodeStore(data):
+    arr, end = decodeSnapshot(data)
+    for start, stop in recordSpans(data, end):
+        arr.append(str(data[start:stop], 'utf-8'))
+        end = stop
+    return arr, end
+
+def fileSignature(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def streamFile(f):
+    # Reads through a private map, so memory stays bounded and a concurrent
+    # saveStrings (which replaces the file) cannot disturb the iteration
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        count, blobStart, tailStart, flags = readHeader(view)
+        span = SPANS[offsetWidth(flags)]
+        for i in range(count):
+            start, end = span.unpack_from(view, HEADER.size + span.size // 2 * i)
+            yield str(view[blobStart + start:blobStart + end - 1], 'utf-8')
+        yield from iterRecords(view, tailStart)
+
+def readStore(path):
+    with open(path, 'rb') as f:
+        return decodeStore(f.read())[0]
+
+def hasTail(path):
+    with open(path, 'rb') as f:
+        magic, count, blobSize, flags = HEADER.unpack(f.read(HEADER.size))
+        return os.fstat(f.fileno()).st_size > HEADER.size + offsetWidth(flags) * (count + 1) + blobSize
+
+def encodeManifest(names, nextNumber):
+    return SEGMENTS_MAGIC + json.dumps({'segments': names, 'next': nextNumber}).encode('utf-8')
+
+def decodeManifest(data):
+    if not data.startswith(SEGMENTS_MAGIC):
+        raise ValueError('not a MyDB segment manifest')
+    manifest = json.loads(data[len(SEGMENTS_MAGIC):])
+    return manifest['segments'], manifest['next']
+
+def sameFile(a, b):
+    return (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino)
+
+@contextmanager
+def lockedFile(path, exclusive=True):
+    # Writers hold an exclusive lock on the file they change, readers of a
+    # segment manifest a shared one. Files are replaced rather than rewritten,
+    # so a lock taken on a file that was swapped out while we waited is retried
+    # on the new one.
+    flags = os.O_RDWR | os.O_APPEND if exclusive else os.O_RDONLY
+    while True:
+        fd = os.open(path, flags)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            if sameFile(os.fstat(fd), os.stat(path)):
+                yield fd
+                return
+        finally:
+            os.close(fd)
+
+def writeTempFile(directory, parts):
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.mydb-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for part in parts:
+                f.write(part)
+            f.flush()
+            st = os.fstat(f.fileno())
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return tmp, st
+
+def readAll(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 64 * 1024)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+def writeAll(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
 
 class MyDB:
 
-    def __init__(self, filename):
+    def __init__(self, filename, cache=True, writeBack=False, flushInterval=None):
         self.fname = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        # With cache, the strings on disk are kept in memory together with the
+        # signature of the file they were read from. The file is only ever
+        # appended to in place or replaced whole, so a grown file is caught up
+        # by reading just the new records.
+        self.cache = cache
+        self.strings = None
+        self.storedEnd = 0
+        self.signature = None
+        # With writeBack, saveString only queues the string; it reaches the file
+        # on flush(), close() or after flushInterval seconds. saveStrings
+        # replaces the contents, so anything still queued is dropped.
+        self.writeBack = writeBack
+        self.flushInterval = flushInterval
+        self.pending = []
+        self.timer = None
+        self.lock = threading.RLock()
+        self.map = None
+        self.mapIdentity = None
+        self.resetIndex()
         if not os.path.isfile(self.fname):
-            self.saveStrings([])
+            self.create()
+        self.migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def loadStrings(self):
+        with self.lock:
+            if not self.cache:
+                with open(self.fname, 'rb') as f:
+                    data = f.read()
+                return decodeStore(data)[0] + self.pending
+            self.revalidate()
+            return self.strings + self.pending
+
+    def revalidate(self):
+        st = os.stat(self.fname)
+        if fileSignature(st) == self.signature:
+            return
+        if self.strings is None or (st.st_dev, st.st_ino) != self.signature[:2] or st.st_size < self.storedEnd:
+            self.reload()
+            return
+        with open(self.fname, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != self.signature[:2]:
+                self.reload()
+                return
+            f.seek(self.storedEnd)
+            data = f.read()
+        for start, end in recordSpans(data, 0):
+            self.strings.append(str(data[start:end], 'utf-8'))
+            self.storedEnd += LENGTH.size + end - start
+        self.signature = fileSignature(st)
+
+    def reload(self):
+        with open(self.fname, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        self.strings, self.storedEnd = decodeStore(data)
+        self.signature = fileSignature(st)
+
+    def cached(self):
+        # Serves random access from memory once the strings have been loaded
+        if self.strings is None:
+            self.flush()
+            return False
+        self.revalidate()
+        return True
+
+    def iterStrings(self):
+        with self.lock:
+            if self.cached():
+                return iter(self.strings + self.pending)
+        return self.streamStrings()
+
+    def streamStrings(self):
         with open(self.fname, 'rb') as f:
-            arr = pickle.load(f)
-        return arr
+            yield from streamFile(f)
+
+    def __iter__(self):
+        return self.iterStrings()
+
+    def __len__(self):
+        with self.lock:
+            if self.cached():
+                return len(self.strings) + len(self.pending)
+            self.refreshIndex()
+            return self.snapshotCount + len(self.tailIndex)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self.get(key)
+        with self.lock:
+            if self.cached():
+                return (self.strings + self.pending)[key] if self.pending else self.strings[key]
+            self.refreshIndex()
+            count = self.snapshotCount + len(self.tailIndex)
+            return [self.readRecord(i) for i in range(*key.indices(count))]
+
+    def get(self, i):
+        with self.lock:
+            if self.cached():
+                stored = len(self.strings)
+                count = stored + len(self.pending)
+            else:
+                self.refreshIndex()
+                count = self.snapshotCount + len(self.tailIndex)
+            if i < 0:
+                i += count
+            if not 0 <= i < count:
+                raise IndexError('MyDB index out of range')
+            if self.strings is None:
+                return self.readRecord(i)
+            return self.strings[i] if i < stored else self.pending[i - stored]
+
+    def readRecord(self, i):
+        if i < self.snapshotCount:
+            start, end = self.span.unpack_from(self.map, HEADER.size + self.span.size // 2 * i)
+            return str(self.map[self.blobStart + start:self.blobStart + end - 1], 'utf-8')
+        start = self.tailIndex[i - self.snapshotCount]
+        (length,) = LENGTH.unpack_from(self.map, start)
+        start += LENGTH.size
+        return str(self.map[start:start + length], 'utf-8')
+
+    def refreshIndex(self):
+        # The snapshot is indexed by its own offsets array; only tail records
+        # need scanning, and that index is extended incrementally as the file grows
+        st = os.stat(self.fname)
+        if self.map is not None and (st.st_dev, st.st_ino) == self.mapIdentity and st.st_size == len(self.map):
+            return
+        with open(self.fname, 'rb') as f:
+            st = os.fstat(f.fileno())
+            identity = (st.st_dev, st.st_ino)
+            if identity != self.mapIdentity or st.st_size < (self.indexedEnd or 0):
+                self.closeMap()
+                self.mapIdentity = identity
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.indexedEnd is None:
+            self.snapshotCount, self.blobStart, self.indexedEnd, flags = readHeader(self.map)
+            self.span = SPANS[offsetWidth(flags)]
+        for start, end in recordSpans(self.map, self.indexedEnd):
+            self.tailIndex.append(start - LENGTH.size)
+            self.indexedEnd = end
+
+    def resetIndex(self):
+        self.snapshotCount = 0
+        self.blobStart = 0
+        self.span = SPANS[4]
+        self.tailIndex = array('Q')
+        self.indexedEnd = None
+
+    def closeMap(self):
+        if self.map is not None:
+            self.map.close()
+        self.map = None
+        self.mapIdentity = None
+        self.resetIndex()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.closeMap()
+
+    def install(self, tmp, st, arr):
+        # Call with the lock held; readers see either the old file or the new one
+        try:
+            os.replace(tmp, self.fname)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if self.cache:
+            self.strings = list(arr)
+            self.storedEnd = st.st_size
+            self.signature = fileSignature(st)
+
+    def create(self):
+        # Linking a finished file into place cannot clobber one another process just created
+        tmp, st = writeTempFile(self.directory, encodeSnapshot([]))
+        try:
+            os.link(tmp, self.fname)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
 
     def saveStrings(self, arr):
-        with open(self.fname, 'wb') as f:
-            pickle.dump(arr, f)
+        with self.lock:
+            self.cancelFlush()
+            self.pending = []
+            tmp, st = writeTempFile(self.directory, encodeSnapshot(arr))
+            with lockedFile(self.fname):
+                self.install(tmp, st, arr)
+
+    def saveString(self, s):
+        record = encodeRecord(s)
+        with self.lock:
+            if not self.writeBack:
+                self.appendRecords([s], record)
+                return
+            self.pending.append(s)
+            if self.flushInterval is not None and self.timer is None:
+                self.timer = threading.Timer(self.flushInterval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.cancelFlush()
+            if self.pending:
+                pending, self.pending = self.pending, []
+                self.appendRecords(pending, b''.join(map(encodeRecord, pending)))
+
+    def cancelFlush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def appendRecords(self, strings, data):
+        with lockedFile(self.fname) as fd:
+            # No writer can be mid-append while we hold the lock, so bytes past the
+            # last complete record were left by one that died; drop them, or they
+            # would swallow this record
+            validEnd = self.validEnd()
+            if os.fstat(fd).st_size > validEnd:
+                os.ftruncate(fd, validEnd)
+            writeAll(fd, data)
+            after = os.fstat(fd)
+        if self.strings is not None:
+            self.strings.extend(strings)
+            self.storedEnd = after.st_size
+            self.signature = fileSignature(after)
+
+    def validEnd(self):
+        if self.strings is not None:
+            self.revalidate()
+            return self.storedEnd
+        self.refreshIndex()
+        return self.indexedEnd
+
+    def migrate(self):
+        # One-time conversion of stores written by earlier releases
+        with open(self.fname, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic == MAGIC:
+                return
+            if magic == SEGMENTS_MAGIC:
+                raise ValueError(f'{self.fname} is a segment manifest; open it with SegmentedMyDB')
+        with self.lock, lockedFile(self.fname):
+            with open(self.fname, 'rb') as f:
+                magic = f.read(len(MAGIC))
+                if magic == MAGIC:
+                    return
+                f.seek(0)
+                if magic == LOG_MAGIC:
+                    arr = list(iterRecords(f.read(), len(LOG_MAGIC)))
+                else:
+                    arr = StringUnpickler(f).load()
+            tmp, st = writeTempFile(self.directory, encodeSnapshot(arr))
+            self.install(tmp, st, arr)
+
+class SegmentedMyDB:
+
+    def __init__(self, filename, segmentBytes=64 * 1024 * 1024, compactInterval=None, cache=True):
+        # filename holds the manifest; the strings live in MyDB segment files
+        # next to it. Appends go to the last segment, and a new one is started
+        # once it reaches segmentBytes. Earlier segments are sealed: they only
+        # change when compaction rewrites them.
+        self.fname = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.segmentBytes = segmentBytes
+        self.cache = cache
+        self.segments = {}
+        self.names = []
+        self.nextNumber = 1
+        self.manifestSignature = None
+        self.lock = threading.RLock()
+        if not os.path.isfile(self.fname):
+            self.create()
+        self.stopping = threading.Event()
+        self.compactor = None
+        if compactInterval is not None:
+            self.compactor = threading.Thread(target=self.compactLoop, args=(compactInterval,),
+                                              name='mydb-compactor', daemon=True)
+            self.compactor.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def segmentName(self, number):
+        return f'{os.path.basename(self.fname)}.{number:06d}'
+
+    def segmentPath(self, name):
+        return os.path.join(self.directory, name)
+
+    def create(self):
+        name = self.segmentName(1)
+        MyDB(self.segmentPath(name)).close()
+        tmp, st = writeTempFile(self.directory, [encodeManifest([name], 2)])
+        try:
+            os.link(tmp, self.fname)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+
+    def manifest(self, fd):
+        st = os.fstat(fd)
+        if fileSignature(st) != self.manifestSignature:
+            self.names, self.nextNumber = decodeManifest(readAll(fd))
+            self.manifestSignature = fileSignature(st)
+            for name in list(self.segments):
+                if name not in self.names:
+                    self.segments.pop(name).close()
+        return self.names, self.nextNumber
+
+    def writeManifest(self, names, nextNumber):
+        # Call with the exclusive manifest lock held
+        tmp, st = writeTempFile(self.directory, [encodeManifest(names, nextNumber)])
+        os.replace(tmp, self.fname)
+
+    def segment(self, name):
+        db = self.segments.get(name)
+        if db is None:
+            db = self.segments[name] = MyDB(self.segmentPath(name), cache=self.cache)
+        return db
+
+    @contextmanager
+    def reading(self):
+        # Segments are only deleted under the exclusive manifest lock, so every
+        # segment named in the manifest exists while this is held
+        with self.lock, lockedFile(self.fname, exclusive=False) as fd:
+            yield [self.segment(name) for name in self.manifest(fd)[0]]
+
+    def loadStrings(self):
+        with self.reading() as segments:
+            arr = []
+            for db in segments:
+                arr.extend(db.loadStrings())
+            return arr
+
+    def iterStrings(self):
+        with self.reading() as segments:
+            files = [open(db.fname, 'rb') for db in segments]
+        return self.streamFiles(files)
+
+    def streamFiles(self, files):
+        try:
+            for f in files:
+                yield from streamFile(f)
+        finally:
+            for f in files:
+                f.close()
+
+    def __iter__(self):
+        return self.iterStrings()
+
+    def __len__(self):
+        with self.reading() as segments:
+            return sum(len(db) for db in segments)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self.get(key)
+        with self.reading() as segments:
+            starts = self.segmentStarts(segments)
+            return [self.readAt(segments, starts, i) for i in range(*key.indices(starts[-1]))]
+
+    def get(self, i):
+        with self.reading() as segments:
+            starts = self.segmentStarts(segments)
+            if i < 0:
+                i += starts[-1]
+            if not 0 <= i < starts[-1]:
+                raise IndexError('MyDB index out of range')
+            return self.readAt(segments, starts, i)
+
+    def segmentStarts(self, segments):
+        return list(accumulate((len(db) for db in segments), initial=0))
+
+    def readAt(self, segments, starts, i):
+        n = bisect_right(starts, i) - 1
+        return segments[n].get(i - starts[n])
 
     def saveString(self, s):
-        arr = self.loadStrings()
-        arr.append(s)
-        self.saveStrings(arr)
+        with self.reading() as segments:
+            tail = segments[-1]
+            tail.saveString(s)
+            full = os.path.getsize(tail.fname) >= self.segmentBytes
+        if full:
+            self.rollOver(os.path.basename(tail.fname))
+
+    def rollOver(self, tailName):
+        with self.lock, lockedFile(self.fname) as fd:
+            names, nextNumber = self.manifest(fd)
+            if names[-1] != tailName:
+                return
+            name = self.segmentName(nextNumber)
+            MyDB(self.segmentPath(name)).close()
+            self.writeManifest(names + [name], nextNumber + 1)
+
+    def saveStrings(self, arr):
+        # Segment files are written before the manifest lock is taken; only the
+        # swap and the removal of the old segments happen under it
+        files = [writeTempFile(self.directory, encodeSnapshot(chunk))[0] for chunk in self.chunks(arr)]
+        with self.lock, lockedFile(self.fname) as fd:
+            old, nextNumber = self.manifest(fd)
+            names = []
+            for tmp in files:
+                names.append(self.segmentName(nextNumber))
+                os.replace(tmp, self.segmentPath(names[-1]))
+                nextNumber += 1
+            self.writeManifest(names, nextNumber)
+            for name in old:
+                os.unlink(self.segmentPath(name))
+
+    def chunks(self, arr):
+        chunk = []
+        size = 0
+        for s in arr:
+            length = len(s.encode('utf-8')) + 5
+            if chunk and size + length > self.segmentBytes:
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(s)
+            size += length
+        yield chunk
+
+    def compact(self):
+        # Merges runs of small sealed segments and rewrites sealed segments that
+        # still hold appended records, so they load through the fast snapshot path.
+        # Sealed segments never change, so the new files are written under the
+        # shared lock; only the manifest swap needs the exclusive one.
+        with lockedFile(self.fname, exclusive=False) as fd:
+            names, nextNumber = decodeManifest(readAll(fd))
+            merged = []
+            for run in self.compactionRuns(names[:-1]):
+                arr = []
+                for name in run:
+                    arr.extend(readStore(self.segmentPath(name)))
+                merged.append((run, writeTempFile(self.directory, encodeSnapshot(arr))[0]))
+        if not merged:
+            return 0
+        replaced = []
+        with self.lock, lockedFile(self.fname) as fd:
+            names, nextNumber = self.manifest(fd)
+            for run, tmp in merged:
+                start = names.index(run[0]) if run[0] in names else -1
+                if start < 0 or names[start:start + len(run)] != run:
+                    # Another process compacted or rewrote these segments first
+                    os.unlink(tmp)
+                    continue
+                name = self.segmentName(nextNumber)
+                nextNumber += 1
+                os.replace(tmp, self.segmentPath(name))
+                names = names[:start] + [name] + names[start + len(run):]
+                replaced.extend(run)
+            if replaced:
+                self.writeManifest(names, nextNumber)
+            for name in replaced:
+                os.unlink(self.segmentPath(name))
+        return len(replaced)
+
+    def compactionRuns(self, sealed):
+        runs = []
+        run = []
+        size = 0
+        for name in sealed:
+            segmentSize = os.path.getsize(self.segmentPath(name))
+            if run and size + segmentSize > self.segmentBytes:
+                runs.append(run)
+                run = []
+                size = 0
+            run.append(name)
+            size += segmentSize
+        if run:
+            runs.append(run)
+        return [run for run in runs if len(run) > 1 or hasTail(self.segmentPath(run[0]))]
+
+    def compactLoop(self, interval):
+        while not self.stopping.wait(interval):
+            try:
+                self.compact()
+            except OSError:
+                traceback.print_exc()
+
+    def flush(self):
+        with self.lock:
+            for db in self.segments.values():
+                db.flush()
+
+    def close(self):
+        self.stopping.set()
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.lock:
+            for db in self.segments.values():
+                db.close()
+            self.segments.clear()
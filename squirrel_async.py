@@ -0,0 +1,161 @@
+import asyncio
+import io
+import sys
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from squirrel_metrics import HTTP_CONNECTIONS
+from squirrel_server import SquirrelServerHandler, configureServer
+
+class TransportWriter(io.RawIOBase):
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        # Called from an executor thread: wait for the transport to drain so a
+        # large response is paced by the client instead of piling up in memory.
+        asyncio.run_coroutine_threadsafe(self.send(data), self.loop).result()
+        return len(data)
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+class TransportSink:
+
+    # Lets the change feed thread write to a connection the event loop owns.
+    # Writes are queued on the loop without waiting; a client that lets too
+    # much pile up is dropped instead of stalling every other subscriber.
+    maxBuffered = 1024 * 1024
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.closed = Future()
+
+    def write(self, data):
+        transport = self.writer.transport
+        if transport.is_closing() or transport.get_write_buffer_size() > self.maxBuffered:
+            raise ConnectionResetError("change feed subscriber went away or stopped reading")
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    def flush(self):
+        # The event loop sends queued writes by itself
+        return True
+
+    def close(self):
+        self.closed.set_result(None)
+
+class AsyncBridgeHandler(SquirrelServerHandler):
+
+    def __init__(self, rawRequest, client_address, server, wfile, requestsHandled, writer):
+        self.rawRequest = rawRequest
+        self.bridgeWfile = wfile
+        self.previousRequests = requestsHandled
+        self.writer = writer
+        super().__init__(None, client_address, server)
+
+    def setup(self):
+        self.rfile = io.BytesIO(self.rawRequest)
+        self.wfile = self.bridgeWfile
+        self.requestsHandled = self.previousRequests
+        self.close_connection = True
+
+    def handle(self):
+        self.handle_one_request()
+
+    def finish(self):
+        self.wfile.flush()
+
+    def handle_expect_100(self):
+        # The engine already answered the Expect header before reading the body
+        return True
+
+    def parkingSink(self):
+        self.parkedSink = TransportSink(self.server.loop, self.writer)
+        return self.parkedSink
+
+def parseHead(head):
+    length = 0
+    expectContinue = False
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value.strip())
+        elif name == b"expect":
+            expectContinue = value.strip().lower() == b"100-continue"
+    return length, expectContinue
+
+class AsyncSquirrelServer:
+
+    def __init__(self, listen, workers=16, **options):
+        self.server_address = listen
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="squirrel-db")
+        configureServer(self, workers, **options)
+
+    async def serveForever(self):
+        self.loop = asyncio.get_running_loop()
+        host, port = self.server_address
+        server = await asyncio.start_server(self.handleConnection, host, port, backlog=128)
+        async with server:
+            await server.serve_forever()
+
+    async def handleConnection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername")
+        wfile = io.BufferedWriter(TransportWriter(loop, writer), 64 * 1024)
+        requestsHandled = 0
+        HTTP_CONNECTIONS.inc()
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepAliveTimeout)
+                    length, expectContinue = parseHead(head)
+                    if expectContinue and length:
+                        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        ValueError, ConnectionError):
+                    break
+                handler = await loop.run_in_executor(
+                    self.executor, AsyncBridgeHandler, head + body, peer, self, wfile, requestsHandled, writer)
+                requestsHandled += 1
+                if handler.parkedSink is not None:
+                    # A waiting change feed client costs this coroutine and nothing else until the feed lets go
+                    await asyncio.wrap_future(handler.parkedSink.closed)
+                    break
+                if handler.close_connection:
+                    break
+        except Exception:
+            self.handle_error(peer)
+        finally:
+            HTTP_CONNECTIONS.dec()
+            writer.close()
+
+    def handle_error(self, client_address):
+        print("-" * 40, file=sys.stderr)
+        print(f"Exception occurred during processing of request from {client_address}", file=sys.stderr)
+        traceback.print_exc()
+        print("-" * 40, file=sys.stderr)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.changes.close()
+        self.pool.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+def runAsync(listen, workers=16, **options):
+    server = AsyncSquirrelServer(listen, workers=workers, **options)
+    try:
+        asyncio.run(server.serveForever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,333 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+# Load generator for squirrel_server. Starts a server on a scratch copy of the
+# empty database (or targets a running one with --no-start), drives a weighted
+# mix of requests from --concurrency keep-alive connections and prints
+# throughput and latency percentiles as JSON.
+#
+#   python squirrel_bench.py run --duration 10 --concurrency 32 --output before.json
+#   python squirrel_bench.py run --server-args "--mode asyncio" --output after.json
+#   python squirrel_bench.py compare before.json after.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DB = os.path.join(HERE, "empty_squirrel_db.db")
+DEFAULT_MIX = "get=60,list=10,post=10,put=10,delete=10"
+OPERATIONS = ("get", "list", "post", "put", "delete")
+SIZES = ("small", "medium", "large")
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+def parseMix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight for {name!r} must be a number")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return None
+    rank = max(0, min(len(sortedValues) - 1, int(round(fraction * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[rank]
+
+def summarize(latencies, seconds):
+    values = sorted(latencies)
+    toMs = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "requests": len(values),
+        "throughput": round(len(values) / seconds, 1) if seconds else None,
+        "mean_ms": toMs(sum(values) / len(values)) if values else None,
+        "p50_ms": toMs(percentile(values, 0.50)),
+        "p95_ms": toMs(percentile(values, 0.95)),
+        "p99_ms": toMs(percentile(values, 0.99)),
+        "max_ms": toMs(values[-1]) if values else None,
+    }
+
+class ServerProcess:
+
+    def __init__(self, port, serverArgs):
+        self.port = port
+        self.directory = tempfile.mkdtemp(prefix="squirrel-bench-")
+        shutil.copyfile(TEMPLATE_DB, os.path.join(self.directory, "squirrel_db.db"))
+        # The server logs every request; a pipe nobody reads would fill up and stall it
+        self.log = open(os.path.join(self.directory, "server.log"), "w+b")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "squirrel_server.py"), "--port", str(port), *serverArgs],
+            cwd=self.directory, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def waitUntilReady(self, host, timeout=15.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f"squirrel_server exited early:\n{self.log.read().decode(errors='replace')}")
+            try:
+                conn = http.client.HTTPConnection(host, self.port, timeout=1)
+                conn.request("GET", "/healthz")
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+            except OSError:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f"squirrel_server did not answer within {timeout} s")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class Workload:
+
+    def __init__(self, mix, seed):
+        self.operations = [name for name in mix if mix[name] > 0]
+        self.weights = [mix[name] for name in self.operations]
+        self.random = random.Random(seed)
+        self.ids = []
+        self.lock = threading.Lock()
+
+    def pick(self, rng):
+        return rng.choices(self.operations, self.weights)[0]
+
+    def anyId(self, rng):
+        with self.lock:
+            return rng.choice(self.ids) if self.ids else 0
+
+    def takeId(self, rng):
+        with self.lock:
+            if not self.ids:
+                return 0
+            i = rng.randrange(len(self.ids))
+            self.ids[i], self.ids[-1] = self.ids[-1], self.ids[i]
+            return self.ids.pop()
+
+    def addId(self, squirrelId):
+        with self.lock:
+            self.ids.append(squirrelId)
+
+    def request(self, operation, rng):
+        body = urlencode({"name": f"Bench{rng.randrange(1 << 30)}", "size": rng.choice(SIZES)})
+        if operation == "get":
+            return "GET", f"/squirrels/{self.anyId(rng)}", None, {}
+        if operation == "list":
+            return "GET", "/squirrels?limit=50", None, {}
+        if operation == "post":
+            return "POST", "/squirrels", body, FORM
+        if operation == "put":
+            return "PUT", f"/squirrels/{self.anyId(rng)}", body, FORM
+        return "DELETE", f"/squirrels/{self.takeId(rng)}", None, {}
+
+def seedRows(host, port, count):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    ids = []
+    for start in range(0, count, 1000):
+        items = [{"name": f"Seed{i}", "size": SIZES[i % len(SIZES)]} for i in range(start, min(count, start + 1000))]
+        conn.request("POST", "/squirrels/bulk", json.dumps(items), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        results = json.loads(response.read())["results"]
+        ids.extend(result["id"] for result in results if result["status"] == 201)
+    conn.close()
+    return ids
+
+def worker(host, port, workload, seed, warmupEnd, stopAt, results):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    latencies = {name: [] for name in OPERATIONS}
+    statuses = {}
+    errors = 0
+    # Requests sent before stopAt that were still in flight when it passed
+    pending = 0
+    while True:
+        start = time.perf_counter()
+        if start >= stopAt:
+            break
+        operation = workload.pick(rng)
+        method, path, body, headers = workload.request(operation, rng)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            payload = response.read()
+            done = time.perf_counter()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        if operation == "post" and response.status == 201:
+            location = response.getheader("Location")
+            if location:
+                workload.addId(int(location.rsplit("/", 1)[1]))
+        # A request counts in the window it completes in, so slow requests
+        # started during warmup are not credited to the measured seconds
+        if done < warmupEnd:
+            continue
+        if done >= stopAt:
+            pending += 1
+            continue
+        latencies[operation].append(done - start)
+        key = f"{operation} {response.status}"
+        statuses[key] = statuses.get(key, 0) + 1
+        if response.status >= 500:
+            errors += 1
+    conn.close()
+    results.append((latencies, statuses, errors, pending))
+
+def runLoad(host, port, mix, concurrency, duration, warmup, seedCount, seed):
+    workload = Workload(mix, seed)
+    for squirrelId in seedRows(host, port, seedCount):
+        workload.addId(squirrelId)
+    results = []
+    start = time.perf_counter()
+    warmupEnd = start + warmup
+    stopAt = warmupEnd + duration
+    threads = [threading.Thread(target=worker, args=(host, port, workload, seed + n + 1, warmupEnd, stopAt, results))
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    allLatencies = []
+    statuses = {}
+    errors = 0
+    pending = 0
+    operations = {}
+    for name in OPERATIONS:
+        values = [value for latencies, _, _, _ in results for value in latencies[name]]
+        if values:
+            operations[name] = summarize(values, duration)
+            allLatencies.extend(values)
+    for _, workerStatuses, workerErrors, workerPending in results:
+        errors += workerErrors
+        pending += workerPending
+        for key, count in workerStatuses.items():
+            statuses[key] = statuses.get(key, 0) + count
+    # A server that starves some connections shows up as a low minimum here
+    perConnection = sorted(sum(map(len, latencies.values())) for latencies, _, _, _ in results)
+    return {
+        "overall": summarize(allLatencies, duration),
+        "operations": operations,
+        "statuses": dict(sorted(statuses.items())),
+        "errors": errors,
+        "pending_at_stop": pending,
+        "per_connection": {
+            "min_requests": perConnection[0] if perConnection else None,
+            "max_requests": perConnection[-1] if perConnection else None,
+        },
+        "seconds": round(duration, 3),
+    }
+
+def run(args):
+    server = None
+    if not args.no_start:
+        server = ServerProcess(args.port, args.server_args.split())
+    try:
+        if server is not None:
+            server.waitUntilReady(args.host)
+        result = runLoad(args.host, args.port, args.mix, args.concurrency, args.duration,
+                         args.warmup, args.seed_rows, args.seed)
+    finally:
+        if server is not None:
+            server.stop()
+    report = {
+        "config": {
+            "server_args": None if args.no_start else args.server_args,
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed_rows": args.seed_rows,
+            "seed": args.seed,
+        },
+        **result,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+def change(before, after):
+    if before is None or after is None or before == 0:
+        return None
+    return round((after - before) / before * 100, 1)
+
+def compareSummaries(before, after):
+    return {
+        key: {"before": before.get(key), "after": after.get(key), "change_pct": change(before.get(key), after.get(key))}
+        for key in ("throughput", "p50_ms", "p95_ms", "p99_ms")
+    }
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    operations = sorted(set(before["operations"]) & set(after["operations"]))
+    report = {
+        "before": before["config"],
+        "after": after["config"],
+        "overall": compareSummaries(before["overall"], after["overall"]),
+        "operations": {name: compareSummaries(before["operations"][name], after["operations"][name])
+                       for name in operations},
+        "errors": {"before": before["errors"], "after": after["errors"]},
+        "min_requests_per_connection": {"before": before["per_connection"]["min_requests"],
+                                        "after": after["per_connection"]["min_requests"]},
+    }
+    print(json.dumps(report, indent=2))
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description="Load test squirrel_server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    runParser = commands.add_parser("run", help="drive load and report throughput and latency")
+    runParser.add_argument("--host", default="127.0.0.1")
+    runParser.add_argument("--port", type=int, default=8089)
+    runParser.add_argument("--no-start", action="store_true",
+                           help="target an already running server instead of starting one")
+    runParser.add_argument("--server-args", default="", help='extra squirrel_server.py arguments, e.g. "--mode asyncio"')
+    runParser.add_argument("--mix", type=parseMix, default=parseMix(DEFAULT_MIX),
+                           help=f"operation weights (default {DEFAULT_MIX})")
+    runParser.add_argument("--concurrency", type=int, default=16, help="concurrent keep-alive connections")
+    runParser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    runParser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before measuring")
+    runParser.add_argument("--seed-rows", type=int, default=1000, help="squirrels created before the run")
+    runParser.add_argument("--seed", type=int, default=1, help="random seed, for reproducible request sequences")
+    runParser.add_argument("--output", help="also write the report to this file")
+    runParser.set_defaults(handler=run)
+
+    compareParser = commands.add_parser("compare", help="compare two reports written by run")
+    compareParser.add_argument("before")
+    compareParser.add_argument("after")
+    compareParser.set_defaults(handler=compare)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    args.handler(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class LRUCache:
+
+    def __init__(self, maxSize=1024, ttl=5.0):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def token(self):
+        # Take a token before reading from the database and hand it to put():
+        # if anything was invalidated in between, the value read may be stale.
+        return self.generation
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, token):
+        with self.lock:
+            if token != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.maxSize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class SquirrelCache:
+
+    def __init__(self, maxSize=1024, ttl=5.0, maxListingRows=10000):
+        self.rows = LRUCache(maxSize, ttl)
+        self.listings = LRUCache(max(1, maxSize // 16), ttl)
+        # Larger full listings are streamed from the database instead of being held in memory
+        self.maxListingRows = maxListingRows
+
+    def rowKey(self, squirrelId):
+        try:
+            return int(squirrelId)
+        except (TypeError, ValueError):
+            return None
+
+    def invalidateRow(self, squirrelId):
+        key = self.rowKey(squirrelId)
+        if key is not None:
+            self.rows.invalidate(key)
+        self.listings.clear()
+
+    def invalidateRows(self, squirrelIds):
+        for squirrelId in squirrelIds:
+            key = self.rowKey(squirrelId)
+            if key is not None:
+                self.rows.invalidate(key)
+        self.listings.clear()
+
+    def clear(self):
+        self.rows.clear()
+        self.listings.clear()
+
+    def stats(self):
+        return {"rows": self.rows.stats(), "listings": self.listings.stats()}
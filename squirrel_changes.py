@@ -0,0 +1,222 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from squirrel_db import PoolTimeout
+from squirrel_metrics import CHANGE_SUBSCRIBERS
+
+# Waiting clients of GET /squirrels/changes. A request with nothing new to
+# report hands its connection to the hub and returns, so an idle subscriber
+# holds a socket and a small object instead of a worker thread. One hub thread
+# checks the change log for all of them and writes each one what it has not
+# seen: long-poll clients get one JSON body and are closed, event-stream
+# clients get one event per change and stay.
+
+SSE_TYPE = "text/event-stream"
+# A subscriber whose socket takes none of its backlog for this long is dropped
+WRITE_TIMEOUT = 5.0
+
+def changesBody(changes, since):
+    lastSeq = changes[-1]["seq"] if changes else since
+    return bytes(json.dumps({"changes": changes, "last_seq": lastSeq}), "utf-8")
+
+def sseEvents(changes):
+    # The event id is the sequence number, which EventSource sends back as Last-Event-ID on reconnect
+    return bytes("".join(f"id: {change['seq']}\ndata: {json.dumps(change)}\n\n" for change in changes), "utf-8")
+
+class Subscriber:
+
+    __slots__ = ("sink", "since", "deadline", "lastWrite")
+
+    def __init__(self, sink, since, deadline):
+        self.sink = sink
+        self.since = since
+        # None for an event stream, which stays until the client goes away
+        self.deadline = deadline
+        self.lastWrite = time.monotonic()
+
+    @property
+    def mode(self):
+        return "sse" if self.deadline is None else "longpoll"
+
+class SocketSink:
+
+    # Writes without blocking, so a client that stops reading cannot hold up the
+    # hub thread and every other subscriber with it. What the socket does not
+    # take waits in a backlog that later rounds send; a client that lets too
+    # much pile up is dropped, as TransportSink does for the asyncio engine.
+    maxBuffered = 1024 * 1024
+
+    def __init__(self, hub, sock):
+        self.hub = hub
+        self.sock = sock
+        self.backlog = bytearray()
+        self.lastProgress = time.monotonic()
+        sock.setblocking(False)
+
+    def write(self, data):
+        if not self.backlog:
+            self.lastProgress = time.monotonic()
+        self.backlog += data
+        self.flush()
+        if len(self.backlog) > self.maxBuffered:
+            self.backlog.clear()
+            raise ConnectionResetError("change feed subscriber stopped reading")
+
+    def flush(self):
+        # Returns True once everything written so far has been sent
+        while self.backlog:
+            try:
+                sent = self.sock.send(self.backlog)
+            except BlockingIOError:
+                if time.monotonic() - self.lastProgress > WRITE_TIMEOUT:
+                    self.backlog.clear()
+                    raise ConnectionResetError("change feed subscriber stopped reading")
+                break
+            except OSError:
+                self.backlog.clear()
+                raise
+            del self.backlog[:sent]
+            self.lastProgress = time.monotonic()
+        return not self.backlog
+
+    def close(self):
+        with self.hub.condition:
+            if self.backlog and not self.hub.closed:
+                # The rest of a long-poll answer; the hub sends it before closing the socket
+                self.hub.draining.add(self)
+                self.hub.condition.notify()
+                return
+        self.release()
+
+    def release(self):
+        with self.hub.condition:
+            self.hub.sockets.discard(self.sock)
+            self.hub.draining.discard(self)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class ChangeHub:
+
+    def __init__(self, pool, pollInterval=0.25, heartbeat=15.0, batchSize=1000):
+        self.pool = pool
+        # Writes made by this process wake the hub at once; the poll catches
+        # the ones other processes make
+        self.pollInterval = pollInterval
+        self.heartbeat = heartbeat
+        self.batchSize = batchSize
+        self.subscribers = set()
+        self.sockets = set()
+        # Sinks of finished subscribers with bytes still to send
+        self.draining = set()
+        self.condition = threading.Condition()
+        self.wake = False
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="squirrel-changes", daemon=True)
+        self.thread.start()
+
+    def socketSink(self, sock):
+        with self.condition:
+            self.sockets.add(sock)
+        return SocketSink(self, sock)
+
+    def isParked(self, sock):
+        with self.condition:
+            return sock in self.sockets
+
+    def subscribe(self, sink, since, timeout=None):
+        subscriber = Subscriber(sink, since, None if timeout is None else time.monotonic() + timeout)
+        CHANGE_SUBSCRIBERS.inc(subscriber.mode)
+        with self.condition:
+            self.subscribers.add(subscriber)
+            # Catches a write that landed between the request's own read and now
+            self.wake = True
+            self.condition.notify()
+        return subscriber
+
+    def notify(self):
+        with self.condition:
+            if self.subscribers:
+                self.wake = True
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.subscribers and not self.draining and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    break
+                if not self.wake:
+                    self.condition.wait(self.pollInterval)
+                self.wake = False
+                subscribers = list(self.subscribers)
+                draining = list(self.draining)
+            for sink in draining:
+                try:
+                    done = sink.flush()
+                except OSError:
+                    done = True
+                if done:
+                    sink.release()
+            if subscribers and self.deliver(subscribers):
+                with self.condition:
+                    self.wake = True
+        for subscriber in list(self.subscribers):
+            self.drop(subscriber)
+        for sink in list(self.draining):
+            sink.release()
+
+    def deliver(self, subscribers):
+        # Returns True when the log had more than one batch to hand out
+        try:
+            with self.pool.connection() as db:
+                changes, latest, floor = db.getChanges(min(s.since for s in subscribers), self.batchSize)
+        except (PoolTimeout, sqlite3.Error):
+            return False
+        now = time.monotonic()
+        seqs = [change["seq"] for change in changes]
+        for subscriber in subscribers:
+            if not floor <= subscriber.since <= latest:
+                # The log moved past this client or the database was replaced: it has to start over
+                self.drop(subscriber)
+                continue
+            pending = changes[bisect_right(seqs, subscriber.since):]
+            try:
+                # Sends what an earlier round left in the backlog
+                subscriber.sink.flush()
+                if subscriber.deadline is None:
+                    if pending:
+                        subscriber.sink.write(sseEvents(pending))
+                        subscriber.since = pending[-1]["seq"]
+                    elif now - subscriber.lastWrite >= self.heartbeat:
+                        # Keeps proxies from timing the stream out and finds clients that went away
+                        subscriber.sink.write(b": keepalive\n\n")
+                    else:
+                        continue
+                    subscriber.lastWrite = now
+                elif pending or now >= subscriber.deadline:
+                    subscriber.sink.write(changesBody(pending, subscriber.since))
+                    self.drop(subscriber)
+            except OSError:
+                self.drop(subscriber)
+        return len(changes) == self.batchSize
+
+    def drop(self, subscriber):
+        with self.condition:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.remove(subscriber)
+        CHANGE_SUBSCRIBERS.dec(subscriber.mode)
+        subscriber.sink.close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join(timeout=5)
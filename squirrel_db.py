@@ -1,4 +1,166 @@
+import os
+import queue
+import secrets
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from squirrel_cache import MISSING
+from squirrel_metrics import DB_POOL_WAIT_SECONDS, DB_QUERY_SECONDS
+from squirrel_trace import currentTrace
+
+DB_PATH = "squirrel_db.db"
+
+SQUIRRELS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS squirrels (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    size TEXT NOT NULL
+);
+"""
+
+# Triggers keep a table-wide version counter in squirrel_meta and stamp each
+# row with the counter value of its last write, so every writer (any process,
+# even the sqlite3 shell) moves the versions that ETags are derived from.
+VERSIONING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS squirrel_meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS squirrel_versions (
+    squirrel_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO squirrel_meta (key, value) VALUES ('version', 0);
+CREATE TRIGGER IF NOT EXISTS squirrels_version_insert AFTER INSERT ON squirrels BEGIN
+    UPDATE squirrel_meta SET value = value + 1 WHERE key = 'version';
+    INSERT OR REPLACE INTO squirrel_versions (squirrel_id, version)
+        SELECT NEW.id, value FROM squirrel_meta WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS squirrels_version_update AFTER UPDATE ON squirrels BEGIN
+    UPDATE squirrel_meta SET value = value + 1 WHERE key = 'version';
+    DELETE FROM squirrel_versions WHERE squirrel_id = OLD.id;
+    INSERT OR REPLACE INTO squirrel_versions (squirrel_id, version)
+        SELECT NEW.id, value FROM squirrel_meta WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS squirrels_version_delete AFTER DELETE ON squirrels BEGIN
+    UPDATE squirrel_meta SET value = value + 1 WHERE key = 'version';
+    DELETE FROM squirrel_versions WHERE squirrel_id = OLD.id;
+END;
+"""
+# Connection-level SQLite settings. WAL lets readers run alongside a writer and
+# turns each commit into an append to the log; synchronous=NORMAL only fsyncs at
+# checkpoints, which in WAL mode can lose the last commits on power loss but
+# never corrupts the database.
+PROFILES = {
+    "default": {},
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64 * 1024,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+PRAGMAS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store", "wal_autocheckpoint")
+
+def resolveProfile(name, overrides=None):
+    if name not in PROFILES:
+        raise ValueError(f"unknown SQLite profile: {name}")
+    profile = dict(PROFILES[name])
+    for key, value in (overrides or {}).items():
+        if key not in PRAGMAS:
+            raise ValueError(f"unsupported SQLite pragma: {key}")
+        if not str(value).lstrip("-").isalnum():
+            raise ValueError(f"invalid value for {key}: {value}")
+        profile[key] = value
+    return profile
+
+def describeProfile(name, profile):
+    settings = ", ".join(f"{key}={value}" for key, value in profile.items())
+    return f"{name} ({settings or 'SQLite defaults'})"
+
+SELECT_TABLE_VERSION = "SELECT value FROM squirrel_meta WHERE key = 'version'"
+SELECT_SQUIRREL = """
+    SELECT squirrels.*, squirrel_versions.version AS _version FROM squirrels
+    LEFT JOIN squirrel_versions ON squirrel_versions.squirrel_id = squirrels.id
+    WHERE squirrels.id = ?
+"""
+
+SELECT_CHANGES = "SELECT seq, op, squirrel_id, name, size FROM squirrel_changes WHERE seq > ? ORDER BY seq LIMIT ?"
+SELECT_OLDEST_CHANGE = "SELECT MIN(seq) AS seq FROM squirrel_changes"
+
+WRITE_STATEMENTS = {
+    "create": "INSERT INTO squirrels (name, size) VALUES (?, ?)",
+    "update": "UPDATE squirrels SET name = ?, size = ? WHERE id = ?",
+    "delete": "DELETE FROM squirrels WHERE id = ?",
+}
+
+# An index keeps its entries ordered by (column, rowid), so an equality filter
+# reads matching rows already in id order and can seek straight past after_id.
+INDEX_SCHEMA = """
+CREATE INDEX IF NOT EXISTS squirrels_name_index ON squirrels (name);
+CREATE INDEX IF NOT EXISTS squirrels_size_index ON squirrels (size);
+"""
+
+# Every write is also logged in squirrel_changes, numbered by the table version it
+# produced, so GET /squirrels/changes can replay what happened after any version
+# the log still covers. The version triggers are replaced rather than joined by
+# new ones because SQLite does not promise an order between triggers.
+CHANGE_LOG_SIZE = 100000
+CHANGES_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS squirrel_changes (
+    seq INTEGER PRIMARY KEY,
+    op TEXT NOT NULL,
+    squirrel_id INTEGER NOT NULL,
+    name TEXT,
+    size TEXT
+);
+DROP TRIGGER IF EXISTS squirrels_version_insert;
+DROP TRIGGER IF EXISTS squirrels_version_update;
+DROP TRIGGER IF EXISTS squirrels_version_delete;
+CREATE TRIGGER squirrels_version_insert AFTER INSERT ON squirrels BEGIN
+    UPDATE squirrel_meta SET value = value + 1 WHERE key = 'version';
+    INSERT OR REPLACE INTO squirrel_versions (squirrel_id, version)
+        SELECT NEW.id, value FROM squirrel_meta WHERE key = 'version';
+    INSERT INTO squirrel_changes (seq, op, squirrel_id, name, size)
+        SELECT value, 'create', NEW.id, NEW.name, NEW.size FROM squirrel_meta WHERE key = 'version';
+END;
+CREATE TRIGGER squirrels_version_update AFTER UPDATE ON squirrels BEGIN
+    UPDATE squirrel_meta SET value = value + 1 WHERE key = 'version';
+    DELETE FROM squirrel_versions WHERE squirrel_id = OLD.id;
+    INSERT OR REPLACE INTO squirrel_versions (squirrel_id, version)
+        SELECT NEW.id, value FROM squirrel_meta WHERE key = 'version';
+    INSERT INTO squirrel_changes (seq, op, squirrel_id, name, size)
+        SELECT value, 'update', NEW.id, NEW.name, NEW.size FROM squirrel_meta WHERE key = 'version';
+END;
+CREATE TRIGGER squirrels_version_delete AFTER DELETE ON squirrels BEGIN
+    UPDATE squirrel_meta SET value = value + 1 WHERE key = 'version';
+    DELETE FROM squirrel_versions WHERE squirrel_id = OLD.id;
+    INSERT INTO squirrel_changes (seq, op, squirrel_id)
+        SELECT value, 'delete', OLD.id FROM squirrel_meta WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS squirrel_changes_prune AFTER INSERT ON squirrel_changes BEGIN
+    DELETE FROM squirrel_changes WHERE seq <= NEW.seq - {CHANGE_LOG_SIZE};
+END;
+"""
+
+# Applied in order; PRAGMA user_version records how many have run. Each one
+# must be idempotent: databases made before versioning (or by hand) start at
+# 0 with some of the objects already there, and two processes starting at
+# once may both apply the same step.
+MIGRATIONS = (SQUIRRELS_SCHEMA, INDEX_SCHEMA, VERSIONING_SCHEMA, CHANGES_SCHEMA)
+SCHEMA_VERSION = len(MIGRATIONS)
+FILTERS = ("name", "name_prefix", "size")
+# Listings name their columns so callers asking for tuple rows know what each position holds
+SQUIRREL_COLUMNS = ("id", "name", "size")
+SELECT_COLUMNS = ", ".join(SQUIRREL_COLUMNS)
 
 def dict_factory(cursor, row):
     d = {}
@@ -6,36 +168,626 @@ def dict_factory(cursor, row):
         d[col[0]] = row[idx]
     return d
 
+def tracedDictFactory(cursor, row):
+    trace = currentTrace()
+    if not trace:
+        return dict_factory(cursor, row)
+    trace.enter("rows")
+    try:
+        return dict_factory(cursor, row)
+    finally:
+        trace.exit()
+
+def prefixUpperBound(prefix):
+    # The smallest string above every string that starts with prefix, or None if there is none
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    following = ord(prefix[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        # Surrogates cannot be stored as UTF-8
+        following = 0xE000
+    return prefix[:-1] + chr(following)
+
+def nameOrdered(filters):
+    # A name prefix is a range of the name index, whose entries are in (name, id)
+    # order. Its results follow that order, so a page seeks into the index where
+    # the last one ended instead of sorting or scanning for the matches.
+    return filters.get("name") is None and bool(filters.get("name_prefix"))
+
+def filterClause(filters, afterName=None):
+    # Returns the WHERE conditions and parameters for a filter dict; afterName
+    # moves the start of a name prefix range up to where the last page ended
+    conditions = []
+    params = []
+    if filters.get("name") is not None:
+        conditions.append("name = ?")
+        params.append(filters["name"])
+    elif filters.get("name_prefix"):
+        # A range on the name index rather than LIKE, which ignores case and so cannot use it
+        prefix = filters["name_prefix"]
+        lower = max(prefix, afterName) if afterName else prefix
+        upper = prefixUpperBound(prefix)
+        conditions.append("name >= ?" if upper is None else "name >= ? AND name < ?")
+        params.extend([lower] if upper is None else [lower, upper])
+    if filters.get("size") is not None:
+        # The unary plus keeps the planner from trading the name index order for a sort
+        conditions.append("+size = ?" if nameOrdered(filters) else "size = ?")
+        params.append(filters["size"])
+    return conditions, params
+
+def orderBy(filters):
+    return "name, id" if nameOrdered(filters) else "id"
+
+def listingQuery(filters):
+    filters = filters or {}
+    conditions, params = filterClause(filters)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {SELECT_COLUMNS} FROM squirrels{where} ORDER BY {orderBy(filters)}", params
+
+def pageQuery(filters, afterId, limit, afterName=None):
+    # Keyset pagination: a page continues after afterId, or after (afterName,
+    # afterId) for name prefix results
+    filters = filters or {}
+    conditions, params = filterClause(filters, afterName)
+    if nameOrdered(filters):
+        conditions.append("(name > ? OR id > ?)")
+        params.extend([afterName or "", afterId])
+    else:
+        conditions.append("id > ?")
+        params.append(afterId)
+    where = " AND ".join(conditions)
+    return f"SELECT {SELECT_COLUMNS} FROM squirrels WHERE {where} ORDER BY {orderBy(filters)} LIMIT ?", params + [limit]
+
+def filterKey(filters):
+    return tuple(sorted((key, value) for key, value in (filters or {}).items() if value is not None))
+
+def migrate(connection):
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for number in range(version + 1, SCHEMA_VERSION + 1):
+        try:
+            connection.executescript(f"BEGIN IMMEDIATE;\n{MIGRATIONS[number - 1]}\nPRAGMA user_version = {number};\nCOMMIT;")
+        except BaseException:
+            if connection.in_transaction:
+                connection.rollback()
+            raise
+    return max(version, SCHEMA_VERSION)
+
+def fileIdentity(path):
+    # An open connection keeps its inode alive, so a replaced database
+    # file always shows up with a different (device, inode) pair.
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
+
 class SquirrelDB:
 
-    def __init__(self):
-        self.connection = sqlite3.connect("squirrel_db.db")
+    def __init__(self, path=DB_PATH, cache=None, profile=None, writer=None):
+        self.path = path
+        self.cache = cache
+        self.writer = writer
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        for key, value in (profile or {}).items():
+            self.connection.execute(f"PRAGMA {key} = {value}")
+        self.schemaVersion = migrate(self.connection)
         self.connection.row_factory = dict_factory
         self.cursor = self.connection.cursor()
+        self.tupleCursor = self.connection.cursor()
+        self.tupleCursor.row_factory = None
+        self.fileId = fileIdentity(path)
+        self.lastUsed = time.monotonic()
+        self.epoch = self.loadEpoch()
+
+    def close(self):
+        self.connection.close()
+
+    def isCurrent(self):
+        return self.fileId is not None and fileIdentity(self.path) == self.fileId
+
+    def traceRows(self, enabled):
+        # Only traced requests pay for timing each row
+        factory = tracedDictFactory if enabled else dict_factory
+        if self.connection.row_factory is not factory:
+            self.connection.row_factory = factory
+            self.cursor.row_factory = factory
+
+    def warm(self):
+        # Compile the hot reads into this connection's statement cache and pull
+        # the pages they touch into SQLite's page cache. Writes are left out so
+        # that warming never takes the write lock.
+        for query, params in [(SELECT_TABLE_VERSION, []), (SELECT_SQUIRREL, [0]),
+                              listingQuery(None), pageQuery(None, 0, 1)]:
+            self.connection.execute(query, params).fetchone()
+
+    def ping(self):
+        try:
+            self.connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # VERSIONS
+
+    def loadEpoch(self):
+        self.cursor.execute("SELECT value FROM squirrel_meta WHERE key = 'epoch'")
+        row = self.cursor.fetchone()
+        if row is None:
+            # The epoch tells ETags of a recreated database apart from the old one's
+            self.cursor.execute("INSERT OR IGNORE INTO squirrel_meta (key, value) VALUES ('epoch', ?)", [secrets.token_hex(4)])
+            self.connection.commit()
+            self.cursor.execute("SELECT value FROM squirrel_meta WHERE key = 'epoch'")
+            row = self.cursor.fetchone()
+        return row["value"]
+
+    def etagFor(self, version):
+        if not version:
+            return None
+        return f'"{self.epoch}-{version}"'
+
+    def beginRead(self):
+        # Read the version and the rows in one transaction so they agree
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+
+    def fetchTableVersion(self):
+        self.cursor.execute(SELECT_TABLE_VERSION)
+        return self.cursor.fetchone()["value"]
+
+    # READS
+
+    def getSquirrels(self, filters=None):
+        return [squirrel for batch in self.iterSquirrelBatches(filters=filters) for squirrel in batch]
+
+    def iterSquirrelBatches(self, batchSize=500, filters=None):
+        version, batches = self.listSquirrels(batchSize, filters)
+        return batches
+
+    def listSquirrels(self, batchSize=500, filters=None, tuples=False):
+        # Returns the table version and an iterator over batches of rows that
+        # are at least as new as that version. With tuples=True the rows are
+        # plain tuples in SQUIRREL_COLUMNS order, which skips building a dict per row.
+        key = ("all", filterKey(filters), tuples)
+        token = None
+        if self.cache is not None:
+            listing = self.cache.listings.get(key)
+            if listing is not MISSING:
+                squirrels, version = listing
+                return version, (squirrels[start:start + batchSize] for start in range(0, len(squirrels), batchSize))
+            # Taken before the snapshot is fixed, not when the caller starts reading the batches
+            token = self.cache.listings.token()
+        self.beginRead()
+        version = self.fetchTableVersion()
+        return version, self.streamSquirrelBatches(batchSize, version, filters, key, tuples, token)
+
+    def streamSquirrelBatches(self, batchSize, version, filters, key, tuples, token):
+        # Fill the cache while streaming, giving up once the listing is too big to keep
+        collected = [] if self.cache is not None else None
+        cursor = self.connection.cursor()
+        if tuples:
+            cursor.row_factory = None
+        # Only the time spent inside SQLite counts, not the time the client takes to read
+        elapsed = 0.0
+        try:
+            query, params = listingQuery(filters)
+            start = time.perf_counter()
+            cursor.execute(query, params)
+            elapsed += time.perf_counter() - start
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(batchSize)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                if collected is not None:
+                    collected.extend(rows)
+                    if len(collected) > self.cache.maxListingRows:
+                        collected = None
+                yield rows
+        finally:
+            cursor.close()
+            self.connection.commit()
+            DB_QUERY_SECONDS.observe(elapsed, "list_squirrels")
+        if collected is not None:
+            self.cache.listings.put(key, (collected, version), token)
+
+    def getSquirrelsPage(self, limit, afterId=0, filters=None, afterName=None):
+        squirrels, nextAfterId, version = self.getSquirrelsPageVersioned(limit, afterId, filters, afterName=afterName)
+        return squirrels, nextAfterId
+
+    def getSquirrelsPageVersioned(self, limit, afterId=0, filters=None, tuples=False, afterName=None):
+        if self.cache is None:
+            return self.fetchSquirrelsPage(limit, afterId, filters, tuples, afterName)
+        key = ("page", limit, afterId, afterName, filterKey(filters), tuples)
+        page = self.cache.listings.get(key)
+        if page is MISSING:
+            token = self.cache.listings.token()
+            page = self.fetchSquirrelsPage(limit, afterId, filters, tuples, afterName)
+            self.cache.listings.put(key, page, token)
+        return page
 
-    def getSquirrels(self):
-        self.cursor.execute("SELECT * FROM squirrels ORDER BY id")
-        return self.cursor.fetchall()
+    def fetchSquirrelsPage(self, limit, afterId, filters=None, tuples=False, afterName=None):
+        # Keyset pagination: seek past the last row seen instead of using OFFSET,
+        # so every page costs the same. One extra row tells us if more remain.
+        query, params = pageQuery(filters, afterId, limit + 1, afterName)
+        cursor = self.tupleCursor if tuples else self.cursor
+        with DB_QUERY_SECONDS.time("get_page"):
+            self.beginRead()
+            try:
+                version = self.fetchTableVersion()
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+            finally:
+                self.connection.commit()
+        nextAfterId = None
+        if len(rows) > limit:
+            nextAfterId = rows[limit - 1][0] if tuples else rows[limit - 1]["id"]
+        return rows[:limit], nextAfterId, version
 
     def getSquirrel(self, squirrelId):
+        squirrel, version = self.getSquirrelVersioned(squirrelId)
+        return squirrel
+
+    def getSquirrelVersioned(self, squirrelId):
+        key = self.cache.rowKey(squirrelId) if self.cache is not None else None
+        if key is None:
+            return self.fetchSquirrel(squirrelId)
+        entry = self.cache.rows.get(key)
+        if entry is MISSING:
+            token = self.cache.rows.token()
+            entry = self.fetchSquirrel(squirrelId)
+            self.cache.rows.put(key, entry, token)
+        return entry
+
+    def fetchSquirrel(self, squirrelId):
         data = [squirrelId]
-        self.cursor.execute("SELECT * FROM squirrels WHERE id = ?", data)
-        return self.cursor.fetchone()
+        with DB_QUERY_SECONDS.time("get_squirrel"):
+            self.cursor.execute(SELECT_SQUIRREL, data)
+            squirrel = self.cursor.fetchone()
+        if squirrel is None:
+            return None, None
+        version = squirrel.pop("_version")
+        return squirrel, version
+
+    def getChanges(self, since=None, limit=1000):
+        # Returns up to limit changes after version since (None: the current
+        # version), the current version, and the oldest version the log can
+        # continue from. A since outside [floor, latest] cannot be answered.
+        with DB_QUERY_SECONDS.time("get_changes"):
+            self.beginRead()
+            try:
+                latest = self.fetchTableVersion()
+                self.cursor.execute(SELECT_CHANGES, [latest if since is None else since, limit])
+                rows = self.cursor.fetchall()
+                self.cursor.execute(SELECT_OLDEST_CHANGE)
+                oldest = self.cursor.fetchone()["seq"]
+            finally:
+                self.connection.commit()
+        changes = []
+        for row in rows:
+            squirrel = None
+            if row["op"] != "delete":
+                squirrel = {"id": row["squirrel_id"], "name": row["name"], "size": row["size"]}
+            changes.append({"seq": row["seq"], "op": row["op"], "id": row["squirrel_id"], "squirrel": squirrel})
+        floor = latest if oldest is None else oldest - 1
+        return changes, latest, floor
+
+    # WRITES
 
     def createSquirrel(self, name, size):
-        data = [name, size]
-        self.cursor.execute("INSERT INTO squirrels (name, size) VALUES (?, ?)", data)
-        self.connection.commit()
-        return None
+        return self.write("create", [name, size])[1]
 
     def updateSquirrel(self, squirrelId, name, size):
-        data = [name, size, squirrelId]
-        self.cursor.execute("UPDATE squirrels SET name = ?, size = ? WHERE id = ?", data)
-        self.connection.commit()
-        return None
+        return self.write("update", [name, size, squirrelId])[0] > 0
 
     def deleteSquirrel(self, squirrelId):
-        data = [squirrelId]
-        self.cursor.execute("DELETE FROM squirrels WHERE id = ?", data)
-        self.connection.commit()
-        return None
+        return self.write("delete", [squirrelId])[0] > 0
+
+    def write(self, kind, data):
+        # Returns (rows changed, last inserted id), once the change is committed
+        if self.writer is not None:
+            return self.writer.submit(kind, data)
+        rowcount, lastrowid = self.applyWrite(kind, data)
+        with DB_QUERY_SECONDS.time("commit"):
+            self.connection.commit()
+        self.invalidateWrite(kind, data, rowcount, lastrowid)
+        return rowcount, lastrowid
+
+    def createSquirrels(self, records):
+        # records: (name, size) pairs. Returns the assigned ids in order.
+        if not records:
+            return []
+        with DB_QUERY_SECONDS.time("bulk_create"):
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.cursor.executemany(WRITE_STATEMENTS["create"], records)
+                # Inside one write transaction rowids are handed out consecutively
+                lastId = self.connection.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+        ids = list(range(lastId - len(records) + 1, lastId + 1))
+        self.invalidateMany(ids)
+        return ids
+
+    def updateSquirrels(self, records):
+        # records: (id, name, size) triples. Returns the set of ids that existed.
+        return self.writeMany("update", [id for id, name, size in records],
+                              [[name, size, id] for id, name, size in records])
+
+    def deleteSquirrels(self, squirrelIds):
+        # Returns the set of ids that existed
+        return self.writeMany("delete", squirrelIds, [[id] for id in squirrelIds])
+
+    def writeMany(self, kind, squirrelIds, rows):
+        if not rows:
+            return set()
+        with DB_QUERY_SECONDS.time(f"bulk_{kind}"):
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                found = self.fetchExistingIds(squirrelIds)
+                self.cursor.executemany(WRITE_STATEMENTS[kind], [row for row in rows if row[-1] in found])
+                self.connection.commit()
+            except BaseException:
+                self.connection.rollback()
+                raise
+        self.invalidateMany(found)
+        return found
+
+    def fetchExistingIds(self, squirrelIds):
+        found = set()
+        unique = list(dict.fromkeys(squirrelIds))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            marks = ", ".join("?" * len(chunk))
+            self.cursor.execute(f"SELECT id FROM squirrels WHERE id IN ({marks})", chunk)
+            found.update(row["id"] for row in self.cursor.fetchall())
+        return found
+
+    def applyWrite(self, kind, data):
+        with DB_QUERY_SECONDS.time(kind):
+            self.cursor.execute(WRITE_STATEMENTS[kind], data)
+        return self.cursor.rowcount, self.cursor.lastrowid
+
+    def invalidateWrite(self, kind, data, rowcount, lastrowid):
+        if kind == "create":
+            self.invalidate(lastrowid)
+        elif rowcount > 0:
+            self.invalidate(data[-1])
+
+    def invalidate(self, squirrelId):
+        if self.cache is not None:
+            self.cache.invalidateRow(squirrelId)
+
+    def invalidateMany(self, squirrelIds):
+        if self.cache is not None and squirrelIds:
+            self.cache.invalidateRows(squirrelIds)
+
+class PendingWrite:
+
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.data = data
+        self.rowcount = 0
+        self.lastrowid = None
+        self.error = None
+        self.done = threading.Event()
+
+class WriteBatcher:
+
+    # Group commit: mutations from concurrent requests are queued and applied
+    # by one thread in a single transaction, so many writes share one fsync.
+    # Each caller is released only after the commit that contains its write.
+
+    def __init__(self, path=DB_PATH, cache=None, profile=None, maxBatch=256, maxDelay=0.002):
+        self.path = path
+        self.cache = cache
+        self.profile = profile
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.queue = queue.Queue()
+        self.db = None
+        self.batches = 0
+        self.writes = 0
+        self.thread = threading.Thread(target=self.run, name="squirrel-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, data):
+        pending = PendingWrite(kind, data)
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.rowcount, pending.lastrowid
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.maxDelay
+            while len(batch) < self.maxBatch:
+                try:
+                    pending = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+            self.commitBatch(batch)
+        if self.db is not None:
+            self.db.close()
+
+    def commitBatch(self, batch):
+        try:
+            db = self.connect()
+            db.connection.execute("BEGIN IMMEDIATE")
+            for pending in batch:
+                # A savepoint per write lets one failing write leave the others intact
+                db.cursor.execute("SAVEPOINT pending_write")
+                try:
+                    pending.rowcount, pending.lastrowid = db.applyWrite(pending.kind, pending.data)
+                except sqlite3.Error as e:
+                    db.cursor.execute("ROLLBACK TO pending_write")
+                    pending.error = e
+                db.cursor.execute("RELEASE pending_write")
+            with DB_QUERY_SECONDS.time("commit"):
+                db.connection.commit()
+        except sqlite3.Error as e:
+            if self.db is not None and self.db.connection.in_transaction:
+                self.db.connection.rollback()
+            for pending in batch:
+                pending.error = pending.error or e
+        else:
+            for pending in batch:
+                if pending.error is None:
+                    db.invalidateWrite(pending.kind, pending.data, pending.rowcount, pending.lastrowid)
+            self.batches += 1
+            self.writes += len(batch)
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def connect(self):
+        if self.db is not None and self.db.isCurrent():
+            return self.db
+        if self.db is not None:
+            self.db.close()
+            if self.cache is not None:
+                self.cache.clear()
+        self.db = SquirrelDB(self.path, self.cache, self.profile)
+        return self.db
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def stats(self):
+        return {"batches": self.batches, "writes": self.writes}
+
+class PoolTimeout(Exception):
+    pass
+
+class SquirrelDBPool:
+
+    def __init__(self, path=DB_PATH, maxSize=16, timeout=10.0, pingAfter=30.0, cache=None, profile=None, writer=None):
+        self.path = path
+        self.cache = cache
+        self.profile = profile
+        self.writer = writer
+        self.fileId = None
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self.pingAfter = pingAfter
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(maxSize)
+        self.opened = 0
+        self.checkouts = 0
+        self.inUse = 0
+
+    def acquire(self):
+        with DB_POOL_WAIT_SECONDS.time():
+            acquired = self.slots.acquire(timeout=self.timeout)
+        if not acquired:
+            raise PoolTimeout(f"no database connection available after {self.timeout}s")
+        try:
+            with self.lock:
+                db = self.idle.pop() if self.idle else None
+                self.checkouts += 1
+                self.inUse += 1
+            if db is not None and not self.isHealthy(db):
+                db.close()
+                self.discardStale()
+                db = None
+            if db is None:
+                db = SquirrelDB(self.path, self.cache, self.profile, self.writer)
+                with self.lock:
+                    self.opened += 1
+                    replaced = db.fileId != self.fileId
+                    self.fileId = db.fileId
+                if replaced and self.cache is not None:
+                    self.cache.clear()
+            return db
+        except BaseException:
+            with self.lock:
+                self.inUse -= 1
+            self.slots.release()
+            raise
+
+    def release(self, db):
+        try:
+            if db.connection.in_transaction:
+                db.connection.rollback()
+            db.lastUsed = time.monotonic()
+            with self.lock:
+                self.idle.append(db)
+        except sqlite3.Error:
+            db.close()
+        finally:
+            with self.lock:
+                self.inUse -= 1
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        db = self.acquire()
+        db.traceRows(currentTrace() is not None)
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def warm(self, count=None):
+        # Open (and migrate) connections before the first request needs them
+        count = self.maxSize if count is None else min(count, self.maxSize)
+        dbs = []
+        try:
+            for _ in range(count):
+                dbs.append(self.acquire())
+            for db in dbs:
+                db.warm()
+        finally:
+            for db in dbs:
+                self.release(db)
+
+    def isHealthy(self, db):
+        if not db.isCurrent():
+            return False
+        if time.monotonic() - db.lastUsed > self.pingAfter:
+            return db.ping()
+        return True
+
+    def discardStale(self):
+        # The database file was replaced: close every idle connection to the
+        # old file at once rather than finding them one checkout at a time.
+        with self.lock:
+            stale = [db for db in self.idle if not db.isCurrent()]
+            self.idle = [db for db in self.idle if db not in stale]
+        for db in stale:
+            db.close()
+        if self.cache is not None:
+            self.cache.clear()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for db in idle:
+            db.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_size": self.maxSize,
+                "idle": len(self.idle),
+                "in_use": self.inUse,
+                "opened": self.opened,
+                "checkouts": self.checkouts,
+            }
@@ -0,0 +1,194 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Prometheus text exposition (format 0.0.4) without a client library. Every
+# update is one dict lookup and an add under a lock, so it stays on in the
+# hot path.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatLabels(names, values, extra=""):
+    pairs = [f'{name}="{escapeLabel(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        with self.lock:
+            series = sorted(self.series.items())
+        return self.header() + [f"{self.name}{formatLabels(self.labels, key)} {formatValue(value)}"
+                                for key, value in series]
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, *labelValues, amount=1):
+        with self.lock:
+            self.series[labelValues] = self.series.get(labelValues, 0) + amount
+
+class Gauge(Metric):
+
+    kind = "gauge"
+
+    def inc(self, *labelValues, amount=1):
+        with self.lock:
+            self.series[labelValues] = self.series.get(labelValues, 0) + amount
+
+    def dec(self, *labelValues, amount=1):
+        self.inc(*labelValues, amount=-amount)
+
+    def set(self, value, *labelValues):
+        with self.lock:
+            self.series[labelValues] = value
+
+class Timer:
+
+    __slots__ = ("histogram", "labelValues", "start")
+
+    def __init__(self, histogram, labelValues):
+        self.histogram = histogram
+        self.labelValues = labelValues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelValues)
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.bucketLabels = [f'le="{formatValue(float(bound))}"' for bound in self.buckets] + ['le="+Inf"']
+
+    def observe(self, value, *labelValues):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labelValues)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self.series[labelValues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labelValues):
+        return Timer(self, labelValues)
+
+    def render(self):
+        with self.lock:
+            series = sorted((key, list(value)) for key, value in self.series.items())
+        lines = self.header()
+        for key, counts in series:
+            total = 0
+            for bucketLabel, count in zip(self.bucketLabels, counts):
+                total += count
+                lines.append(f"{self.name}_bucket{formatLabels(self.labels, key, bucketLabel)} {total}")
+            labels = formatLabels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {formatValue(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return lines
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "squirrel_http_requests_total", "HTTP requests answered.", ("method", "route", "status")))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "squirrel_http_request_duration_seconds", "Time from parsed request headers to the end of the response.",
+    ("method", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "squirrel_http_requests_in_flight", "Requests currently being handled."))
+HTTP_CONNECTIONS = REGISTRY.register(Gauge(
+    "squirrel_http_connections_open", "Client connections currently open."))
+CHANGE_SUBSCRIBERS = REGISTRY.register(Gauge(
+    "squirrel_change_subscribers", "Clients waiting on GET /squirrels/changes.", ("mode",)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "squirrel_db_query_duration_seconds", "Time spent in SQLite per query.", ("query",)))
+DB_POOL_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "squirrel_db_pool_wait_seconds", "Time spent waiting for a pooled database connection."))
+
+def gauge(name, help, samples):
+    return stat("gauge", name, help, samples)
+
+def counter(name, help, samples):
+    return stat("counter", name, help, samples)
+
+def stat(kind, name, help, samples):
+    # samples: (labels dict, value) pairs
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{formatLabels(labels.keys(), labels.values())} {formatValue(value)}")
+    return lines
+
+def renderPoolStats(pool):
+    stats = pool.stats()
+    lines = gauge("squirrel_db_pool_connections", "Pooled database connections by state.",
+                  [({"state": "idle"}, stats["idle"]), ({"state": "in_use"}, stats["in_use"])])
+    lines += gauge("squirrel_db_pool_max_connections", "Most connections the pool opens.", [({}, stats["max_size"])])
+    lines += counter("squirrel_db_pool_opened_total", "Database connections opened.", [({}, stats["opened"])])
+    lines += counter("squirrel_db_pool_checkouts_total", "Connections handed out by the pool.", [({}, stats["checkouts"])])
+    if pool.cache is not None:
+        caches = sorted(pool.cache.stats().items())
+        lines += gauge("squirrel_cache_entries", "Entries held in the read cache.",
+                       [({"cache": name}, cache["size"]) for name, cache in caches])
+        lines += counter("squirrel_cache_hits_total", "Read cache hits.",
+                         [({"cache": name}, cache["hits"]) for name, cache in caches])
+        lines += counter("squirrel_cache_misses_total", "Read cache misses.",
+                         [({"cache": name}, cache["misses"]) for name, cache in caches])
+        lines += counter("squirrel_cache_evictions_total", "Entries evicted from the read cache.",
+                         [({"cache": name}, cache["evictions"]) for name, cache in caches])
+    if pool.writer is not None:
+        writer = pool.writer.stats()
+        lines += counter("squirrel_write_batches_total", "Group commits.", [({}, writer["batches"])])
+        lines += counter("squirrel_write_batched_writes_total", "Writes applied through group commit.",
+                         [({}, writer["writes"])])
+    return lines
+
+def renderMetrics(pool=None):
+    lines = REGISTRY.render()
+    if pool is not None:
+        lines += renderPoolStats(pool)
+    return ("\n".join(lines) + "\n").encode("utf-8")
@@ -1,133 +1,1174 @@
+import argparse
 import json
+import math
+import os
+import queue
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import parse_qs
-from squirrel_db import SquirrelDB
+from urllib.parse import parse_qs, urlencode, urlsplit
+from squirrel_cache import MISSING, LRUCache, SquirrelCache
+from squirrel_changes import SSE_TYPE, ChangeHub, changesBody, sseEvents
+from squirrel_db import (DB_PATH, FILTERS, PROFILES, SQUIRREL_COLUMNS, SquirrelDB, SquirrelDBPool, WriteBatcher,
+                         describeProfile, nameOrdered, resolveProfile)
+from squirrel_metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_CONNECTIONS, HTTP_IN_FLIGHT,
+                              HTTP_REQUEST_SECONDS, HTTP_REQUESTS, renderMetrics)
+from squirrel_trace import NULL_TRACE, TRACE_HEADER, Tracer
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_ITEMS = 10000
+# SQLite integers are signed 64-bit; a bigger id cannot even be bound as a parameter
+SQLITE_INTEGER_RANGE = range(-2**63, 2**63)
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# Listings can be sent as one JSON array or as one JSON object per line
+LISTING_TYPES = ("application/json", *NDJSON_TYPES)
+# Offered content codings, preferred first when the client ranks them equally
+CONTENT_ENCODINGS = ("gzip", "deflate")
+# A streamed listing compressing to more than this is not kept in the compressed body cache
+MAX_CACHED_COMPRESSED_BYTES = 8 * 1024 * 1024
+# The change feed answers long-polls with JSON and keeps event streams open
+FEED_TYPES = ("application/json", SSE_TYPE)
+DEFAULT_CHANGES_WAIT = 30.0
+MAX_CHANGES_WAIT = 120.0
+MAX_CHANGES = 1000
+# Metric labels use these instead of the raw method and path, to keep the series count fixed
+METRIC_METHODS = ("GET", "HEAD", "POST", "PUT", "DELETE")
 
 class SquirrelServerHandler(BaseHTTPRequestHandler):
 
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+    # Unread request bodies up to this size are drained to keep the connection usable
+    maxDrainBytes = 64 * 1024
+    dateHeader = (None, None)
+    # Set once the change feed owns the connection
+    parkedSink = None
+    # Set while a keep-alive connection waits for its next request outside any worker
+    idle = False
+
+    def setup(self):
+        self.timeout = self.server.keepAliveTimeout
+        super().setup()
+        self.requestsHandled = 0
+        HTTP_CONNECTIONS.inc()
+
+    def finish(self):
+        if self.idle:
+            # The server watches the connection and resumes or closes it later
+            return
+        HTTP_CONNECTIONS.dec()
+        super().finish()
+
+    def handle(self):
+        # Requests already buffered (pipelined) are served right away. Otherwise
+        # a server that can watch idle connections gets this one back, so a
+        # keep-alive client between requests does not hold a worker thread.
+        self.idle = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if self.server.watchesIdle and not self.inputPending():
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def inputPending(self):
+        # Only what is already buffered or readable without waiting counts
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def handle_one_request(self):
+        self.requestBodyRead = False
+        self.requestStarted = None
+        self.responseStatus = None
+        self.trace = NULL_TRACE
+        try:
+            super().handle_one_request()
+        finally:
+            if self.trace:
+                trace, self.trace = self.trace, NULL_TRACE
+                self.server.tracer.finish(trace, self.command, self.path, self.responseStatus)
+            if self.requestStarted is not None:
+                self.recordRequest()
+        self.requestsHandled += 1
+        if not self.close_connection and not self.requestBodyRead:
+            self.discardRequestData()
+
+    def parse_request(self):
+        # Timing starts once the headers are in, so idle keep-alive time is not counted
+        started = time.perf_counter()
+        parsed = super().parse_request()
+        if parsed:
+            self.requestStarted = time.perf_counter()
+            HTTP_IN_FLIGHT.inc()
+            if self.server.tracer is not None:
+                self.trace = self.server.tracer.start(started, self.headers.get(TRACE_HEADER))
+                if self.trace:
+                    self.trace.lap("parse_request")
+        return parsed
+
+    def date_time_string(self, timestamp=None):
+        # The Date header only changes once a second; formatting it costs about 3 us
+        if timestamp is not None:
+            return super().date_time_string(timestamp)
+        second = int(time.time())
+        cachedSecond, text = SquirrelServerHandler.dateHeader
+        if cachedSecond != second:
+            text = super().date_time_string(second)
+            SquirrelServerHandler.dateHeader = (second, text)
+        return text
+
+    def send_response(self, code, message=None):
+        self.responseStatus = code
+        super().send_response(code, message)
+        if self.trace:
+            self.send_header(f"{TRACE_HEADER}-Id", self.trace.id)
+
+    def recordRequest(self):
+        HTTP_IN_FLIGHT.dec()
+        method = self.command if self.command in METRIC_METHODS else "other"
+        route = self.routeLabel()
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - self.requestStarted, method, route)
+        HTTP_REQUESTS.inc(method, route, str(self.responseStatus or 0))
+
+    def routeLabel(self):
+        parsed = self.parsePath()
+        if not parsed:
+            return "other"
+        resourceName, resourceId = parsed
+        if resourceName == "squirrels":
+            if not resourceId:
+                return "/squirrels"
+            if resourceId in ("bulk", "changes"):
+                return f"/squirrels/{resourceId}"
+            return "/squirrels/{id}"
+        if resourceName in ("metrics", "healthz") and not resourceId:
+            return f"/{resourceName}"
+        return "other"
+
     # HTTP METHODS
 
     def do_GET(self):
         resourceName, resourceId = self.parsePath()
         if resourceName == "squirrels":
-            if resourceId:
+            if resourceId == "changes":
+                self.handleSquirrelsChanges()
+            elif resourceId:
                 self.handleSquirrelsRetrieve(resourceId)
             else:
                 self.handleSquirrelsIndex()
+        elif resourceName == "metrics" and not resourceId:
+            self.handleMetrics()
+        elif resourceName == "healthz" and not resourceId:
+            self.handleHealth()
         else:
             self.handle404()
 
+    def do_HEAD(self):
+        # Routed like GET; the response helpers leave the body out
+        self.do_GET()
+
     def do_POST(self):
         resourceName, resourceId = self.parsePath()
         if resourceName == "squirrels":
-            if resourceId:
+            if resourceId == "bulk":
+                self.handleSquirrelsBulkCreate()
+            elif resourceId:
                 self.handle404()
             else:
                 self.handleSquirrelsCreate()
         else:
             self.handle404()
+        # Wake waiting change feed clients now instead of at the next poll
+        self.server.changes.notify()
 
     def do_PUT(self):
         resourceName, resourceId = self.parsePath()
         if resourceName == "squirrels":
-            if resourceId:
+            if resourceId == "bulk":
+                self.handleSquirrelsBulkUpdate()
+            elif resourceId:
                 self.handleSquirrelsUpdate(resourceId)
             else:
                 self.handle404()
         else:
             self.handle404()
+        # Wake waiting change feed clients now instead of at the next poll
+        self.server.changes.notify()
 
     def do_DELETE(self):
         resourceName, resourceId = self.parsePath()
         if resourceName == "squirrels":
-            if resourceId:
+            if resourceId == "bulk":
+                self.handleSquirrelsBulkDelete()
+            elif resourceId:
                 self.handleSquirrelsDelete(resourceId)
             else:
                 self.handle404()
         else:
             self.handle404()
+        # Wake waiting change feed clients now instead of at the next poll
+        self.server.changes.notify()
 
     # HELPERS
 
-    def getRequestData(self):
+    def readRequestBody(self):
         length = int(self.headers["Content-Length"])
-        body = self.rfile.read(length).decode("utf-8")
-        data = parse_qs(body)
+        body = self.rfile.read(length)
+        self.requestBodyRead = True
+        return body
+
+    def requestContentType(self):
+        return (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+    def getRequestData(self):
+        # A URL-encoded form, or a JSON object (a single NDJSON line is one too)
+        with self.trace.phase("request_body"):
+            body = self.readRequestBody().decode("utf-8")
+            contentType = self.requestContentType()
+            if contentType == "application/json" or contentType in NDJSON_TYPES:
+                data = json.loads(body)
+            else:
+                data = {key: values[0] for key, values in parse_qs(body).items()}
+        error = bulkRecordError(data, ("name", "size"))
+        if error:
+            raise ValueError(error)
+        return data
+
+    def getRequestRecords(self):
+        # A JSON array, or one JSON value per line for NDJSON bodies
+        with self.trace.phase("request_body"):
+            body = self.readRequestBody().decode("utf-8")
+            if self.requestContentType() in NDJSON_TYPES:
+                records = [json.loads(line) for line in body.splitlines() if line.strip()]
+            else:
+                records = json.loads(body)
+        if not isinstance(records, list):
+            raise ValueError("expected a JSON array or NDJSON lines")
+        if len(records) > MAX_BULK_ITEMS:
+            raise ValueError(f"at most {MAX_BULK_ITEMS} items per request")
+        return records
+
+    def discardRequestData(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.maxDrainBytes:
+            self.close_connection = True
+        elif length:
+            self.rfile.read(length)
+        self.requestBodyRead = True
+
+    def preferredType(self, offered):
+        # The offered media type the Accept header ranks highest; ties and a
+        # missing or unsatisfiable header go to the first one offered
+        accept = self.headers.get("Accept")
+        if not accept:
+            return offered[0]
+        ranks = headerQualities(accept)
+        best, bestQuality = offered[0], 0.0
+        for mediaType in offered:
+            quality = ranks.get(mediaType, ranks.get(mediaType.split("/")[0] + "/*", ranks.get("*/*", 0.0)))
+            if quality > bestQuality:
+                best, bestQuality = mediaType, quality
+        return best
+
+    def preferredEncoding(self):
+        # gzip or deflate when the client accepts one, None for identity
+        acceptEncoding = self.headers.get("Accept-Encoding")
+        if not acceptEncoding:
+            return None
+        ranks = headerQualities(acceptEncoding)
+        best, bestQuality = None, 0.0
+        for encoding in CONTENT_ENCODINGS:
+            quality = ranks.get(encoding, ranks.get("*", 0.0))
+            if quality > bestQuality:
+                best, bestQuality = encoding, quality
+        return best
+
+    def getQueryParams(self):
+        data = parse_qs(urlsplit(self.path).query)
         for key in data:
             data[key] = data[key][0]
         return data
 
+    def writeResponse(self, status, body=b"", contentType=None, headers=None):
+        headers = headers or {}
+        # A body that already carries a Content-Encoding came out of the compressed body cache
+        if status == 200 and self.compressionApplies(contentType, len(body)) and "Content-Encoding" not in headers:
+            headers = dict(headers, Vary=addVary(headers, "Accept-Encoding"))
+            encoding = self.preferredEncoding()
+            if encoding:
+                body = self.compressBody(body, encoding, headers)
+        self.send_response(status)
+        if contentType:
+            self.send_header("Content-Type", contentType)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status not in (204, 304):
+            self.send_header("Content-Length", str(len(body)))
+        self.sendConnectionHeaders()
+        with self.trace.phase("write"):
+            self.end_headers()
+            if body and self.command != "HEAD":
+                self.wfile.write(body)
+            if self.trace:
+                # Otherwise the socket write happens after the handler returns, outside any phase
+                self.wfile.flush()
+
+    def compressionApplies(self, contentType, size=None):
+        minBytes = self.server.compressMinBytes
+        if minBytes is None or (size is not None and size < minBytes):
+            return False
+        return compressible(contentType)
+
+    def compressBody(self, body, encoding, headers):
+        key = self.compressedKey(encoding, headers)
+        compressed = self.server.compressedBodies.get(key) if key else MISSING
+        if compressed is MISSING:
+            with self.trace.phase("compress"):
+                compressor = newCompressor(encoding, self.server.compressLevel)
+                compressed = compressor.compress(body) + compressor.flush()
+            if key:
+                self.server.compressedBodies.put(key, compressed, self.server.compressedBodies.token())
+        markEncoded(headers, encoding)
+        return compressed
+
+    def compressedKey(self, encoding, headers):
+        # The entity tag pins the representation and the path tells pages of the same version apart
+        etag = headers.get("ETag") if headers else None
+        if not etag or self.server.compressedBodies is None:
+            return None
+        return (self.path, etag, encoding)
+
+    def writeCompressedFromCache(self, contentType, headers):
+        # A hot response that was compressed before goes out as is, skipping encoding and compression
+        encoding = self.preferredEncoding()
+        key = self.compressedKey(encoding, headers) if encoding else None
+        compressed = self.server.compressedBodies.get(key) if key else MISSING
+        if compressed is MISSING:
+            return False
+        headers = dict(headers, Vary=addVary(headers, "Accept-Encoding"))
+        markEncoded(headers, encoding)
+        self.writeResponse(200, compressed, contentType, headers)
+        return True
+
+    def startChunkedResponse(self, status, contentType=None, headers=None):
+        self.compressor = None
+        self.compressedParts = None
+        self.heldChunks = None
+        headers = headers or {}
+        if self.compressionApplies(contentType):
+            # Whether a listing is compressed depends on how long it is when requested
+            headers = dict(headers, Vary=addVary(headers, "Accept-Encoding"))
+            encoding = self.preferredEncoding()
+            if encoding:
+                # The length is unknown up front, so the start of the body is held back until it
+                # reaches the compression threshold; a body that ends short of it goes out as is
+                self.heldChunks = []
+                self.heldSize = 0
+                self.heldResponse = (status, contentType, headers, encoding)
+                return
+        self.sendChunkedHeaders(status, contentType, headers)
+
+    def sendChunkedHeaders(self, status, contentType, headers):
+        self.send_response(status)
+        if contentType:
+            self.send_header("Content-Type", contentType)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.chunked = self.request_version != "HTTP/1.0"
+        if self.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            # HTTP/1.0 clients read the body until the connection closes
+            self.send_header("Connection", "close")
+        self.sendConnectionHeaders()
+        with self.trace.phase("write"):
+            self.end_headers()
+
+    def releaseChunks(self, compress):
+        status, contentType, headers, encoding = self.heldResponse
+        held = b"".join(self.heldChunks)
+        self.heldChunks = self.heldResponse = None
+        if compress:
+            self.compressor = newCompressor(encoding, self.server.compressLevel)
+            self.streamKey = self.compressedKey(encoding, headers)
+            if self.streamKey:
+                self.compressedParts = []
+                self.compressedSize = 0
+            markEncoded(headers, encoding)
+        self.sendChunkedHeaders(status, contentType, headers)
+        self.writeChunk(held)
+
+    def writeChunk(self, data):
+        if self.heldChunks is not None:
+            self.heldChunks.append(data)
+            self.heldSize += len(data)
+            if self.heldSize >= self.server.compressMinBytes:
+                self.releaseChunks(True)
+            return
+        if self.compressor is not None:
+            with self.trace.phase("compress"):
+                data = self.compressor.compress(data)
+        self.sendChunk(data)
+
+    def flushChunks(self):
+        if self.heldChunks is not None:
+            # Still below the threshold; nothing has been sent yet
+            return
+        if self.compressor is not None:
+            with self.trace.phase("compress"):
+                data = self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.sendChunk(data)
+        with self.trace.phase("write"):
+            self.wfile.flush()
+
+    def sendChunk(self, data):
+        if not data:
+            return
+        if self.compressedParts is not None:
+            self.compressedParts.append(data)
+            self.compressedSize += len(data)
+            if self.compressedSize > MAX_CACHED_COMPRESSED_BYTES:
+                self.compressedParts = None
+        if self.command == "HEAD":
+            return
+        with self.trace.phase("write"):
+            if self.chunked:
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+            else:
+                self.wfile.write(data)
+
+    def endChunkedResponse(self):
+        if self.heldChunks is not None:
+            self.releaseChunks(False)
+        if self.compressor is not None:
+            with self.trace.phase("compress"):
+                data = self.compressor.flush()
+            self.sendChunk(data)
+            if self.compressedParts is not None:
+                cache = self.server.compressedBodies
+                cache.put(self.streamKey, b"".join(self.compressedParts), cache.token())
+            self.compressor = self.compressedParts = None
+        with self.trace.phase("write"):
+            if self.chunked and self.command != "HEAD":
+                self.wfile.write(b"0\r\n\r\n")
+            if self.trace:
+                self.wfile.flush()
+
+    def sendConnectionHeaders(self):
+        if self.close_connection:
+            return
+        if self.requestsHandled + 1 >= self.server.maxKeepAliveRequests:
+            self.send_header("Connection", "close")
+        else:
+            remaining = self.server.maxKeepAliveRequests - self.requestsHandled - 1
+            self.send_header("Keep-Alive", f"timeout={self.server.keepAliveTimeout:g}, max={remaining}")
+
     def parsePath(self):
-        if self.path.startswith("/"):
-            parts = self.path[1:].split("/")
-            resourceName = parts[0]
-            resourceId = None
-            if len(parts) > 1:
-                resourceId = parts[1]
-            return (resourceName, resourceId)
-        return False
+        with self.trace.phase("parse_path"):
+            path = urlsplit(self.path).path
+            if path.startswith("/"):
+                parts = path[1:].split("/")
+                resourceName = parts[0]
+                resourceId = None
+                if len(parts) > 1:
+                    resourceId = parts[1]
+                return (resourceName, resourceId)
+            return False
 
     # ACTIONS
 
     def handleSquirrelsIndex(self):
-        db = SquirrelDB()
-        squirrelsList = db.getSquirrels()
+        params = self.getQueryParams()
+        filters = {key: params[key] for key in FILTERS if key in params}
+        contentType = self.preferredType(LISTING_TYPES)
+        if "limit" in params or "after_id" in params or "after_name" in params:
+            self.handleSquirrelsPage(params, filters, contentType)
+            return
+        ndjson = contentType in NDJSON_TYPES
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            version, batches = db.listSquirrels(filters=filters, tuples=True)
+            etag = variantTag(db.etagFor(version), "ndjson" if ndjson else None)
+            if self.etagMatches(etag):
+                self.handle304(etag)
+                return
+            if self.writeCompressedFromCache(contentType, listingHeaders(etag)):
+                return
+            self.startChunkedResponse(200, contentType, listingHeaders(etag))
+            try:
+                prefix = "["
+                for batch in batches:
+                    with self.trace.phase("json"):
+                        rows = SQUIRREL_ENCODER.encode(batch)
+                        if ndjson:
+                            chunk = bytes("\n".join(rows) + "\n", "utf-8")
+                        else:
+                            chunk = bytes(prefix + ", ".join(rows), "utf-8")
+                    self.writeChunk(chunk)
+                    if prefix == "[":
+                        # Get the first rows to the client without waiting for a full buffer
+                        self.flushChunks()
+                    prefix = ", "
+                if not ndjson:
+                    self.writeChunk(b"[]" if prefix == "[" else b"]")
+                self.endChunkedResponse()
+            except BaseException:
+                # The status line is already out, so the only way to signal failure is to drop the connection
+                self.close_connection = True
+                raise
+
+    def handleSquirrelsPage(self, params, filters, contentType):
+        try:
+            limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+            afterId = int(params.get("after_id", 0))
+        except ValueError:
+            self.handle400("limit and after_id must be integers")
+            return
+        if limit < 1:
+            self.handle400("limit must be at least 1")
+            return
+        limit = min(limit, MAX_PAGE_SIZE)
+        # Name prefix results are in name order, so their cursor is the last name and id
+        byName = nameOrdered(filters)
+        afterName = params.get("after_name") if byName else None
+        if byName and afterId and afterName is None:
+            self.handle400("after_id needs after_name when filtering by name_prefix")
+            return
+        ndjson = contentType in NDJSON_TYPES
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            rows, nextAfterId, version = db.getSquirrelsPageVersioned(limit, afterId, filters, tuples=True,
+                                                                      afterName=afterName)
+            etag = variantTag(db.etagFor(version), "ndjson" if ndjson else None)
+        if self.etagMatches(etag):
+            self.handle304(etag)
+            return
+        headers = listingHeaders(etag)
+        if nextAfterId is not None:
+            cursor = {"after_name": rows[-1][1], "after_id": nextAfterId} if byName else {"after_id": nextAfterId}
+            nextQuery = urlencode({**filters, "limit": limit, **cursor})
+            headers["Link"] = f'</squirrels?{nextQuery}>; rel="next"'
+        if self.writeCompressedFromCache(contentType, headers):
+            return
+        with self.trace.phase("json"):
+            encoded = SQUIRREL_ENCODER.encode(rows)
+            if ndjson:
+                body = bytes("".join(row + "\n" for row in encoded), "utf-8")
+            else:
+                body = bytes("[" + ", ".join(encoded) + "]", "utf-8")
+        self.writeResponse(200, body, contentType, headers)
+
+    def handleSquirrelsChanges(self):
+        params = self.getQueryParams()
+        # A HEAD request gets the headers of an immediate answer; it has no body to wait for
+        stream = self.command != "HEAD" and self.preferredType(FEED_TYPES) == SSE_TYPE
+        # EventSource sends the id of the last event it saw when it reconnects
+        since = self.headers.get("Last-Event-ID") or params.get("since")
+        try:
+            since = None if since is None else int(since)
+            wait = float(params.get("timeout", DEFAULT_CHANGES_WAIT))
+            if not math.isfinite(wait):
+                raise ValueError(wait)
+        except ValueError:
+            self.handle400("since must be an integer and timeout a finite number")
+            return
+        wait = min(max(wait, 0.0), MAX_CHANGES_WAIT)
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            changes, latest, floor = db.getChanges(since, MAX_CHANGES)
+        if since is None:
+            # Without since the answer is only the position to follow from
+            since, wait = latest, 0.0
+        elif not floor <= since <= latest:
+            self.handle410(f"changes after {since} are not in the log (it covers {floor} to {latest}); "
+                           f"reload /squirrels and follow from since={latest}")
+            return
+        if stream:
+            self.startParkedResponse(SSE_TYPE)
+            with self.trace.phase("write"):
+                self.wfile.write(sseEvents(changes))
+                self.wfile.flush()
+            self.server.changes.subscribe(self.parkingSink(), changes[-1]["seq"] if changes else since)
+        elif changes or not wait or self.command == "HEAD":
+            self.writeResponse(200, changesBody(changes, since), "application/json", {"Cache-Control": "no-store"})
+        else:
+            self.startParkedResponse("application/json")
+            with self.trace.phase("write"):
+                self.wfile.flush()
+            self.server.changes.subscribe(self.parkingSink(), since, wait)
+
+    def startParkedResponse(self, contentType):
+        # The body comes later from the change feed thread and ends when it closes the connection
+        self.close_connection = True
         self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(bytes(json.dumps(squirrelsList), "utf-8"))
+        self.send_header("Content-Type", contentType)
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        with self.trace.phase("write"):
+            self.end_headers()
+
+    def parkingSink(self):
+        self.parkedSink = self.server.changes.socketSink(self.connection)
+        return self.parkedSink
 
     def handleSquirrelsRetrieve(self, squirrelId):
-        db = SquirrelDB()
-        squirrel = db.getSquirrel(squirrelId)
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            squirrel, version = db.getSquirrelVersioned(squirrelId)
+            etag = db.etagFor(version)
         if squirrel:
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(bytes(json.dumps(squirrel), "utf-8"))
+            if self.etagMatches(etag):
+                self.handle304(etag)
+                return
+            with self.trace.phase("json"):
+                body = bytes(json.dumps(squirrel), "utf-8")
+            self.writeResponse(200, body, "application/json", {"ETag": etag} if etag else None)
         else:
             self.handle404()
 
     def handleSquirrelsCreate(self):
-        db = SquirrelDB()
-        body = self.getRequestData()
-        db.createSquirrel(body["name"], body["size"])
-        self.send_response(201)
-        self.end_headers()
+        try:
+            body = self.getRequestData()
+        except ValueError as e:
+            self.handle400(str(e))
+            return
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            squirrelId = db.createSquirrel(body["name"], body["size"])
+        self.writeResponse(201, headers={"Location": f"/squirrels/{squirrelId}"})
 
     def handleSquirrelsUpdate(self, squirrelId):
-        db = SquirrelDB()
-        squirrel = db.getSquirrel(squirrelId)
-        if squirrel:
+        try:
             body = self.getRequestData()
-            db.updateSquirrel(squirrelId, body["name"], body["size"])
-            self.send_response(204)
-            self.end_headers()
+        except ValueError as e:
+            self.handle400(str(e))
+            return
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            updated = db.updateSquirrel(squirrelId, body["name"], body["size"])
+        if updated:
+            self.writeResponse(204)
         else:
             self.handle404()
 
     def handleSquirrelsDelete(self, squirrelId):
-        db = SquirrelDB()
-        squirrel = db.getSquirrel(squirrelId)
-        if squirrel:
-            db.deleteSquirrel(squirrelId)
-            self.send_response(204)
-            self.end_headers()
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            deleted = db.deleteSquirrel(squirrelId)
+        if deleted:
+            self.writeResponse(204)
         else:
             self.handle404()
 
+    def handleSquirrelsBulkCreate(self):
+        records = self.getBulkRecords()
+        if records is None:
+            return
+        results, valid = validateBulkRecords(records, ("name", "size"))
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            ids = db.createSquirrels([(records[i]["name"], records[i]["size"]) for i in valid])
+        for index, squirrelId in zip(valid, ids):
+            results[index] = {"status": 201, "id": squirrelId}
+        self.writeBulkResults(results)
+
+    def handleSquirrelsBulkUpdate(self):
+        records = self.getBulkRecords()
+        if records is None:
+            return
+        results, valid = validateBulkRecords(records, ("id", "name", "size"))
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            found = db.updateSquirrels([(records[i]["id"], records[i]["name"], records[i]["size"]) for i in valid])
+        for index in valid:
+            squirrelId = records[index]["id"]
+            results[index] = {"status": 204 if squirrelId in found else 404, "id": squirrelId}
+        self.writeBulkResults(results)
+
+    def handleSquirrelsBulkDelete(self):
+        records = self.getBulkRecords()
+        if records is None:
+            return
+        # Accept bare ids as well as {"id": ...} objects
+        records = [record if isinstance(record, dict) else {"id": record} for record in records]
+        results, valid = validateBulkRecords(records, ("id",))
+        with self.trace.phase("db"), self.server.pool.connection() as db:
+            found = db.deleteSquirrels([records[i]["id"] for i in valid])
+        for index in valid:
+            squirrelId = records[index]["id"]
+            results[index] = {"status": 204 if squirrelId in found else 404, "id": squirrelId}
+        self.writeBulkResults(results)
+
+    def getBulkRecords(self):
+        try:
+            return self.getRequestRecords()
+        except (ValueError, TypeError) as e:
+            self.handle400(str(e))
+            return None
+
+    def writeBulkResults(self, results):
+        with self.trace.phase("json"):
+            body = bytes(json.dumps({"results": results}), "utf-8")
+        self.writeResponse(200, body, "application/json")
+
+    def etagMatches(self, etag):
+        ifNoneMatch = self.headers.get("If-None-Match")
+        if not etag or not ifNoneMatch:
+            return False
+        if ifNoneMatch.strip() == "*":
+            return True
+        candidates = (tag.strip() for tag in ifNoneMatch.split(","))
+        return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+    def handleHealth(self):
+        # Ready means a pooled connection answers, so the route is slow or failing exactly when requests would be
+        with self.server.pool.connection() as db:
+            healthy = db.ping()
+            body = {"status": "ok" if healthy else "unavailable", "schema_version": db.schemaVersion}
+        self.writeResponse(200 if healthy else 503, bytes(json.dumps(body), "utf-8"), "application/json",
+                           {"Cache-Control": "no-store"})
+
+    def handleMetrics(self):
+        self.writeResponse(200, renderMetrics(self.server.pool), METRICS_CONTENT_TYPE)
+
+    def handle304(self, etag):
+        self.writeResponse(304, headers={"ETag": etag})
+
+    def handle400(self, message):
+        self.writeResponse(400, bytes(f"400 Bad Request: {message}", "utf-8"), "text/plain")
+
+    def handle410(self, message):
+        self.writeResponse(410, bytes(f"410 Gone: {message}", "utf-8"), "text/plain")
+
     def handle404(self):
-        self.send_response(404)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(bytes("404 Not Found", "utf-8"))
+        self.writeResponse(404, bytes("404 Not Found", "utf-8"), "text/plain")
 
-def run():
-    print("squirrel_server running at 127.0.0.1:8080")
-    listen = ("127.0.0.1", 8080)
-    server = HTTPServer(listen, SquirrelServerHandler)
-    server.serve_forever()
+def variantTag(etag, variant):
+    # Each representation of a resource needs its own entity tag
+    if not etag or not variant:
+        return etag
+    return f'{etag[:-1]}-{variant}"'
 
-if __name__ == '__main__':
-    run()
+def headerQualities(value):
+    # Maps each token of an Accept-style header to its q-value
+    ranks = {}
+    for part in value.split(","):
+        token, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        ranks[token.strip().lower()] = quality
+    return ranks
+
+def compressible(contentType):
+    return bool(contentType) and (contentType in LISTING_TYPES or contentType.startswith("text/"))
+
+def newCompressor(encoding, level):
+    # gzip wraps the deflate stream in a gzip header, HTTP deflate in a zlib one
+    return zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+
+def addVary(headers, field):
+    vary = (headers or {}).get("Vary")
+    return f"{vary}, {field}" if vary else field
+
+def markEncoded(headers, encoding):
+    headers["Content-Encoding"] = encoding
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        # The compressed bytes differ from the identity ones, so the tag only promises semantic equivalence
+        headers["ETag"] = "W/" + etag
+
+def listingHeaders(etag):
+    headers = {"Vary": "Accept"}
+    if etag:
+        headers["ETag"] = etag
+    return headers
+
+JSON_VALUE_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+}
+
+class JsonRowEncoder:
+
+    # Turns tuple rows into the JSON text json.dumps gives for the equivalent
+    # dicts, without building the dicts. Keys are formatted once into a
+    # template, and each column is encoded with a single map() when all its
+    # values share a type, which keeps the per-value work in C.
+
+    def __init__(self, columns):
+        self.template = "{" + ", ".join(f"{json.dumps(column)}: %s" for column in columns) + "}"
+
+    def encode(self, rows):
+        columns = []
+        for values in zip(*rows):
+            types = set(map(type, values))
+            encoder = JSON_VALUE_ENCODERS.get(types.pop()) if len(types) == 1 else None
+            columns.append(map(encoder or json.dumps, values))
+        return [self.template % row for row in zip(*columns)]
+
+SQUIRREL_ENCODER = JsonRowEncoder(SQUIRREL_COLUMNS)
+
+def validateBulkRecords(records, fields):
+    # Returns a result slot per record, pre-filled for invalid ones, and the indexes of valid ones
+    results = [None] * len(records)
+    valid = []
+    for index, record in enumerate(records):
+        error = bulkRecordError(record, fields)
+        if error:
+            results[index] = {"status": 400, "error": error}
+        else:
+            valid.append(index)
+    return results, valid
+
+def bulkRecordError(record, fields):
+    if not isinstance(record, dict):
+        return "expected an object"
+    for field in fields:
+        if field not in record:
+            return f"missing {field}"
+    squirrelId = record.get("id")
+    if "id" in fields and (not isinstance(squirrelId, int) or isinstance(squirrelId, bool)
+                           or squirrelId not in SQLITE_INTEGER_RANGE):
+        return "id must be an integer"
+    for field in ("name", "size"):
+        if field in fields and not isinstance(record[field], str):
+            return f"{field} must be a string"
+    return None
 
+class SquirrelHTTPServer(HTTPServer):
+
+    watchesIdle = False
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def shutdown_request(self, request):
+        # A connection handed to the change feed stays open after its handler returns
+        if not self.changes.isParked(request):
+            super().shutdown_request(request)
+
+class ThreadPoolHTTPServer(SquirrelHTTPServer):
+
+    request_queue_size = 128
+    # Idle keep-alive connections wait in a selector, not in a worker thread
+    watchesIdle = True
+    keepAliveTimeout = 15.0
+
+    def __init__(self, serverAddress, handlerClass, workers=16, reusePort=False):
+        self.allow_reuse_port = reusePort
+        # Before binding: a failed bind calls server_close, which shuts the executor down
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="squirrel-worker")
+        self.idleSelector = selectors.DefaultSelector()
+        self.idleQueue = queue.SimpleQueue()
+        self.wakeReader, self.wakeWriter = socket.socketpair()
+        self.wakeWriter.setblocking(False)
+        self.idleSelector.register(self.wakeReader, selectors.EVENT_READ)
+        self.closing = False
+        self.idleThread = threading.Thread(target=self.watchIdle, name="squirrel-idle", daemon=True)
+        self.idleThread.start()
+        super().__init__(serverAddress, handlerClass)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.processRequestWorker, request, client_address)
+
+    def processRequestWorker(self, request, client_address):
+        handler = None
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.parkOrClose(handler, request)
+
+    def resumeWorker(self, handler):
+        try:
+            try:
+                handler.handle()
+            finally:
+                handler.finish()
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+        finally:
+            self.parkOrClose(handler, handler.request)
+
+    def parkOrClose(self, handler, request):
+        if handler is None or not handler.idle:
+            self.shutdown_request(request)
+        elif self.closing:
+            self.closeIdle(handler)
+        else:
+            handler.idleSince = time.monotonic()
+            self.idleQueue.put(handler)
+            self.wakeIdle()
+
+    def wakeIdle(self):
+        try:
+            self.wakeWriter.send(b"\0")
+        except BlockingIOError:
+            # Already full of wake-ups, so the watcher is bound to look again
+            pass
+        except OSError:
+            pass
+
+    def watchIdle(self):
+        # The only thread touching idleSelector: connections are handed over
+        # through idleQueue and come back out through the executor
+        handlers = set()
+        while not self.closing:
+            while not self.idleQueue.empty():
+                handler = self.idleQueue.get()
+                self.idleSelector.register(handler.connection, selectors.EVENT_READ, handler)
+                handlers.add(handler)
+            for key, events in self.idleSelector.select(timeout=1.0):
+                if key.fileobj is self.wakeReader:
+                    self.wakeReader.recv(4096)
+                    continue
+                self.idleSelector.unregister(key.fileobj)
+                handlers.discard(key.data)
+                self.executor.submit(self.resumeWorker, key.data)
+            expired = time.monotonic() - self.keepAliveTimeout
+            for handler in [handler for handler in handlers if handler.idleSince < expired]:
+                self.idleSelector.unregister(handler.connection)
+                handlers.discard(handler)
+                self.closeIdle(handler)
+        while not self.idleQueue.empty():
+            handlers.add(self.idleQueue.get())
+        for handler in handlers:
+            self.closeIdle(handler)
+
+    def closeIdle(self, handler):
+        handler.idle = False
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def server_close(self):
+        super().server_close()
+        self.closing = True
+        self.wakeIdle()
+        self.idleThread.join(timeout=5)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.idleSelector.close()
+        self.wakeReader.close()
+        self.wakeWriter.close()
+
+MODES = ("single", "threaded", "prefork", "asyncio")
+
+def configureServer(server, poolSize, dbPath=DB_PATH, keepAliveTimeout=15.0, maxKeepAliveRequests=1000,
+                    cacheSize=1024, cacheTtl=5.0, dbProfile=None, batchWrites=False, batchSize=256, batchWindow=0.002,
+                    traceFile=None, traceRate=0.0, profileDir=None,
+                    compressMinBytes=1024, compressLevel=6, compressCacheSize=64, changesPoll=0.25):
+    cache = SquirrelCache(cacheSize, cacheTtl) if cacheSize > 0 else None
+    writer = (WriteBatcher(dbPath, cache=cache, profile=dbProfile, maxBatch=batchSize, maxDelay=batchWindow)
+              if batchWrites else None)
+    server.pool = SquirrelDBPool(dbPath, maxSize=poolSize, cache=cache, profile=dbProfile, writer=writer)
+    server.pool.warm()
+    server.keepAliveTimeout = keepAliveTimeout
+    server.maxKeepAliveRequests = maxKeepAliveRequests
+    # Without a trace file the trace header is ignored, so clients cannot turn tracing on by themselves
+    server.tracer = Tracer(traceFile, traceRate, profileDir) if traceFile else None
+    # compressMinBytes None turns compression off; compressed bodies are cached by entity tag, so no
+    # invalidation is needed and the cache also works in prefork mode
+    server.compressMinBytes = compressMinBytes
+    server.compressLevel = compressLevel
+    server.compressedBodies = (LRUCache(compressCacheSize, ttl=60.0)
+                               if compressMinBytes is not None and compressCacheSize > 0 else None)
+    server.changes = ChangeHub(server.pool, pollInterval=changesPoll)
+
+def makeServer(listen, mode, workers, reusePort=False, **options):
+    if mode == "single":
+        server = SquirrelHTTPServer(listen, SquirrelServerHandler)
+        # A persistent connection would block every other client
+        configureServer(server, 1, **dict(options, maxKeepAliveRequests=1))
+    else:
+        server = ThreadPoolHTTPServer(listen, SquirrelServerHandler, workers=workers, reusePort=reusePort)
+        configureServer(server, workers, **options)
+    return server
+
+def serveForever(server):
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.changes.close()
+        server.pool.close()
+        if server.tracer is not None:
+            server.tracer.close()
+
+def runPreforked(listen, processes, workers, **options):
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                serveForever(makeServer(listen, "threaded", workers, reusePort=True, **options))
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stderr.flush()
+                os._exit(status)
+        children.append(pid)
+    stopping = False
+
+    def stopChildren(signum=None, frame=None):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stopChildren)
+    signal.signal(signal.SIGINT, stopChildren)
+    failed = 0
+    remaining = set(children)
+    while remaining:
+        pid, status = os.wait()
+        remaining.discard(pid)
+        if stopping and os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGTERM:
+            continue
+        if os.waitstatus_to_exitcode(status) != 0:
+            failed += 1
+            if not stopping:
+                # One worker failing (e.g. the port is taken) takes the server down instead of leaving it degraded
+                print(f"squirrel_server: worker process {pid} failed, stopping the others", file=sys.stderr, flush=True)
+                stopChildren()
+    return 1 if failed else 0
+
+def run(host="127.0.0.1", port=8080, mode="threaded", workers=16, processes=None, dbPath=DB_PATH,
+        keepAliveTimeout=15.0, maxKeepAliveRequests=1000, cacheSize=1024, cacheTtl=5.0,
+        dbProfile="fast", dbPragmas=None, batchWrites=False, batchSize=256, batchWindow=0.002,
+        traceFile=None, traceRate=0.0, profileDir=None,
+        compressMinBytes=1024, compressLevel=6, compressCacheSize=64, changesPoll=0.25):
+    if mode not in MODES:
+        raise ValueError(f"unknown server mode: {mode}")
+    listen = (host, port)
+    profile = resolveProfile(dbProfile, dbPragmas)
+    print(f"squirrel_server: SQLite profile {describeProfile(dbProfile, profile)}", flush=True)
+    # Create or migrate the schema once, before any worker process opens the database
+    db = SquirrelDB(dbPath, profile=profile)
+    print(f"squirrel_server: {dbPath} at schema version {db.schemaVersion}", flush=True)
+    db.close()
+    if mode == "prefork" and cacheSize:
+        # Worker processes cannot invalidate each other's caches
+        print("squirrel_server: read cache disabled in prefork mode", flush=True)
+        cacheSize = 0
+    options = {
+        "dbPath": dbPath,
+        "keepAliveTimeout": keepAliveTimeout,
+        "maxKeepAliveRequests": maxKeepAliveRequests,
+        "cacheSize": cacheSize,
+        "cacheTtl": cacheTtl,
+        "dbProfile": profile,
+        "batchWrites": batchWrites,
+        "batchSize": batchSize,
+        "batchWindow": batchWindow,
+        "traceFile": traceFile,
+        "traceRate": traceRate,
+        "profileDir": profileDir,
+        "compressMinBytes": compressMinBytes,
+        "compressLevel": compressLevel,
+        "compressCacheSize": compressCacheSize,
+        "changesPoll": changesPoll,
+    }
+    if batchWrites:
+        print(f"squirrel_server: group commit on (up to {batchSize} writes per {batchWindow * 1000:g} ms)", flush=True)
+    if traceFile:
+        profiling = f", cProfile dumps in {profileDir}" if profileDir else ""
+        print(f"squirrel_server: tracing {traceRate:.1%} of requests plus those sending {TRACE_HEADER} "
+              f"to {traceFile}{profiling}", flush=True)
+    if compressMinBytes is None:
+        print("squirrel_server: response compression off", flush=True)
+    else:
+        print(f"squirrel_server: gzip/deflate for responses from {compressMinBytes} bytes "
+              f"(level {compressLevel}, {compressCacheSize} cached bodies)", flush=True)
+    if mode == "prefork":
+        processes = processes or os.cpu_count() or 1
+        print(f"squirrel_server running at {host}:{port} (prefork, {processes} processes x {workers} workers)", flush=True)
+        return runPreforked(listen, processes, workers, **options)
+    elif mode == "asyncio":
+        from squirrel_async import runAsync
+        print(f"squirrel_server running at {host}:{port} (asyncio, {workers} database workers)", flush=True)
+        runAsync(listen, workers, **options)
+    else:
+        server = makeServer(listen, mode, workers, **options)
+        detail = "single" if mode == "single" else f"threaded, {workers} workers"
+        print(f"squirrel_server running at {host}:{port} ({detail})", flush=True)
+        serveForever(server)
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description="Squirrel REST server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--mode", choices=MODES, default="threaded")
+    parser.add_argument("--workers", type=int, default=16, help="worker threads per process (database threads in asyncio mode)")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes in prefork mode (default: CPU count)")
+    parser.add_argument("--keepalive-timeout", type=float, default=15.0, help="seconds an idle persistent connection is kept open")
+    parser.add_argument("--max-keepalive-requests", type=int, default=1000, help="requests served per connection before closing it")
+    parser.add_argument("--cache-size", type=int, default=1024, help="squirrels kept in the read cache (0 disables it)")
+    parser.add_argument("--cache-ttl", type=float, default=5.0, help="seconds a cached read stays valid")
+    parser.add_argument("--db-path", default=os.environ.get("SQUIRREL_DB_PATH") or DB_PATH,
+                        help=f"SQLite database file, created if missing (default {DB_PATH}; env SQUIRREL_DB_PATH)")
+    parser.add_argument("--db-profile", choices=sorted(PROFILES), default="fast", help="SQLite tuning profile")
+    parser.add_argument("--db-pragma", action="append", default=[], metavar="NAME=VALUE",
+                        help="override one setting of the profile, e.g. synchronous=FULL (repeatable)")
+    parser.add_argument("--batch-writes", action="store_true", help="coalesce concurrent writes into shared commits")
+    parser.add_argument("--batch-size", type=int, default=256, help="most writes committed together")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="how long a batch waits for more writes")
+    parser.add_argument("--trace-file", default=os.environ.get("SQUIRREL_TRACE_FILE"),
+                        help="append per-phase request timings here as JSON lines (env SQUIRREL_TRACE_FILE)")
+    parser.add_argument("--trace-rate", type=float, default=float(os.environ.get("SQUIRREL_TRACE_RATE") or 0),
+                        help=f"fraction of requests to trace; others only when they send {TRACE_HEADER} (env SQUIRREL_TRACE_RATE)")
+    parser.add_argument("--profile-dir", default=os.environ.get("SQUIRREL_PROFILE_DIR"),
+                        help=f"write a cProfile dump for requests sending {TRACE_HEADER}: profile (env SQUIRREL_PROFILE_DIR)")
+    parser.add_argument("--compress-min-bytes", type=int, default=1024,
+                        help="smallest response body sent gzip or deflate compressed")
+    parser.add_argument("--compress-level", type=int, choices=range(1, 10), default=6, metavar="1-9",
+                        help="zlib compression level")
+    parser.add_argument("--compress-cache-size", type=int, default=64,
+                        help="compressed response bodies kept for reuse (0 disables the cache)")
+    parser.add_argument("--no-compression", action="store_true", help="never compress responses")
+    parser.add_argument("--changes-poll-ms", type=float, default=250.0,
+                        help="how often waiting change feed clients are checked for writes made by other processes")
+    return parser.parse_args(argv)
+
+def parsePragmas(pairs):
+    pragmas = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        pragmas[key.strip()] = value.strip()
+    return pragmas
+
+if __name__ == '__main__':
+    args = parseArgs()
+    status = run(host=args.host, port=args.port, mode=args.mode, workers=args.workers, processes=args.processes,
+        dbPath=args.db_path,
+        keepAliveTimeout=args.keepalive_timeout, maxKeepAliveRequests=args.max_keepalive_requests,
+        cacheSize=args.cache_size, cacheTtl=args.cache_ttl,
+        dbProfile=args.db_profile, dbPragmas=parsePragmas(args.db_pragma),
+        batchWrites=args.batch_writes, batchSize=args.batch_size, batchWindow=args.batch_window_ms / 1000,
+        traceFile=args.trace_file, traceRate=args.trace_rate, profileDir=args.profile_dir,
+        compressMinBytes=None if args.no_compression else args.compress_min_bytes,
+        compressLevel=args.compress_level, compressCacheSize=args.compress_cache_size,
+        changesPoll=args.changes_poll_ms / 1000)
+    sys.exit(status)
@@ -0,0 +1,130 @@
+import cProfile
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from contextlib import nullcontext
+
+# Opt-in request tracing. A traced request records how long it spends in each
+# phase of the handler pipeline and is written to a JSON-lines file, one
+# object per request. Time is charged to the innermost open phase only, so
+# the phases add up to the request total (the rest is reported as "other").
+
+TRACE_HEADER = "X-Squirrel-Trace"
+TRACE_VALUES = ("1", "true", "on", "profile")
+ACTIVE = threading.local()
+
+def currentTrace():
+    return getattr(ACTIVE, "trace", None)
+
+class NullTrace:
+
+    def __bool__(self):
+        return False
+
+    def phase(self, name):
+        return NULL_PHASE
+
+NULL_PHASE = nullcontext()
+NULL_TRACE = NullTrace()
+
+class Phase:
+
+    __slots__ = ("trace", "name")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.trace.enter(self.name)
+
+    def __exit__(self, *exc):
+        self.trace.exit()
+
+class Trace:
+
+    def __init__(self, started):
+        self.id = secrets.token_hex(8)
+        self.started = started
+        self.phases = {}
+        self.stack = []
+        self.mark = started
+        self.profiler = None
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            self.charge(self.stack[-1], now)
+        self.stack.append(name)
+        self.mark = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.charge(self.stack.pop(), now)
+        self.mark = now
+
+    def charge(self, name, now):
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.mark
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def lap(self, name):
+        # Charges the time since the last phase boundary to name
+        now = time.perf_counter()
+        self.charge(name, now)
+        self.mark = now
+
+class Tracer:
+
+    def __init__(self, path, rate=0.0, profileDir=None):
+        self.path = path
+        self.rate = rate
+        self.profileDir = profileDir
+        # O_APPEND and one write per record keep lines whole across prefork processes
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # cProfile can only run one profiler at a time; a request that finds it busy is traced without it
+        self.profiling = threading.Lock()
+        if profileDir:
+            os.makedirs(profileDir, exist_ok=True)
+
+    def start(self, started, requested):
+        # requested is the value of the trace header: "1" to trace, "profile" to also run cProfile
+        requested = (requested or "").strip().lower()
+        if requested not in TRACE_VALUES and not (self.rate and random.random() < self.rate):
+            return NULL_TRACE
+        trace = Trace(started)
+        if requested == "profile" and self.profileDir and self.profiling.acquire(blocking=False):
+            trace.profiler = cProfile.Profile()
+            trace.profiler.enable()
+        ACTIVE.trace = trace
+        return trace
+
+    def finish(self, trace, method, path, status):
+        ACTIVE.trace = None
+        now = time.perf_counter()
+        while trace.stack:
+            trace.exit()
+        record = {
+            "id": trace.id,
+            "time": round(time.time(), 6),
+            "pid": os.getpid(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "total_ms": round((now - trace.started) * 1000, 3),
+            "phases": {name: round(seconds * 1000, 3) for name, seconds in trace.phases.items()},
+        }
+        record["phases"]["other"] = round(max(0.0, record["total_ms"] - sum(record["phases"].values())), 3)
+        if trace.profiler is not None:
+            trace.profiler.disable()
+            self.profiling.release()
+            record["profile"] = os.path.join(self.profileDir, f"{trace.id}.prof")
+            trace.profiler.dump_stats(record["profile"])
+        os.write(self.fd, (json.dumps(record) + "\n").encode("utf-8"))
+
+    def close(self):
+        os.close(self.fd)
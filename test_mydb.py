@@ -1,6 +1,12 @@
 import os
+import pickle
+import struct
+import subprocess
+import sys
+import time
 import pytest
-from mydb import MyDB
+import mydb
+from mydb import LOG_MAGIC, MAGIC, MyDB, SegmentedMyDB
 
 def describe_MyDB():
 
@@ -262,4 +268,583 @@ def describe_MyDB():
             assert loaded == ["a", "b", "c", "d"]
             
             # teardown
-            os.remove(test_file)
\ No newline at end of file
+            os.remove(test_file)
+
+
+        def it_appends_without_rewriting_existing_records():
+            # setup
+            test_file = "test_append_log.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["x" * 1000] * 100)
+            with open(test_file, "rb") as f:
+                before = f.read()
+
+            # exercise
+            db.saveString("tail")
+
+            # verify
+            with open(test_file, "rb") as f:
+                after = f.read()
+            assert after.startswith(before)
+            assert len(after) - len(before) == 4 + len("tail")
+
+            # teardown
+            os.remove(test_file)
+
+        def it_round_trips_non_ascii_strings():
+            # setup
+            test_file = "test_append_unicode.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+
+            # exercise
+            db.saveString("écureuil")
+            db.saveString("松鼠 🐿")
+            db.saveString("")
+
+            # verify
+            assert db.loadStrings() == ["écureuil", "松鼠 🐿", ""]
+
+            # teardown
+            os.remove(test_file)
+
+    def describe_log_format():
+
+        def it_ignores_a_torn_trailing_record():
+            # setup
+            test_file = "test_log_torn.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["complete"])
+            with open(test_file, "ab") as f:
+                f.write(struct.pack("<I", 100) + b"partial")
+
+            # exercise
+            result = db.loadStrings()
+
+            # verify
+            assert result == ["complete"]
+
+            # teardown
+            os.remove(test_file)
+
+        def it_migrates_a_pickle_database_once():
+            # setup
+            test_file = "test_log_migrate.db"
+            with open(test_file, "wb") as f:
+                pickle.dump(["legacy", "pickled"], f)
+
+            # exercise
+            db = MyDB(test_file)
+            db.saveString("appended")
+
+            # verify
+            with open(test_file, "rb") as f:
+                assert f.read(len(MAGIC)) == MAGIC
+            assert db.loadStrings() == ["legacy", "pickled", "appended"]
+            assert MyDB(test_file).loadStrings() == ["legacy", "pickled", "appended"]
+
+            # teardown
+            os.remove(test_file)
+
+        def it_migrates_an_append_log_database():
+            # setup
+            test_file = "test_log_migrate_v1.db"
+            with open(test_file, "wb") as f:
+                f.write(LOG_MAGIC)
+                for s in ["from", "log"]:
+                    f.write(struct.pack("<I", len(s)) + s.encode())
+
+            # exercise
+            db = MyDB(test_file)
+
+            # verify
+            assert db.loadStrings() == ["from", "log"]
+            assert db.get(1) == "log"
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+        def it_refuses_pickles_that_are_not_plain_strings():
+            # setup
+            test_file = "test_log_unsafe.db"
+            with open(test_file, "wb") as f:
+                pickle.dump([os.path.join], f)
+
+            # exercise / verify
+            with pytest.raises(pickle.UnpicklingError):
+                MyDB(test_file)
+
+            # teardown
+            os.remove(test_file)
+
+        def it_round_trips_strings_containing_nul():
+            # setup
+            test_file = "test_log_nul.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            data = ["a\x00b", "", "\x00", "ü"]
+
+            # exercise
+            db.saveStrings(data)
+
+            # verify
+            assert db.loadStrings() == data
+            assert list(db) == data
+            assert db[0:4] == data
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+    def describe_iterStrings():
+
+        def it_yields_strings_in_order():
+            # setup
+            test_file = "test_iter_order.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["a", "b"])
+            db.saveString("c")
+
+            # exercise
+            iterator = db.iterStrings()
+
+            # verify
+            assert next(iterator) == "a"
+            assert list(iterator) == ["b", "c"]
+            assert list(db) == ["a", "b", "c"]
+
+            # teardown
+            os.remove(test_file)
+
+    def describe_random_access():
+
+        def it_gets_strings_by_index():
+            # setup
+            test_file = "test_get_index.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings([f"item{i}" for i in range(1000)])
+
+            # exercise
+            first, middle, last = db.get(0), db.get(500), db[-1]
+
+            # verify
+            assert (first, middle, last) == ("item0", "item500", "item999")
+            assert len(db) == 1000
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+        def it_slices_strings():
+            # setup
+            test_file = "test_get_slice.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings([str(i) for i in range(10)])
+
+            # exercise
+            result = db[2:8:3]
+
+            # verify
+            assert result == ["2", "5"]
+            assert db[8:] == ["8", "9"]
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+        def it_raises_index_error_out_of_range():
+            # setup
+            test_file = "test_get_range.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["only"])
+
+            # exercise / verify
+            with pytest.raises(IndexError):
+                db.get(1)
+            with pytest.raises(IndexError):
+                db.get(-2)
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+        def it_sees_appends_and_rewrites_after_indexing():
+            # setup
+            test_file = "test_get_refresh.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["one", "two"])
+            assert len(db) == 2
+
+            # exercise
+            MyDB(test_file).saveString("three")
+            appended = db[-1]
+            db.saveStrings(["fresh"])
+
+            # verify
+            assert appended == "three"
+            assert len(db) == 1
+            assert db.get(0) == "fresh"
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+    def describe_cache():
+
+        def it_does_not_reread_the_file_for_repeated_reads_and_appends(monkeypatch):
+            # setup
+            test_file = "test_cache_reads.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["a"])
+            reads = []
+            def countingOpen(path, mode="r", *args, **kwargs):
+                if "r" in mode:
+                    reads.append(path)
+                return open(path, mode, *args, **kwargs)
+            monkeypatch.setattr(mydb, "open", countingOpen, raising=False)
+
+            # exercise
+            for s in ["b", "c", "d"]:
+                db.saveString(s)
+                loaded = db.loadStrings()
+
+            # verify
+            assert loaded == ["a", "b", "c", "d"]
+            assert db.get(3) == "d"
+            assert reads == []
+
+            # teardown
+            os.remove(test_file)
+
+        def it_picks_up_appends_from_another_instance():
+            # setup
+            test_file = "test_cache_appends.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["mine"])
+            other = MyDB(test_file)
+
+            # exercise
+            other.saveString("theirs")
+
+            # verify
+            assert db.loadStrings() == ["mine", "theirs"]
+            assert len(db) == 2
+
+            # teardown
+            os.remove(test_file)
+
+        def it_reloads_after_another_instance_rewrites():
+            # setup
+            test_file = "test_cache_rewrite.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["old"])
+            assert db.loadStrings() == ["old"]
+
+            # exercise
+            MyDB(test_file).saveStrings(["new", "data"])
+
+            # verify
+            assert db.loadStrings() == ["new", "data"]
+
+            # teardown
+            os.remove(test_file)
+
+        def it_reads_from_the_file_without_cache():
+            # setup
+            test_file = "test_cache_disabled.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file, cache=False)
+            db.saveStrings(["x", "y"])
+            db.saveString("z")
+
+            # exercise
+            result = (db.loadStrings(), db.get(2), db[0:2], len(db), list(db))
+
+            # verify
+            assert result == (["x", "y", "z"], "z", ["x", "y"], 3, ["x", "y", "z"])
+
+            # teardown
+            db.close()
+            os.remove(test_file)
+
+    def describe_write_back():
+
+        def it_keeps_appends_in_memory_until_flushed():
+            # setup
+            test_file = "test_writeback_pending.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file, writeBack=True)
+            db.saveStrings(["stored"])
+
+            # exercise
+            db.saveString("pending")
+
+            # verify
+            assert db.loadStrings() == ["stored", "pending"]
+            assert db[-1] == "pending"
+            assert MyDB(test_file).loadStrings() == ["stored"]
+            db.flush()
+            assert MyDB(test_file).loadStrings() == ["stored", "pending"]
+
+            # teardown
+            os.remove(test_file)
+
+        def it_flushes_when_the_context_exits():
+            # setup
+            test_file = "test_writeback_context.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+
+            # exercise
+            with MyDB(test_file, writeBack=True) as db:
+                db.saveString("one")
+                db.saveString("two")
+
+            # verify
+            assert MyDB(test_file).loadStrings() == ["one", "two"]
+
+            # teardown
+            os.remove(test_file)
+
+        def it_flushes_after_the_interval():
+            # setup
+            test_file = "test_writeback_interval.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file, writeBack=True, flushInterval=0.05)
+
+            # exercise
+            db.saveString("later")
+            deadline = time.monotonic() + 5
+            while MyDB(test_file).loadStrings() == [] and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            # verify
+            assert MyDB(test_file).loadStrings() == ["later"]
+            assert db.pending == []
+
+            # teardown
+            os.remove(test_file)
+
+    def describe_concurrent_writers():
+
+        def it_drops_a_torn_record_before_appending():
+            # setup
+            for cache in (True, False):
+                test_file = "test_writers_torn.db"
+                if os.path.isfile(test_file):
+                    os.remove(test_file)
+                db = MyDB(test_file, cache=cache)
+                db.saveStrings(["complete"])
+                with open(test_file, "ab") as f:
+                    f.write(struct.pack("<I", 100) + b"partial")
+
+                # exercise
+                db.saveString("next")
+
+                # verify
+                assert MyDB(test_file).loadStrings() == ["complete", "next"]
+
+                # teardown
+                db.close()
+                os.remove(test_file)
+
+        def it_appends_to_the_file_that_replaced_the_one_it_read():
+            # setup
+            test_file = "test_writers_replaced.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            db = MyDB(test_file)
+            db.saveStrings(["before"])
+
+            # exercise
+            MyDB(test_file).saveStrings(["replaced"])
+            db.saveString("after")
+
+            # verify
+            assert MyDB(test_file).loadStrings() == ["replaced", "after"]
+            assert db.loadStrings() == ["replaced", "after"]
+
+            # teardown
+            os.remove(test_file)
+
+        def it_keeps_every_append_from_concurrent_processes():
+            # setup
+            test_file = "test_writers_processes.db"
+            if os.path.isfile(test_file):
+                os.remove(test_file)
+            MyDB(test_file)
+            script = ("import sys\n"
+                      "from mydb import MyDB\n"
+                      "db = MyDB(sys.argv[1])\n"
+                      "for i in range(200):\n"
+                      "    db.saveString(f'{sys.argv[2]}-{i}')\n")
+
+            # exercise
+            workers = [subprocess.Popen([sys.executable, "-c", script, test_file, str(n)]) for n in range(4)]
+            for worker in workers:
+                assert worker.wait(timeout=60) == 0
+
+            # verify
+            loaded = MyDB(test_file).loadStrings()
+            assert len(loaded) == 800
+            for n in range(4):
+                assert [s for s in loaded if s.startswith(f"{n}-")] == [f"{n}-{i}" for i in range(200)]
+
+            # teardown
+            os.remove(test_file)
+
+def describe_SegmentedMyDB():
+
+    def it_rolls_over_to_new_segments_and_loads_them_in_order(tmp_path):
+        # setup
+        test_file = str(tmp_path / "segments.db")
+        db = SegmentedMyDB(test_file, segmentBytes=256)
+
+        # exercise
+        for i in range(100):
+            db.saveString(f"item-{i}")
+
+        # verify
+        assert len(db.names) > 3
+        assert all(os.path.isfile(tmp_path / name) for name in db.names)
+        assert db.loadStrings() == [f"item-{i}" for i in range(100)]
+        assert SegmentedMyDB(test_file).loadStrings() == [f"item-{i}" for i in range(100)]
+
+        # teardown
+        db.close()
+
+    def it_reads_by_index_and_iterates_across_segments(tmp_path):
+        # setup
+        db = SegmentedMyDB(str(tmp_path / "segments.db"), segmentBytes=256)
+        for i in range(60):
+            db.saveString(str(i))
+
+        # exercise
+        result = (len(db), db.get(0), db.get(33), db[-1], db[28:32], list(db))
+
+        # verify
+        assert result == (60, "0", "33", "59", ["28", "29", "30", "31"], [str(i) for i in range(60)])
+        with pytest.raises(IndexError):
+            db.get(60)
+
+        # teardown
+        db.close()
+
+    def it_replaces_all_segments_on_saveStrings(tmp_path):
+        # setup
+        db = SegmentedMyDB(str(tmp_path / "segments.db"), segmentBytes=256)
+        for i in range(60):
+            db.saveString(f"old-{i}")
+        old = list(db.names)
+
+        # exercise
+        db.saveStrings([f"new-{i}" for i in range(100)])
+
+        # verify
+        assert db.loadStrings() == [f"new-{i}" for i in range(100)]
+        assert not any(os.path.exists(tmp_path / name) for name in old)
+        assert sorted(os.listdir(tmp_path)) == sorted(["segments.db"] + db.names)
+
+        # teardown
+        db.close()
+
+    def it_compacts_small_sealed_segments(tmp_path):
+        # setup
+        test_file = str(tmp_path / "segments.db")
+        with SegmentedMyDB(test_file, segmentBytes=256) as db:
+            for i in range(200):
+                db.saveString(f"item-{i}")
+        db = SegmentedMyDB(test_file, segmentBytes=64 * 1024)
+        before = db.loadStrings()
+        sealed = len(db.names) - 1
+
+        # exercise
+        replaced = db.compact()
+
+        # verify
+        assert replaced == sealed
+        assert len(db.loadStrings()) == 200
+        assert db.loadStrings() == before
+        assert len(db.names) == 2
+        assert sorted(os.listdir(tmp_path)) == sorted(["segments.db"] + db.names)
+        assert db.compact() == 0
+
+        # teardown
+        db.close()
+
+    def it_compacts_in_the_background(tmp_path):
+        # setup
+        test_file = str(tmp_path / "segments.db")
+        with SegmentedMyDB(test_file, segmentBytes=256) as db:
+            for i in range(100):
+                db.saveString(f"item-{i}")
+
+        # exercise
+        db = SegmentedMyDB(test_file, segmentBytes=64 * 1024, compactInterval=0.01)
+        deadline = time.monotonic() + 5
+        while len(os.listdir(tmp_path)) > 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # verify
+        assert len(os.listdir(tmp_path)) == 3
+        assert db.loadStrings() == [f"item-{i}" for i in range(100)]
+
+        # teardown
+        db.close()
+
+    def it_keeps_every_append_from_concurrent_processes(tmp_path):
+        # setup
+        test_file = str(tmp_path / "segments.db")
+        SegmentedMyDB(test_file, segmentBytes=1024).close()
+        script = ("import sys\n"
+                  "from mydb import SegmentedMyDB\n"
+                  "db = SegmentedMyDB(sys.argv[1], segmentBytes=1024)\n"
+                  "for i in range(200):\n"
+                  "    db.saveString(f'{sys.argv[2]}-{i}')\n")
+
+        # exercise
+        workers = [subprocess.Popen([sys.executable, "-c", script, test_file, str(n)], cwd=os.getcwd(),
+                                    env=dict(os.environ, PYTHONPATH=os.getcwd())) for n in range(4)]
+        for worker in workers:
+            assert worker.wait(timeout=60) == 0
+
+        # verify
+        loaded = SegmentedMyDB(test_file).loadStrings()
+        assert len(loaded) == 800
+        for n in range(4):
+            assert [s for s in loaded if s.startswith(f"{n}-")] == [f"{n}-{i}" for i in range(200)]
+
+    def it_is_refused_by_plain_MyDB(tmp_path):
+        # setup
+        test_file = str(tmp_path / "segments.db")
+        SegmentedMyDB(test_file).close()
+
+        # exercise / verify
+        with pytest.raises(ValueError):
+            MyDB(test_file)
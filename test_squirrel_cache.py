@@ -0,0 +1,108 @@
+import time
+from squirrel_cache import LRUCache, SquirrelCache, MISSING
+
+def describe_LRUCache():
+
+    def describe_get():
+
+        def it_returns_missing_for_an_unknown_key():
+            # setup
+            cache = LRUCache(maxSize=2)
+
+            # exercise / verify
+            assert cache.get("nope") is MISSING
+
+        def it_returns_a_stored_value():
+            # setup
+            cache = LRUCache(maxSize=2)
+            cache.put("a", 1, cache.token())
+
+            # exercise / verify
+            assert cache.get("a") == 1
+
+        def it_expires_entries_after_the_ttl():
+            # setup
+            cache = LRUCache(maxSize=2, ttl=0.01)
+            cache.put("a", 1, cache.token())
+
+            # exercise
+            time.sleep(0.02)
+
+            # verify
+            assert cache.get("a") is MISSING
+
+        def it_counts_hits_and_misses():
+            # setup
+            cache = LRUCache(maxSize=2)
+            cache.put("a", 1, cache.token())
+
+            # exercise
+            cache.get("a")
+            cache.get("b")
+
+            # verify
+            assert cache.stats()["hits"] == 1
+            assert cache.stats()["misses"] == 1
+
+    def describe_put():
+
+        def it_evicts_the_least_recently_used_entry():
+            # setup
+            cache = LRUCache(maxSize=2)
+            cache.put("a", 1, cache.token())
+            cache.put("b", 2, cache.token())
+            cache.get("a")
+
+            # exercise
+            cache.put("c", 3, cache.token())
+
+            # verify
+            assert cache.get("b") is MISSING
+            assert cache.get("a") == 1
+            assert cache.stats()["evictions"] == 1
+
+        def it_drops_a_value_read_before_an_invalidation():
+            # setup
+            cache = LRUCache(maxSize=2)
+            token = cache.token()
+            cache.invalidate("a")
+
+            # exercise
+            cache.put("a", "stale", token)
+
+            # verify
+            assert cache.get("a") is MISSING
+
+    def describe_invalidate():
+
+        def it_removes_only_the_given_key():
+            # setup
+            cache = LRUCache(maxSize=2)
+            cache.put("a", 1, cache.token())
+            cache.put("b", 2, cache.token())
+
+            # exercise
+            cache.invalidate("a")
+
+            # verify
+            assert cache.get("a") is MISSING
+            assert cache.get("b") == 2
+
+def describe_SquirrelCache():
+
+    def describe_invalidateRow():
+
+        def it_drops_the_row_and_every_listing():
+            # setup
+            cache = SquirrelCache(maxSize=16)
+            cache.rows.put(1, {"id": 1}, cache.rows.token())
+            cache.rows.put(2, {"id": 2}, cache.rows.token())
+            cache.listings.put("all", [], cache.listings.token())
+
+            # exercise
+            cache.invalidateRow("1")
+
+            # verify
+            assert cache.rows.get(1) is MISSING
+            assert cache.rows.get(2) == {"id": 2}
+            assert cache.listings.get("all") is MISSING
@@ -0,0 +1,195 @@
+import json
+import socket
+import threading
+import time
+import pytest
+from squirrel_changes import ChangeHub, changesBody, sseEvents
+from squirrel_db import SquirrelDBPool
+
+class RecordingSink:
+
+    def __init__(self, failing=False):
+        self.writes = []
+        self.failing = failing
+        self.closed = threading.Event()
+
+    def write(self, data):
+        if self.failing:
+            raise BrokenPipeError()
+        self.writes.append(data)
+
+    def flush(self):
+        return True
+
+    def close(self):
+        self.closed.set()
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SquirrelDBPool(str(tmp_path / "squirrels.db"), maxSize=2)
+    yield pool
+    pool.close()
+
+@pytest.fixture
+def hub(pool):
+    hub = ChangeHub(pool, pollInterval=0.02, heartbeat=0.05)
+    yield hub
+    hub.close()
+
+def describe_ChangeHub():
+
+    def it_answers_a_long_poll_with_the_first_write_and_lets_go(pool, hub):
+        # setup
+        sink = RecordingSink()
+        hub.subscribe(sink, 0, timeout=5)
+
+        # exercise
+        with pool.connection() as db:
+            db.createSquirrel("Fluffy", "large")
+        hub.notify()
+
+        # verify
+        assert sink.closed.wait(2)
+        body = json.loads(sink.writes[0])
+        assert [change["op"] for change in body["changes"]] == ["create"]
+        assert body["last_seq"] == 1
+
+    def it_answers_an_expired_long_poll_with_no_changes(hub):
+        # setup
+        sink = RecordingSink()
+
+        # exercise
+        hub.subscribe(sink, 0, timeout=0.05)
+
+        # verify
+        assert sink.closed.wait(2)
+        assert json.loads(sink.writes[0]) == {"changes": [], "last_seq": 0}
+
+    def it_keeps_streaming_events_to_a_stream_subscriber(pool, hub):
+        # setup
+        sink = RecordingSink()
+        hub.subscribe(sink, 0)
+
+        # exercise
+        with pool.connection() as db:
+            db.createSquirrel("Fluffy", "large")
+            hub.notify()
+            time.sleep(0.1)
+            db.deleteSquirrel("1")
+            hub.notify()
+            time.sleep(0.1)
+
+        # verify
+        events = b"".join(sink.writes)
+        assert events.count(b"id: ") == 2
+        assert b"id: 2\ndata: " in events
+        assert b": keepalive\n\n" in events
+        assert not sink.closed.is_set()
+
+    def it_drops_a_subscriber_whose_writes_fail(hub):
+        # setup
+        sink = RecordingSink(failing=True)
+
+        # exercise
+        hub.subscribe(sink, 0)
+
+        # verify
+        assert sink.closed.wait(2)
+
+    def it_drops_a_subscriber_ahead_of_the_log(hub):
+        # setup
+        sink = RecordingSink()
+
+        # exercise
+        hub.subscribe(sink, 5, timeout=5)
+
+        # verify
+        assert sink.closed.wait(2)
+        assert sink.writes == []
+
+    def it_answers_other_subscribers_while_one_stops_reading(pool, hub):
+        # setup
+        stuck, peer = socket.socketpair()
+        stuck.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        hub.subscribe(hub.socketSink(stuck), 0)
+        with pool.connection() as db:
+            db.createSquirrels([(f"Squirrel{i}", "small") for i in range(3000)])
+        hub.notify()
+        time.sleep(0.1)
+        sink = RecordingSink()
+        started = time.monotonic()
+
+        # exercise
+        hub.subscribe(sink, 0, timeout=5)
+
+        # verify
+        assert sink.closed.wait(2)
+        assert time.monotonic() - started < 1
+
+        # teardown
+        peer.close()
+
+    def it_closes_every_subscriber_when_it_closes(pool):
+        # setup
+        hub = ChangeHub(pool, pollInterval=0.02)
+        sink = RecordingSink()
+        hub.subscribe(sink, 0)
+
+        # exercise
+        hub.close()
+
+        # verify
+        assert sink.closed.is_set()
+
+def describe_formatting():
+
+    def it_reports_since_as_last_seq_when_nothing_changed():
+        # exercise / verify
+        assert json.loads(changesBody([], 7)) == {"changes": [], "last_seq": 7}
+
+    def it_writes_one_event_per_change_with_its_sequence_number():
+        # setup
+        changes = [{"seq": 3, "op": "delete", "id": 1, "squirrel": None}]
+
+        # exercise
+        events = sseEvents(changes)
+
+        # verify
+        assert events == b'id: 3\ndata: {"seq": 3, "op": "delete", "id": 1, "squirrel": null}\n\n'
+
+def describe_SocketSink():
+
+    def it_drops_a_client_that_lets_too_much_pile_up(hub):
+        # setup
+        sock, peer = socket.socketpair()
+        sink = hub.socketSink(sock)
+
+        # exercise / verify
+        with pytest.raises(ConnectionResetError):
+            for _ in range(100):
+                sink.write(b"x" * 65536)
+
+        # teardown
+        sink.release()
+        peer.close()
+
+    def it_finishes_sending_a_long_poll_answer_after_letting_go(hub):
+        # setup
+        sock, peer = socket.socketpair()
+        sink = hub.socketSink(sock)
+        body = b"x" * 500000
+
+        # exercise
+        sink.write(body)
+        sink.close()
+        peer.settimeout(2)
+        received = b""
+        while chunk := peer.recv(65536):
+            received += chunk
+
+        # verify
+        assert received == body
+        assert not hub.isParked(sock)
+
+        # teardown
+        peer.close()
@@ -0,0 +1,723 @@
+import os
+import sqlite3
+import threading
+import pytest
+from squirrel_cache import SquirrelCache
+from concurrent.futures import ThreadPoolExecutor
+from squirrel_db import SCHEMA_VERSION, SquirrelDBPool, PoolTimeout, WriteBatcher, pageQuery, prefixUpperBound, resolveProfile
+
+def create_database(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS squirrels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            size TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "squirrels.db")
+    create_database(path)
+    return path
+
+def describe_SquirrelDBPool():
+
+    def describe_connection():
+
+        def it_reuses_a_returned_connection(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=2)
+            with pool.connection() as db:
+                first = db
+
+            # exercise
+            with pool.connection() as db:
+                second = db
+
+            # verify
+            assert first is second
+            assert pool.stats()["opened"] == 1
+
+            # teardown
+            pool.close()
+
+        def it_opens_at_most_max_size_connections(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=2, timeout=0.1)
+            a = pool.acquire()
+            b = pool.acquire()
+
+            # exercise / verify
+            with pytest.raises(PoolTimeout):
+                pool.acquire()
+
+            # teardown
+            pool.release(a)
+            pool.release(b)
+            pool.close()
+
+        def it_hands_a_connection_to_a_waiting_thread_when_released(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, timeout=5)
+            held = pool.acquire()
+            acquired = []
+            waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+            waiter.start()
+
+            # exercise
+            pool.release(held)
+            waiter.join(timeout=5)
+
+            # verify
+            assert acquired == [held]
+
+            # teardown
+            pool.release(held)
+            pool.close()
+
+        def it_rolls_back_uncommitted_work_on_release(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.cursor.execute("INSERT INTO squirrels (name, size) VALUES ('Ghost', 'small')")
+
+            # exercise
+            with pool.connection() as db:
+                squirrels = db.getSquirrels()
+
+            # verify
+            assert squirrels == []
+
+            # teardown
+            pool.close()
+
+    def describe_health_checks():
+
+        def it_reconnects_when_the_database_file_is_replaced(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrel("Old", "small")
+                first = db
+            os.remove(db_path)
+            create_database(db_path)
+
+            # exercise
+            with pool.connection() as db:
+                squirrels = db.getSquirrels()
+                second = db
+
+            # verify
+            assert second is not first
+            assert squirrels == []
+
+            # teardown
+            pool.close()
+
+        def it_pings_connections_that_were_idle_too_long(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, pingAfter=0)
+            with pool.connection() as db:
+                first = db
+            first.connection.close()
+
+            # exercise
+            with pool.connection() as db:
+                second = db
+
+            # verify
+            assert second is not first
+
+            # teardown
+            pool.close()
+
+    def describe_warm():
+
+        def it_opens_and_returns_connections_ahead_of_requests(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=3)
+
+            # exercise
+            pool.warm()
+
+            # verify
+            stats = pool.stats()
+            assert (stats["opened"], stats["idle"], stats["in_use"]) == (3, 3, 0)
+
+            # teardown
+            pool.close()
+
+def describe_resolveProfile():
+
+    def it_applies_overrides_on_top_of_the_named_profile():
+        # exercise
+        profile = resolveProfile("fast", {"synchronous": "FULL"})
+
+        # verify
+        assert profile["journal_mode"] == "WAL"
+        assert profile["synchronous"] == "FULL"
+
+    def it_rejects_unknown_pragmas():
+        # exercise / verify
+        with pytest.raises(ValueError):
+            resolveProfile("fast", {"writable_schema": "ON"})
+
+    def it_rejects_values_that_are_not_plain_words_or_numbers():
+        # exercise / verify
+        with pytest.raises(ValueError):
+            resolveProfile("fast", {"synchronous": "OFF; DROP TABLE squirrels"})
+
+def describe_SquirrelDB():
+
+    def describe_migrate():
+
+        def it_creates_the_schema_in_an_empty_database(tmp_path):
+            # setup
+            pool = SquirrelDBPool(str(tmp_path / "new.db"), maxSize=1)
+
+            # exercise
+            with pool.connection() as db:
+                squirrelId = db.createSquirrel("Fresh", "small")
+                version = db.connection.execute("PRAGMA user_version").fetchone()["user_version"]
+
+            # verify
+            assert squirrelId == 1
+            assert version == SCHEMA_VERSION
+
+            # teardown
+            pool.close()
+
+        def it_upgrades_a_database_made_before_migrations_and_keeps_its_rows(db_path):
+            # setup
+            conn = sqlite3.connect(db_path)
+            conn.execute("INSERT INTO squirrels (name, size) VALUES ('Old', 'small')")
+            conn.commit()
+            conn.close()
+
+            # exercise
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                squirrels = db.getSquirrels({"name": "Old"})
+                indexes = {row["name"] for row in db.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+            # verify
+            assert [s["name"] for s in squirrels] == ["Old"]
+            assert {"squirrels_name_index", "squirrels_size_index"} <= indexes
+
+            # teardown
+            pool.close()
+
+    def describe_profile():
+
+        def it_applies_the_profile_to_every_pooled_connection(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, profile=resolveProfile("fast"))
+
+            # exercise
+            with pool.connection() as db:
+                journalMode = db.connection.execute("PRAGMA journal_mode").fetchone()["journal_mode"]
+                synchronous = db.connection.execute("PRAGMA synchronous").fetchone()["synchronous"]
+
+            # verify
+            assert journalMode == "wal"
+            assert synchronous == 1
+
+            # teardown
+            pool.close()
+
+    def describe_iterSquirrelBatches():
+
+        def it_yields_all_rows_in_batches_of_the_given_size(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                for name in ["A", "B", "C"]:
+                    db.createSquirrel(name, "small")
+
+                # exercise
+                batches = list(db.iterSquirrelBatches(batchSize=2))
+
+            # verify
+            assert [[s["name"] for s in batch] for batch in batches] == [["A", "B"], ["C"]]
+
+            # teardown
+            pool.close()
+
+    def describe_getSquirrelsPage():
+
+        def it_returns_the_next_cursor_when_more_rows_remain(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                for name in ["A", "B", "C"]:
+                    db.createSquirrel(name, "small")
+
+                # exercise
+                page, nextAfterId = db.getSquirrelsPage(2)
+
+            # verify
+            assert [s["name"] for s in page] == ["A", "B"]
+            assert nextAfterId == 2
+
+            # teardown
+            pool.close()
+
+        def it_returns_no_cursor_on_the_last_page(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                for name in ["A", "B", "C"]:
+                    db.createSquirrel(name, "small")
+
+                # exercise
+                page, nextAfterId = db.getSquirrelsPage(2, afterId=2)
+
+            # verify
+            assert [s["name"] for s in page] == ["C"]
+            assert nextAfterId is None
+
+            # teardown
+            pool.close()
+
+    def describe_filters():
+
+        @pytest.fixture
+        def pool(db_path):
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                for name, size in [("Acorn", "small"), ("Ace", "large"), ("Bark", "large"), ("Acorn", "large")]:
+                    db.createSquirrel(name, size)
+            yield pool
+            pool.close()
+
+        def it_filters_on_an_exact_name(pool):
+            # exercise
+            with pool.connection() as db:
+                squirrels = db.getSquirrels({"name": "Acorn"})
+
+            # verify
+            assert [s["id"] for s in squirrels] == [1, 4]
+
+        def it_filters_on_a_name_prefix_in_name_order(pool):
+            # exercise
+            with pool.connection() as db:
+                squirrels = db.getSquirrels({"name_prefix": "Ac"})
+
+            # verify
+            assert [s["id"] for s in squirrels] == [2, 1, 4]
+
+        def it_filters_on_size_and_name_prefix_together(pool):
+            # exercise
+            with pool.connection() as db:
+                squirrels = db.getSquirrels({"name_prefix": "Ac", "size": "large"})
+
+            # verify
+            assert [s["name"] for s in squirrels] == ["Ace", "Acorn"]
+
+        def it_pages_through_filtered_rows(pool):
+            # exercise
+            with pool.connection() as db:
+                first, nextAfterId = db.getSquirrelsPage(1, filters={"size": "large"})
+                second, _ = db.getSquirrelsPage(5, afterId=nextAfterId, filters={"size": "large"})
+
+            # verify
+            assert [s["id"] for s in first] == [2]
+            assert [s["id"] for s in second] == [3, 4]
+
+        def it_pages_through_a_name_prefix_by_name_and_id(pool):
+            # exercise
+            with pool.connection() as db:
+                first, nextAfterId = db.getSquirrelsPage(2, filters={"name_prefix": "Ac"})
+                second, _ = db.getSquirrelsPage(2, afterId=nextAfterId, filters={"name_prefix": "Ac"},
+                                                afterName=first[-1]["name"])
+
+            # verify
+            assert [(s["name"], s["id"]) for s in first] == [("Ace", 2), ("Acorn", 1)]
+            assert [(s["name"], s["id"]) for s in second] == [("Acorn", 4)]
+
+        def it_searches_the_indexes_instead_of_scanning_the_table(pool):
+            # setup
+            def queryPlan(db, filters, afterName=None):
+                query, params = pageQuery(filters, 0, 10, afterName)
+                rows = db.connection.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                return " ".join(row["detail"] for row in rows)
+
+            # exercise
+            with pool.connection() as db:
+                byName = queryPlan(db, {"name": "Ace"})
+                byPrefix = queryPlan(db, {"name_prefix": "Ac"}, "Acorn")
+                byPrefixAndSize = queryPlan(db, {"name_prefix": "Ac", "size": "large"})
+                bySize = queryPlan(db, {"size": "large"})
+
+            # verify
+            assert "USING INDEX squirrels_name_index" in byName
+            assert "USING INDEX squirrels_name_index" in byPrefix
+            assert "USING INDEX squirrels_name_index" in byPrefixAndSize
+            assert "TEMP B-TREE" not in byPrefix + byPrefixAndSize
+            assert "USING INDEX squirrels_size_index" in bySize
+
+    def describe_prefixUpperBound():
+
+        def it_increments_the_last_character():
+            # exercise / verify
+            assert prefixUpperBound("Ac") == "Ad"
+
+        def it_skips_the_surrogate_range():
+            # exercise / verify
+            assert prefixUpperBound("a\ud7ff") == "a\ue000"
+
+        def it_has_no_bound_for_a_prefix_of_only_the_highest_character():
+            # exercise / verify
+            assert prefixUpperBound(chr(0x10FFFF)) is None
+
+    def describe_read_cache():
+
+        def it_serves_repeated_lookups_from_the_cache(db_path):
+            # setup
+            cache = SquirrelCache()
+            pool = SquirrelDBPool(db_path, maxSize=1, cache=cache)
+            with pool.connection() as db:
+                db.createSquirrel("Fluffy", "large")
+
+                # exercise
+                first = db.getSquirrel("1")
+                second = db.getSquirrel("1")
+
+            # verify
+            assert first == second == {"id": 1, "name": "Fluffy", "size": "large"}
+            assert cache.rows.stats()["hits"] == 1
+
+            # teardown
+            pool.close()
+
+        def it_returns_fresh_data_after_an_update(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, cache=SquirrelCache())
+            with pool.connection() as db:
+                db.createSquirrel("Fluffy", "large")
+                db.getSquirrel("1")
+                db.getSquirrels()
+
+                # exercise
+                db.updateSquirrel("1", "Chippy", "small")
+
+                # verify
+                assert db.getSquirrel("1")["name"] == "Chippy"
+                assert db.getSquirrels()[0]["name"] == "Chippy"
+
+            # teardown
+            pool.close()
+
+        def it_forgets_a_cached_miss_once_the_squirrel_is_created(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, cache=SquirrelCache())
+            with pool.connection() as db:
+                assert db.getSquirrel("1") is None
+
+                # exercise
+                db.createSquirrel("Fluffy", "large")
+
+                # verify
+                assert db.getSquirrel("1")["name"] == "Fluffy"
+
+            # teardown
+            pool.close()
+
+        def it_fills_the_listing_cache_while_streaming(db_path):
+            # setup
+            cache = SquirrelCache()
+            pool = SquirrelDBPool(db_path, maxSize=1, cache=cache)
+            with pool.connection() as db:
+                for name in ["A", "B", "C"]:
+                    db.createSquirrel(name, "small")
+
+                # exercise
+                streamed = [s for batch in db.iterSquirrelBatches(batchSize=2) for s in batch]
+                cached = [s for batch in db.iterSquirrelBatches(batchSize=2) for s in batch]
+
+            # verify
+            assert streamed == cached
+            assert cache.listings.stats()["hits"] == 1
+
+            # teardown
+            pool.close()
+
+        def it_does_not_cache_a_listing_that_a_write_overtook_before_it_was_read(db_path):
+            # setup
+            # WAL, as the server runs it, so the write can commit while the listing holds its snapshot
+            pool = SquirrelDBPool(db_path, maxSize=2, cache=SquirrelCache(), profile=resolveProfile("fast"))
+            with pool.connection() as db:
+                db.createSquirrel("A", "small")
+            with pool.connection() as reader, pool.connection() as writer:
+                version, batches = reader.listSquirrels()
+
+                # exercise
+                writer.createSquirrel("B", "small")
+                streamed = [s["name"] for batch in batches for s in batch]
+                version, batches = reader.listSquirrels()
+                listed = [s["name"] for batch in batches for s in batch]
+
+            # verify
+            assert streamed == ["A"]
+            assert listed == ["A", "B"]
+            assert version == 2
+
+            # teardown
+            pool.close()
+
+        def it_clears_the_cache_when_the_database_file_is_replaced(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, cache=SquirrelCache())
+            with pool.connection() as db:
+                db.createSquirrel("Old", "small")
+                db.getSquirrel("1")
+            os.remove(db_path)
+            create_database(db_path)
+
+            # exercise
+            with pool.connection() as db:
+                squirrel = db.getSquirrel("1")
+
+            # verify
+            assert squirrel is None
+
+            # teardown
+            pool.close()
+
+    def describe_versions():
+
+        def it_bumps_the_row_and_table_versions_on_every_write(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrel("Fluffy", "large")
+                squirrel, created = db.getSquirrelVersioned("1")
+                tableCreated = db.fetchTableVersion()
+
+                # exercise
+                db.updateSquirrel("1", "Chippy", "small")
+                squirrel, updated = db.getSquirrelVersioned("1")
+                tableUpdated = db.fetchTableVersion()
+
+            # verify
+            assert created < updated
+            assert tableCreated < tableUpdated
+
+            # teardown
+            pool.close()
+
+        def it_keeps_other_rows_versions_when_one_row_changes(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrel("Fluffy", "large")
+                db.createSquirrel("Chippy", "small")
+                squirrel, before = db.getSquirrelVersioned("1")
+
+                # exercise
+                db.updateSquirrel("2", "Nutty", "tiny")
+                squirrel, after = db.getSquirrelVersioned("1")
+
+            # verify
+            assert before == after
+
+            # teardown
+            pool.close()
+
+        def it_gives_a_recreated_database_different_etags(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrel("Fluffy", "large")
+                before = db.etagFor(db.fetchTableVersion())
+            os.remove(db_path)
+            create_database(db_path)
+
+            # exercise
+            with pool.connection() as db:
+                db.createSquirrel("Chippy", "small")
+                after = db.etagFor(db.fetchTableVersion())
+
+            # verify
+            assert before != after
+
+            # teardown
+            pool.close()
+
+    def describe_changes():
+
+        def it_logs_every_write_under_the_table_version_it_produced(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrel("Fluffy", "large")
+                db.updateSquirrel("1", "Chippy", "small")
+                db.deleteSquirrel("1")
+
+                # exercise
+                changes, latest, floor = db.getChanges(0)
+
+            # verify
+            assert changes == [
+                {"seq": 1, "op": "create", "id": 1, "squirrel": {"id": 1, "name": "Fluffy", "size": "large"}},
+                {"seq": 2, "op": "update", "id": 1, "squirrel": {"id": 1, "name": "Chippy", "size": "small"}},
+                {"seq": 3, "op": "delete", "id": 1, "squirrel": None},
+            ]
+            assert (latest, floor) == (3, 0)
+
+            # teardown
+            pool.close()
+
+        def it_returns_only_changes_after_since_up_to_the_limit(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrels([(f"S{i}", "small") for i in range(5)])
+
+                # exercise
+                changes, latest, floor = db.getChanges(2, limit=2)
+                current, _, _ = db.getChanges()
+
+            # verify
+            assert [change["seq"] for change in changes] == [3, 4]
+            assert latest == 5
+            assert current == []
+
+            # teardown
+            pool.close()
+
+        def it_starts_the_log_at_the_version_a_migrated_database_had(db_path):
+            # setup
+            conn = sqlite3.connect(db_path)
+            conn.execute("INSERT INTO squirrels (name, size) VALUES ('Old', 'small')")
+            conn.commit()
+            conn.close()
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.connection.execute("DELETE FROM squirrel_changes")
+                db.connection.execute("UPDATE squirrel_meta SET value = 7 WHERE key = 'version'")
+                db.connection.commit()
+
+                # exercise
+                changes, latest, floor = db.getChanges(0)
+
+            # verify
+            assert changes == []
+            assert latest == floor == 7
+
+            # teardown
+            pool.close()
+
+    def describe_bulk_writes():
+
+        def it_creates_many_squirrels_and_returns_their_ids(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1)
+            with pool.connection() as db:
+                db.createSquirrel("First", "small")
+                db.deleteSquirrel("1")
+
+                # exercise
+                ids = db.createSquirrels([("A", "small"), ("B", "large")])
+
+                # verify
+                assert ids == [2, 3]
+                assert [(s["id"], s["name"]) for s in db.getSquirrels()] == [(2, "A"), (3, "B")]
+
+            # teardown
+            pool.close()
+
+        def it_updates_and_deletes_only_existing_squirrels(db_path):
+            # setup
+            pool = SquirrelDBPool(db_path, maxSize=1, cache=SquirrelCache())
+            with pool.connection() as db:
+                db.createSquirrels([("A", "small"), ("B", "large")])
+                db.getSquirrel("1")
+
+                # exercise
+                updated = db.updateSquirrels([(1, "Z", "huge"), (5, "Y", "tiny")])
+                deleted = db.deleteSquirrels([2, 6])
+
+                # verify
+                assert updated == {1}
+                assert deleted == {2}
+                assert db.getSquirrels() == [{"id": 1, "name": "Z", "size": "huge"}]
+
+            # teardown
+            pool.close()
+
+def describe_WriteBatcher():
+
+    def it_commits_concurrent_writes_together(db_path):
+        # setup
+        writer = WriteBatcher(db_path, maxDelay=0.05)
+        pool = SquirrelDBPool(db_path, maxSize=8, writer=writer)
+        def create(i):
+            with pool.connection() as db:
+                db.createSquirrel(f"Squirrel{i}", "small")
+
+        # exercise
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(create, range(40)))
+
+        # verify
+        with pool.connection() as db:
+            assert len(db.getSquirrels()) == 40
+        assert writer.stats()["writes"] == 40
+        assert writer.stats()["batches"] < 40
+
+        # teardown
+        pool.close()
+
+    def it_reports_rows_changed_by_updates_and_deletes(db_path):
+        # setup
+        pool = SquirrelDBPool(db_path, maxSize=1, writer=WriteBatcher(db_path))
+        with pool.connection() as db:
+            assert db.createSquirrel("Fluffy", "large") == 1
+
+            # exercise / verify
+            assert db.updateSquirrel("1", "Chippy", "small") is True
+            assert db.updateSquirrel("2", "Ghost", "none") is False
+            assert db.deleteSquirrel("1") is True
+
+        # teardown
+        pool.close()
+
+    def it_fails_only_the_write_that_broke(db_path):
+        # setup
+        writer = WriteBatcher(db_path)
+
+        # exercise
+        with pytest.raises(sqlite3.IntegrityError):
+            writer.submit("create", [None, "small"])
+        writer.submit("create", ["Fluffy", "large"])
+
+        # verify
+        pool = SquirrelDBPool(db_path, maxSize=1)
+        with pool.connection() as db:
+            assert [s["name"] for s in db.getSquirrels()] == ["Fluffy"]
+
+        # teardown
+        writer.close()
+        pool.close()
+
+    def it_invalidates_cached_reads_before_acknowledging(db_path):
+        # setup
+        cache = SquirrelCache()
+        pool = SquirrelDBPool(db_path, maxSize=1, cache=cache, writer=WriteBatcher(db_path, cache=cache))
+        with pool.connection() as db:
+            db.createSquirrel("Fluffy", "large")
+            db.getSquirrel("1")
+
+            # exercise
+            db.updateSquirrel("1", "Chippy", "small")
+
+            # verify
+            assert db.getSquirrel("1")["name"] == "Chippy"
+
+        # teardown
+        pool.close()
@@ -0,0 +1,119 @@
+from squirrel_metrics import Counter, Gauge, Histogram, Registry, renderMetrics
+
+def describe_Counter():
+
+    def it_counts_per_label_set():
+        # setup
+        counter = Counter("requests_total", "Requests.", ("method",))
+
+        # exercise
+        counter.inc("GET")
+        counter.inc("GET")
+        counter.inc("POST", amount=3)
+
+        # verify
+        assert counter.render() == [
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{method="GET"} 2',
+            'requests_total{method="POST"} 3',
+        ]
+
+    def it_escapes_label_values():
+        # setup
+        counter = Counter("paths_total", "Paths.", ("path",))
+
+        # exercise
+        counter.inc('a"b\\c\nd')
+
+        # verify
+        assert counter.render()[-1] == 'paths_total{path="a\\"b\\\\c\\nd"} 1'
+
+def describe_Gauge():
+
+    def it_goes_up_and_down():
+        # setup
+        gauge = Gauge("open", "Open things.")
+
+        # exercise
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        # verify
+        assert gauge.render()[-1] == "open 1"
+
+    def it_can_be_set():
+        # setup
+        gauge = Gauge("size", "Size.")
+
+        # exercise
+        gauge.set(42)
+
+        # verify
+        assert gauge.render()[-1] == "size 42"
+
+def describe_Histogram():
+
+    def it_renders_cumulative_buckets_sum_and_count():
+        # setup
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+        # exercise
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+
+        # verify
+        assert histogram.render()[2:] == [
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3",
+        ]
+
+    def it_counts_a_value_on_a_bound_in_that_bucket():
+        # setup
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+        # exercise
+        histogram.observe(0.1)
+
+        # verify
+        assert 'latency_seconds_bucket{le="0.1"} 1' in histogram.render()
+
+    def it_times_a_block():
+        # setup
+        histogram = Histogram("query_seconds", "Queries.", ("query",), buckets=(60.0,))
+
+        # exercise
+        with histogram.time("select"):
+            pass
+
+        # verify
+        assert 'query_seconds_bucket{query="select",le="60.0"} 1' in histogram.render()
+
+def describe_Registry():
+
+    def it_renders_metrics_in_registration_order():
+        # setup
+        registry = Registry()
+        registry.register(Gauge("b", "B.")).set(1)
+        registry.register(Gauge("a", "A.")).set(2)
+
+        # exercise
+        lines = registry.render()
+
+        # verify
+        assert [line for line in lines if not line.startswith("#")] == ["b 1", "a 2"]
+
+def describe_renderMetrics():
+
+    def it_returns_the_exposition_as_bytes_ending_in_a_newline():
+        # exercise
+        body = renderMetrics()
+
+        # verify
+        assert body.endswith(b"\n")
+        assert b"# TYPE squirrel_http_requests_total counter" in body
@@ -1,3 +1,5 @@
+import gzip
+import json
 import os
 import sys
 import pytest
@@ -5,19 +7,51 @@ import requests
 import shutil
 import subprocess
 import time
+import threading
 import sqlite3
+import socket
+import zlib
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 
 BASE_URL = "http://127.0.0.1:8080"
 SERVER_PROCESS = None
+# Extra command line arguments for the server, e.g. "--mode prefork --processes 2"
+SERVER_ARGS = os.environ.get("SQUIRREL_SERVER_ARGS", "").split()
+# The server runs on a scratch database so the tests never touch the checked in squirrel_db.db
+DB_FILE = None
 
 def is_server_running():
     """Check server responsiveness"""
     try:
-        response = requests.get(f"{BASE_URL}/squirrels", timeout=0.5)
-        return True
+        response = requests.get(f"{BASE_URL}/healthz", timeout=0.5)
+        return response.status_code == 200
     except:
         return False
 
+def wait_for_server(timeout=10.0):
+    """Poll the readiness route until the server answers"""
+    deadline = time.monotonic() + timeout
+    while not is_server_running():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"squirrel_server not ready after {timeout} s")
+        time.sleep(0.02)
+
+def create_squirrels(count):
+    """Bulk create count squirrels and return them as the listing shows them"""
+    squirrels = [{"name": f"Squirrel{i}", "size": "medium"} for i in range(count)]
+    requests.post(f"{BASE_URL}/squirrels/bulk", json=squirrels)
+    return [{"id": i + 1, **squirrel} for i, squirrel in enumerate(squirrels)]
+
+def get_raw(path, headers):
+    """GET without any automatic content decoding"""
+    conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=2)
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response, body
+
 def restart_server_if_needed():
     """Restart server if not running"""
     global SERVER_PROCESS
@@ -33,29 +67,29 @@ def restart_server_if_needed():
         # Start new server process
         python_cmd = sys.executable
         SERVER_PROCESS = subprocess.Popen(
-            [python_cmd, "squirrel_server.py"],
+            [python_cmd, "squirrel_server.py", "--db-path", DB_FILE, *SERVER_ARGS],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
-        # Pause to let server start
-        time.sleep(2)
+        wait_for_server()
 
 @pytest.fixture(scope="session", autouse=True)
-def start_server():
-    """Start squirrel server before running tests"""
-    global SERVER_PROCESS
+def start_server(tmp_path_factory):
+    """Start squirrel server on a copy of the empty database before running tests"""
+    global SERVER_PROCESS, DB_FILE
     
     python_cmd = sys.executable
+    DB_FILE = str(tmp_path_factory.mktemp("squirrel") / "squirrel_db.db")
+    shutil.copyfile("empty_squirrel_db.db", DB_FILE)
 
     # Start server process
     SERVER_PROCESS = subprocess.Popen(
-        [python_cmd, "squirrel_server.py"],
+        [python_cmd, "squirrel_server.py", "--db-path", DB_FILE, *SERVER_ARGS],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE
     )
     
-    # Wait for server to start
-    time.sleep(2)
+    wait_for_server()
     
     yield
 
@@ -70,11 +104,11 @@ def reset_database():
     restart_server_if_needed()
     
     # Copy template database
-    if os.path.isfile("squirrel_db.db"):
-        os.remove("squirrel_db.db")
+    if os.path.isfile(DB_FILE):
+        os.remove(DB_FILE)
 
     # Create new empty database
-    conn = sqlite3.connect("squirrel_db.db")
+    conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS squirrels (
@@ -120,6 +154,474 @@ def describe_SquirrelServer_API():
             assert squirrels[0]["name"] == "Fluffy"
             assert squirrels[1]["name"] == "Chippy"
 
+    def describe_GET_squirrels_streamed():
+
+        def it_streams_the_full_listing_with_chunked_encoding():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels")
+
+            # verify
+            assert response.headers["Transfer-Encoding"] == "chunked"
+            assert response.json() == []
+
+        def it_streams_listings_larger_than_one_batch():
+            # setup - write rows straight to the database to build a large table quickly
+            conn = sqlite3.connect(DB_FILE)
+            conn.executemany("INSERT INTO squirrels (name, size) VALUES (?, ?)",
+                             [(f"Squirrel{i}", "small") for i in range(1234)])
+            conn.commit()
+            conn.close()
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels")
+
+            # verify
+            squirrels = response.json()
+            assert len(squirrels) == 1234
+            assert [s["id"] for s in squirrels] == list(range(1, 1235))
+
+    def describe_GET_squirrels_paginated():
+
+        def it_returns_at_most_limit_squirrels_in_id_order():
+            # setup
+            for name in ["A", "B", "C"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"limit": 2})
+
+            # verify
+            assert response.status_code == 200
+            assert [s["name"] for s in response.json()] == ["A", "B"]
+
+        def it_links_to_the_next_page_while_more_squirrels_remain():
+            # setup
+            for name in ["A", "B", "C"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            first = requests.get(f"{BASE_URL}/squirrels", params={"limit": 2})
+            second = requests.get(BASE_URL + first.links["next"]["url"])
+
+            # verify
+            assert first.links["next"]["url"] == "/squirrels?limit=2&after_id=2"
+            assert [s["name"] for s in second.json()] == ["C"]
+            assert "next" not in second.links
+
+        def it_returns_squirrels_after_the_given_id():
+            # setup
+            for name in ["A", "B", "C"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+            requests.delete(f"{BASE_URL}/squirrels/2")
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"after_id": 1, "limit": 5})
+
+            # verify
+            assert [s["id"] for s in response.json()] == [3]
+
+        def it_returns_400_for_a_non_numeric_limit():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"limit": "lots"})
+
+            # verify
+            assert response.status_code == 400
+
+    def describe_GET_squirrels_filtered():
+
+        def it_filters_by_size():
+            # setup
+            for name, size in [("A", "small"), ("B", "large"), ("C", "large")]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": size})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"size": "large"})
+
+            # verify
+            assert response.status_code == 200
+            assert [s["name"] for s in response.json()] == ["B", "C"]
+
+        def it_filters_by_name_and_name_prefix():
+            # setup
+            for name in ["Acorn", "Ace", "Bark"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            exact = requests.get(f"{BASE_URL}/squirrels", params={"name": "Ace"})
+            prefixed = requests.get(f"{BASE_URL}/squirrels", params={"name_prefix": "Ac"})
+
+            # verify
+            assert [s["name"] for s in exact.json()] == ["Ace"]
+            assert [s["name"] for s in prefixed.json()] == ["Ace", "Acorn"]
+
+        def it_keeps_the_filters_in_the_next_page_link():
+            # setup
+            for name in ["Acorn", "Bark", "Ace", "Acme"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            first = requests.get(f"{BASE_URL}/squirrels", params={"name_prefix": "Ac", "limit": 2})
+            second = requests.get(BASE_URL + first.links["next"]["url"])
+
+            # verify
+            assert first.links["next"]["url"] == "/squirrels?name_prefix=Ac&limit=2&after_name=Acme&after_id=4"
+            assert [s["name"] for s in first.json()] == ["Ace", "Acme"]
+            assert [s["name"] for s in second.json()] == ["Acorn"]
+
+        def it_returns_400_for_a_name_prefix_page_after_an_id_alone():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"name_prefix": "Ac", "after_id": 3})
+
+            # verify
+            assert response.status_code == 400
+
+    def describe_GET_squirrels_ndjson():
+
+        def it_streams_one_object_per_line_when_asked():
+            # setup
+            for name in ["A", "B"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", headers={"Accept": "application/x-ndjson"})
+
+            # verify
+            assert response.headers["Content-Type"] == "application/x-ndjson"
+            assert response.headers["Vary"] == "Accept, Accept-Encoding"
+            assert response.text == '{"id": 1, "name": "A", "size": "small"}\n{"id": 2, "name": "B", "size": "small"}\n'
+
+        def it_sends_an_empty_body_for_an_empty_listing():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", headers={"Accept": "application/x-ndjson"})
+
+            # verify
+            assert response.status_code == 200
+            assert response.text == ""
+
+        def it_pages_ndjson_with_a_next_link():
+            # setup
+            for name in ["A", "B", "C"]:
+                requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"limit": 2},
+                                    headers={"Accept": "application/x-ndjson"})
+
+            # verify
+            assert [line for line in response.text.splitlines()] == [
+                '{"id": 1, "name": "A", "size": "small"}', '{"id": 2, "name": "B", "size": "small"}']
+            assert response.links["next"]["url"] == "/squirrels?limit=2&after_id=2"
+
+        def it_prefers_json_unless_ndjson_ranks_higher():
+            # exercise
+            both = requests.get(f"{BASE_URL}/squirrels", headers={"Accept": "application/json, application/x-ndjson"})
+            ranked = requests.get(f"{BASE_URL}/squirrels",
+                                  headers={"Accept": "application/json;q=0.5, application/x-ndjson"})
+
+            # verify
+            assert both.headers["Content-Type"] == "application/json"
+            assert ranked.headers["Content-Type"] == "application/x-ndjson"
+
+        def it_tags_each_representation_differently():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "A", "size": "small"})
+            asJson = requests.get(f"{BASE_URL}/squirrels")
+            asNdjson = requests.get(f"{BASE_URL}/squirrels", headers={"Accept": "application/x-ndjson"})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", headers={
+                "Accept": "application/x-ndjson", "If-None-Match": asJson.headers["ETag"]})
+
+            # verify
+            assert asJson.headers["ETag"] != asNdjson.headers["ETag"]
+            assert response.status_code == 200
+
+        def it_encodes_names_exactly_like_json_dumps():
+            # setup
+            name = 'Nutty "Squirrel" \\ Ünïcödé 🐿'
+            requests.post(f"{BASE_URL}/squirrels", data={"name": name, "size": "small"})
+
+            # exercise
+            listing = requests.get(f"{BASE_URL}/squirrels")
+            page = requests.get(f"{BASE_URL}/squirrels", params={"limit": 1})
+
+            # verify
+            assert listing.json()[0]["name"] == name
+            assert page.content == bytes(json.dumps([{"id": 1, "name": name, "size": "small"}]), "utf-8")
+
+    def describe_compression():
+
+        def it_streams_a_gzipped_listing_when_accepted():
+            # setup
+            squirrels = create_squirrels(100)
+
+            # exercise
+            response, body = get_raw("/squirrels", {"Accept-Encoding": "gzip, deflate"})
+
+            # verify
+            assert response.getheader("Content-Encoding") == "gzip"
+            assert response.getheader("Vary") == "Accept, Accept-Encoding"
+            assert response.getheader("ETag").startswith('W/"')
+            assert json.loads(gzip.decompress(body)) == squirrels
+            assert len(body) < len(json.dumps(squirrels)) / 4
+
+        def it_deflates_when_gzip_is_refused():
+            # setup
+            squirrels = create_squirrels(100)
+
+            # exercise
+            response, body = get_raw("/squirrels", {"Accept-Encoding": "gzip;q=0, deflate"})
+
+            # verify
+            assert response.getheader("Content-Encoding") == "deflate"
+            assert json.loads(zlib.decompress(body)) == squirrels
+
+        def it_sends_identity_without_accept_encoding():
+            # setup
+            squirrels = create_squirrels(100)
+
+            # exercise
+            response, body = get_raw("/squirrels", {})
+
+            # verify
+            assert response.getheader("Content-Encoding") is None
+            assert json.loads(body) == squirrels
+
+        def it_leaves_small_bodies_uncompressed():
+            # setup
+            create_squirrels(1)
+
+            # exercise
+            response, body = get_raw("/squirrels/1", {"Accept-Encoding": "gzip"})
+
+            # verify
+            assert response.getheader("Content-Encoding") is None
+            assert json.loads(body)["name"] == "Squirrel0"
+
+        def it_leaves_small_streamed_listings_uncompressed():
+            # setup
+            squirrels = create_squirrels(2)
+
+            # exercise
+            response, body = get_raw("/squirrels", {"Accept-Encoding": "gzip"})
+
+            # verify
+            assert response.getheader("Transfer-Encoding") == "chunked"
+            assert response.getheader("Content-Encoding") is None
+            assert not response.getheader("ETag").startswith('W/"')
+            assert json.loads(body) == squirrels
+
+        def it_compresses_large_pages_with_a_content_length():
+            # setup
+            squirrels = create_squirrels(100)
+
+            # exercise
+            response, body = get_raw("/squirrels?limit=60", {"Accept-Encoding": "gzip"})
+
+            # verify
+            assert response.getheader("Content-Encoding") == "gzip"
+            assert response.getheader("Content-Length") == str(len(body))
+            assert json.loads(gzip.decompress(body)) == squirrels[:60]
+
+        def it_reuses_the_compressed_listing_until_it_changes():
+            # setup
+            squirrels = create_squirrels(100)
+            first, firstBody = get_raw("/squirrels", {"Accept-Encoding": "gzip"})
+
+            # exercise
+            second, secondBody = get_raw("/squirrels", {"Accept-Encoding": "gzip"})
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Late", "size": "small"})
+            third, thirdBody = get_raw("/squirrels", {"Accept-Encoding": "gzip"})
+
+            # verify
+            assert gzip.decompress(secondBody) == gzip.decompress(firstBody)
+            assert second.getheader("ETag") == first.getheader("ETag")
+            assert third.getheader("ETag") != first.getheader("ETag")
+            assert json.loads(gzip.decompress(thirdBody))[-1]["name"] == "Late"
+
+        def it_answers_a_weak_tag_with_304():
+            # setup
+            create_squirrels(100)
+            first, _ = get_raw("/squirrels", {"Accept-Encoding": "gzip"})
+
+            # exercise
+            response, body = get_raw("/squirrels", {"Accept-Encoding": "gzip", "If-None-Match": first.getheader("ETag")})
+
+            # verify
+            assert response.status == 304
+            assert body == b""
+
+    def describe_HEAD_requests():
+
+        def it_answers_with_the_get_headers_and_no_body():
+            # setup
+            create_squirrels(1)
+            get = requests.get(f"{BASE_URL}/squirrels/1")
+
+            # exercise
+            response = requests.head(f"{BASE_URL}/squirrels/1")
+
+            # verify
+            assert response.status_code == 200
+            assert response.headers["Content-Length"] == get.headers["Content-Length"]
+            assert response.headers["ETag"] == get.headers["ETag"]
+            assert response.content == b""
+
+        def it_keeps_the_connection_usable_after_a_streamed_listing():
+            # setup
+            create_squirrels(100)
+            conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=2)
+
+            # exercise
+            conn.request("HEAD", "/squirrels", headers={"Accept-Encoding": "gzip"})
+            head = conn.getresponse()
+            headBody = head.read()
+            conn.request("GET", "/squirrels/100")
+            response = conn.getresponse()
+
+            # verify
+            assert head.status == 200
+            assert head.getheader("Content-Encoding") == "gzip"
+            assert headBody == b""
+            assert json.loads(response.read())["id"] == 100
+
+            # teardown
+            conn.close()
+
+        def it_answers_a_change_feed_head_without_waiting():
+            # exercise
+            started = time.monotonic()
+            response = requests.head(f"{BASE_URL}/squirrels/changes", params={"since": 0, "timeout": 5},
+                                     headers={"Accept": "text/event-stream"}, timeout=3)
+
+            # verify
+            assert response.status_code == 200
+            assert response.headers["Content-Type"] == "application/json"
+            assert time.monotonic() - started < 1
+
+        def it_returns_404_for_unknown_paths():
+            # exercise
+            response = requests.head(f"{BASE_URL}/acorns")
+
+            # verify
+            assert response.status_code == 404
+
+    def describe_GET_squirrels_changes():
+
+        def it_returns_the_position_to_follow_from_without_since():
+            # setup
+            create_squirrels(3)
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/changes")
+
+            # verify
+            assert response.status_code == 200
+            assert response.json() == {"changes": [], "last_seq": 3}
+
+        def it_returns_pending_changes_at_once():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            requests.put(f"{BASE_URL}/squirrels/1", data={"name": "Chippy", "size": "small"})
+            requests.delete(f"{BASE_URL}/squirrels/1")
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/changes", params={"since": 1})
+
+            # verify
+            assert response.json() == {"changes": [
+                {"seq": 2, "op": "update", "id": 1, "squirrel": {"id": 1, "name": "Chippy", "size": "small"}},
+                {"seq": 3, "op": "delete", "id": 1, "squirrel": None},
+            ], "last_seq": 3}
+
+        def it_holds_a_long_poll_until_the_next_write():
+            # setup
+            timer = threading.Timer(0.3, requests.post, [f"{BASE_URL}/squirrels"],
+                                    {"data": {"name": "Late", "size": "small"}})
+            timer.start()
+
+            # exercise
+            start = time.monotonic()
+            response = requests.get(f"{BASE_URL}/squirrels/changes", params={"since": 0, "timeout": 5})
+            elapsed = time.monotonic() - start
+
+            # verify
+            assert 0.25 < elapsed < 3
+            assert [change["squirrel"]["name"] for change in response.json()["changes"]] == ["Late"]
+
+            # teardown
+            timer.join()
+
+        def it_returns_no_changes_when_the_wait_runs_out():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/changes", params={"since": 0, "timeout": 0.2})
+
+            # verify
+            assert response.status_code == 200
+            assert response.json() == {"changes": [], "last_seq": 0}
+
+        def it_streams_server_sent_events():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            sock = socket.create_connection(("127.0.0.1", 8080), timeout=3)
+            sock.sendall(b"GET /squirrels/changes?since=0 HTTP/1.1\r\nHost: localhost\r\n"
+                         b"Accept: text/event-stream\r\n\r\n")
+
+            # exercise
+            received = b""
+            while b"id: 1" not in received:
+                received += sock.recv(65536)
+            requests.delete(f"{BASE_URL}/squirrels/1")
+            while b"id: 2" not in received:
+                received += sock.recv(65536)
+
+            # verify
+            assert b"Content-Type: text/event-stream" in received
+            assert b'data: {"seq": 2, "op": "delete", "id": 1, "squirrel": null}' in received
+
+            # teardown
+            sock.close()
+
+        def it_resumes_a_stream_from_last_event_id():
+            # setup
+            create_squirrels(2)
+            sock = socket.create_connection(("127.0.0.1", 8080), timeout=3)
+
+            # exercise
+            sock.sendall(b"GET /squirrels/changes HTTP/1.1\r\nHost: localhost\r\n"
+                         b"Accept: text/event-stream\r\nLast-Event-ID: 1\r\n\r\n")
+            received = b""
+            while b"id: 2" not in received:
+                received += sock.recv(65536)
+
+            # verify
+            assert b"id: 1\n" not in received
+
+            # teardown
+            sock.close()
+
+        def it_answers_410_for_a_position_the_log_does_not_cover():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/changes", params={"since": 1000})
+
+            # verify
+            assert response.status_code == 410
+
+        def it_rejects_a_since_that_is_not_an_integer():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/changes", params={"since": "soon"})
+
+            # verify
+            assert response.status_code == 400
+
+        def it_rejects_a_timeout_that_is_not_finite():
+            # exercise
+            responses = [requests.get(f"{BASE_URL}/squirrels/changes", params={"since": 0, "timeout": timeout}, timeout=3)
+                         for timeout in ("nan", "inf", "-inf")]
+
+            # verify
+            assert [response.status_code for response in responses] == [400, 400, 400]
+
     def describe_GET_squirrels_id():
         
         def it_returns_200_when_squirrel_exists():
@@ -198,6 +700,70 @@ def describe_SquirrelServer_API():
             assert squirrel["name"] == "Original"
             assert squirrel["size"] == "small"
 
+    def describe_conditional_GET():
+
+        def it_returns_304_without_a_body_when_the_squirrel_is_unchanged():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            etag = requests.get(f"{BASE_URL}/squirrels/1").headers["ETag"]
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/1", headers={"If-None-Match": etag})
+
+            # verify
+            assert response.status_code == 304
+            assert response.content == b""
+            assert response.headers["ETag"] == etag
+
+        def it_returns_the_new_squirrel_once_it_was_updated():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            etag = requests.get(f"{BASE_URL}/squirrels/1").headers["ETag"]
+            requests.put(f"{BASE_URL}/squirrels/1", data={"name": "Chippy", "size": "small"})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels/1", headers={"If-None-Match": etag})
+
+            # verify
+            assert response.status_code == 200
+            assert response.json()["name"] == "Chippy"
+            assert response.headers["ETag"] != etag
+
+        def it_returns_304_for_an_unchanged_listing():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            etag = requests.get(f"{BASE_URL}/squirrels").headers["ETag"]
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", headers={"If-None-Match": etag})
+
+            # verify
+            assert response.status_code == 304
+
+        def it_returns_the_listing_again_after_any_squirrel_changed():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            etag = requests.get(f"{BASE_URL}/squirrels").headers["ETag"]
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Chippy", "size": "small"})
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", headers={"If-None-Match": etag})
+
+            # verify
+            assert response.status_code == 200
+            assert len(response.json()) == 2
+
+        def it_returns_304_for_an_unchanged_page():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Fluffy", "size": "large"})
+            etag = requests.get(f"{BASE_URL}/squirrels", params={"limit": 1}).headers["ETag"]
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", params={"limit": 1}, headers={"If-None-Match": etag})
+
+            # verify
+            assert response.status_code == 304
+
     def describe_POST_squirrels():
         
         def it_returns_201_status_code():
@@ -227,6 +793,89 @@ def describe_SquirrelServer_API():
             assert len(squirrels) == 1
             assert squirrels[0]["name"] == "ListSquirrel"
 
+        def it_returns_the_location_of_the_created_squirrel():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "First", "size": "small"})
+
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", data={"name": "Second", "size": "large"})
+
+            # verify
+            assert response.headers["Location"] == "/squirrels/2"
+            assert requests.get(f"{BASE_URL}{response.headers['Location']}").json()["name"] == "Second"
+
+    def describe_JSON_request_bodies():
+
+        def it_creates_a_squirrel_from_a_json_object():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", json={"name": "Jason", "size": "large"})
+
+            # verify
+            assert response.status_code == 201
+            assert requests.get(f"{BASE_URL}/squirrels/1").json() == {"id": 1, "name": "Jason", "size": "large"}
+
+        def it_updates_a_squirrel_from_an_ndjson_line():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Old", "size": "small"})
+
+            # exercise
+            response = requests.put(f"{BASE_URL}/squirrels/1", data='{"name": "New", "size": "huge"}\n',
+                                    headers={"Content-Type": "application/x-ndjson"})
+
+            # verify
+            assert response.status_code == 204
+            assert requests.get(f"{BASE_URL}/squirrels/1").json()["name"] == "New"
+
+        def it_returns_400_for_malformed_json():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", data="{not json",
+                                     headers={"Content-Type": "application/json"})
+
+            # verify
+            assert response.status_code == 400
+
+        def it_returns_400_for_a_json_value_that_is_not_an_object():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", json=["Jason", "large"])
+
+            # verify
+            assert response.status_code == 400
+
+        def it_returns_400_for_a_json_object_missing_a_field():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", json={"name": "Jason"})
+
+            # verify
+            assert response.status_code == 400
+            assert response.text == "400 Bad Request: missing size"
+
+        def it_returns_400_for_a_null_field():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", json={"name": None, "size": "large"})
+
+            # verify
+            assert response.status_code == 400
+            assert response.text == "400 Bad Request: name must be a string"
+
+        def it_returns_400_for_a_number_instead_of_a_string():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels", json={"name": "Jason", "size": 3})
+
+            # verify
+            assert response.status_code == 400
+            assert requests.get(f"{BASE_URL}/squirrels").json() == []
+
+        def it_returns_400_for_a_nested_value_on_update():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "Old", "size": "small"})
+
+            # exercise
+            response = requests.put(f"{BASE_URL}/squirrels/1", json={"name": {"first": "New"}, "size": ["huge"]})
+
+            # verify
+            assert response.status_code == 400
+            assert requests.get(f"{BASE_URL}/squirrels/1").json()["name"] == "Old"
+
     def describe_POST_squirrels_bad_request_validation():
         """Tests for 400 Bad Request when incomplete data is provided"""
         
@@ -294,6 +943,19 @@ def describe_SquirrelServer_API():
             assert squirrel["name"] == "NewName"
             assert squirrel["size"] == "huge"
 
+        def it_returns_the_updated_squirrel_after_it_was_read():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "OldName", "size": "small"})
+            requests.get(f"{BASE_URL}/squirrels/1")
+            requests.get(f"{BASE_URL}/squirrels")
+
+            # exercise
+            requests.put(f"{BASE_URL}/squirrels/1", data={"name": "NewName", "size": "huge"})
+
+            # verify
+            assert requests.get(f"{BASE_URL}/squirrels/1").json()["name"] == "NewName"
+            assert requests.get(f"{BASE_URL}/squirrels").json()[0]["name"] == "NewName"
+
         def it_returns_404_when_updating_nonexistent_squirrel():
             # exercise 
             try:
@@ -351,6 +1013,163 @@ def describe_SquirrelServer_API():
             # verify
             assert response.status_code == 404
 
+    def describe_bulk_endpoints():
+
+        def it_creates_squirrels_from_a_json_array_and_reports_their_ids():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels/bulk",
+                                     json=[{"name": "A", "size": "small"}, {"name": "B", "size": "large"}])
+
+            # verify
+            assert response.status_code == 200
+            assert response.json()["results"] == [{"status": 201, "id": 1}, {"status": 201, "id": 2}]
+            assert [s["name"] for s in requests.get(f"{BASE_URL}/squirrels").json()] == ["A", "B"]
+
+        def it_creates_squirrels_from_ndjson_lines():
+            # setup
+            body = '{"name": "A", "size": "small"}\n{"name": "B", "size": "large"}\n'
+
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels/bulk", data=body,
+                                     headers={"Content-Type": "application/x-ndjson"})
+
+            # verify
+            assert [r["id"] for r in response.json()["results"]] == [1, 2]
+
+        def it_reports_invalid_items_without_rejecting_the_rest():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels/bulk",
+                                     json=[{"name": "A"}, {"name": "B", "size": "large"}])
+
+            # verify
+            assert response.json()["results"] == [{"status": 400, "error": "missing size"}, {"status": 201, "id": 1}]
+
+        def it_updates_existing_squirrels_and_reports_missing_ones():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "A", "size": "small"})
+
+            # exercise
+            response = requests.put(f"{BASE_URL}/squirrels/bulk",
+                                    json=[{"id": 1, "name": "Z", "size": "huge"}, {"id": 9, "name": "Y", "size": "tiny"}])
+
+            # verify
+            assert response.json()["results"] == [{"status": 204, "id": 1}, {"status": 404, "id": 9}]
+            assert requests.get(f"{BASE_URL}/squirrels/1").json()["name"] == "Z"
+
+        def it_deletes_squirrels_by_id():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels/bulk", json=[{"name": n, "size": "small"} for n in "ABC"])
+
+            # exercise
+            response = requests.delete(f"{BASE_URL}/squirrels/bulk", json=[1, {"id": 3}, 7])
+
+            # verify
+            assert [r["status"] for r in response.json()["results"]] == [204, 204, 404]
+            assert [s["name"] for s in requests.get(f"{BASE_URL}/squirrels").json()] == ["B"]
+
+        def it_reports_ids_too_big_for_sqlite_as_invalid_items():
+            # setup
+            requests.post(f"{BASE_URL}/squirrels", data={"name": "A", "size": "small"})
+
+            # exercise
+            updated = requests.put(f"{BASE_URL}/squirrels/bulk",
+                                   json=[{"id": 10**30, "name": "Z", "size": "huge"}, {"id": 1, "name": "Y", "size": "tiny"}])
+            deleted = requests.delete(f"{BASE_URL}/squirrels/bulk", json=[-2**63 - 1, 2**63, 1])
+
+            # verify
+            assert updated.json()["results"] == [{"status": 400, "error": "id must be an integer"}, {"status": 204, "id": 1}]
+            assert [r["status"] for r in deleted.json()["results"]] == [400, 400, 204]
+
+        def it_returns_400_for_a_body_that_is_not_json():
+            # exercise
+            response = requests.post(f"{BASE_URL}/squirrels/bulk", data="name=A&size=small")
+
+            # verify
+            assert response.status_code == 400
+
+    def describe_GET_healthz():
+
+        def it_reports_ready_with_the_schema_version():
+            # exercise
+            response = requests.get(f"{BASE_URL}/healthz")
+
+            # verify
+            assert response.status_code == 200
+            assert response.json()["status"] == "ok"
+            assert response.json()["schema_version"] >= 1
+
+        def it_serves_a_database_file_that_was_removed():
+            # setup - the server creates the schema itself
+            os.remove(DB_FILE)
+
+            # exercise
+            created = requests.post(f"{BASE_URL}/squirrels", data={"name": "Fresh", "size": "small"})
+            response = requests.get(f"{BASE_URL}/squirrels")
+
+            # verify
+            assert created.status_code == 201
+            assert [s["name"] for s in response.json()] == ["Fresh"]
+
+    def describe_GET_metrics():
+
+        def it_returns_prometheus_text():
+            # setup
+            requests.get(f"{BASE_URL}/squirrels")
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/metrics")
+
+            # verify
+            assert response.status_code == 200
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "# TYPE squirrel_http_requests_total counter" in response.text
+            assert "squirrel_db_pool_connections" in response.text
+
+        def it_counts_requests_by_route_and_status():
+            # setup
+            requests.get(f"{BASE_URL}/squirrels/999999")
+
+            # exercise
+            # The request is counted just after its response is sent, so allow a scrape to race it
+            for _ in range(20):
+                response = requests.get(f"{BASE_URL}/metrics")
+                if 'route="/squirrels/{id}",status="404"' in response.text:
+                    break
+                time.sleep(0.05)
+
+            # verify
+            assert 'squirrel_http_requests_total{method="GET",route="/squirrels/{id}",status="404"}' in response.text
+
+    def describe_tracing():
+
+        def it_ignores_the_trace_header_unless_the_server_traces():
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", headers={"X-Squirrel-Trace": "1"})
+
+            # verify
+            assert response.status_code == 200
+            assert "X-Squirrel-Trace-Id" not in response.headers
+
+    def describe_startup():
+
+        def it_reports_a_taken_port_instead_of_a_missing_executor():
+            # setup
+            from squirrel_server import SquirrelServerHandler, ThreadPoolHTTPServer
+
+            # exercise / verify
+            with pytest.raises(OSError) as error:
+                ThreadPoolHTTPServer(("127.0.0.1", 8080), SquirrelServerHandler, workers=1)
+            assert error.value.errno == 98
+
+        def it_exits_non_zero_when_prefork_workers_cannot_bind(tmp_path):
+            # exercise
+            result = subprocess.run([sys.executable, os.path.abspath("squirrel_server.py"), "--mode", "prefork",
+                                     "--processes", "2"], cwd=tmp_path, capture_output=True, text=True, timeout=20)
+
+            # verify
+            assert result.returncode == 1
+            assert "Address already in use" in result.stderr
+
     def describe_404_error_conditions():
         
         def it_returns_404_for_invalid_resource_path():
@@ -407,4 +1226,142 @@ def describe_SquirrelServer_API():
             response = requests.delete(f"{BASE_URL}/dogs/1")
             
             # verify
-            assert response.status_code == 404
\ No newline at end of file
+            assert response.status_code == 404
+
+    def describe_concurrency():
+
+        def it_serves_other_clients_while_one_connection_is_stalled():
+            # setup - open a connection and send only part of a request
+            stalled = socket.create_connection(("127.0.0.1", 8080))
+            stalled.sendall(b"GET /squirrels HTTP/1.1\r\n")
+
+            # exercise
+            try:
+                response = requests.get(f"{BASE_URL}/squirrels", timeout=1)
+            finally:
+                stalled.close()
+
+            # verify
+            assert response.status_code == 200
+
+        def it_handles_parallel_creates_without_losing_any():
+            # setup
+            def create(i):
+                return requests.post(f"{BASE_URL}/squirrels", data={"name": f"Squirrel{i}", "size": "small"}).status_code
+
+            # exercise
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                statuses = list(pool.map(create, range(20)))
+
+            # verify
+            assert statuses == [201] * 20
+            response = requests.get(f"{BASE_URL}/squirrels")
+            assert len(response.json()) == 20
+
+    def describe_persistent_connections():
+
+        def it_answers_new_clients_while_more_idle_connections_than_workers_are_open():
+            # setup
+            idle = []
+            for _ in range(40):
+                conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=2)
+                conn.request("GET", "/healthz")
+                conn.getresponse().read()
+                idle.append(conn)
+
+            # exercise
+            response = requests.get(f"{BASE_URL}/squirrels", timeout=2)
+            idle[0].request("GET", "/healthz")
+            reused = idle[0].getresponse()
+            reused.read()
+
+            # verify
+            assert response.status_code == 200
+            assert reused.status == 200
+
+            # teardown
+            for conn in idle:
+                conn.close()
+
+        def it_serves_several_requests_over_one_connection():
+            # setup
+            conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=2)
+
+            # exercise
+            conn.request("POST", "/squirrels", body="name=Fluffy&size=large",
+                         headers={"Content-Type": "application/x-www-form-urlencoded"})
+            created = conn.getresponse()
+            created.read()
+            sock = conn.sock
+            conn.request("GET", "/squirrels/1")
+            retrieved = conn.getresponse()
+            body = retrieved.read()
+
+            # verify
+            assert created.status == 201
+            assert retrieved.status == 200
+            assert conn.sock is sock
+            assert b"Fluffy" in body
+
+            # teardown
+            conn.close()
+
+        def it_sends_content_length_on_every_response_with_a_body():
+            # setup
+            conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=2)
+
+            # exercise
+            conn.request("POST", "/squirrels", body="name=Fluffy&size=large",
+                         headers={"Content-Type": "application/x-www-form-urlencoded"})
+            created = conn.getresponse()
+            created.read()
+            conn.request("GET", "/squirrels/999")
+            missing = conn.getresponse()
+            missing_body = missing.read()
+
+            # verify
+            assert created.getheader("Content-Length") == "0"
+            assert missing.getheader("Content-Length") == str(len(missing_body))
+
+            # teardown
+            conn.close()
+
+        def it_keeps_the_connection_usable_after_an_unread_request_body():
+            # setup
+            conn = http.client.HTTPConnection("127.0.0.1", 8080, timeout=2)
+
+            # exercise
+            conn.request("POST", "/squirrels/1", body="name=Bad&size=none",
+                         headers={"Content-Type": "application/x-www-form-urlencoded"})
+            rejected = conn.getresponse()
+            rejected.read()
+            conn.request("GET", "/squirrels")
+            listed = conn.getresponse()
+
+            # verify
+            assert rejected.status == 404
+            assert listed.status == 200
+            assert listed.read() == b"[]"
+
+            # teardown
+            conn.close()
+
+        def it_answers_pipelined_requests_in_order():
+            # setup
+            sock = socket.create_connection(("127.0.0.1", 8080), timeout=2)
+            request = b"GET /squirrels/999 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+            # exercise
+            sock.sendall(request + request + b"GET /squirrels?limit=5 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            sock.close()
+
+            # verify
+            assert data.count(b"HTTP/1.1 404") == 2
+            assert data.count(b"HTTP/1.1 200") == 1
+            assert data.endswith(b"[]")
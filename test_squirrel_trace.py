@@ -0,0 +1,123 @@
+import json
+import pstats
+import time
+import pytest
+from squirrel_trace import NULL_TRACE, Trace, Tracer, currentTrace
+
+def readRecords(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture
+def tracer(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.jsonl"), profileDir=str(tmp_path / "profiles"))
+    yield tracer
+    tracer.close()
+
+def describe_Trace():
+
+    def it_charges_time_to_the_innermost_phase():
+        # setup
+        trace = Trace(time.perf_counter())
+
+        # exercise
+        with trace.phase("db"):
+            time.sleep(0.02)
+            with trace.phase("rows"):
+                time.sleep(0.02)
+
+        # verify
+        assert 0.015 < trace.phases["db"] < 0.035
+        assert 0.015 < trace.phases["rows"] < 0.035
+
+    def it_adds_up_repeated_phases():
+        # setup
+        trace = Trace(time.perf_counter())
+
+        # exercise
+        for _ in range(2):
+            with trace.phase("write"):
+                time.sleep(0.01)
+
+        # verify
+        assert trace.phases["write"] >= 0.02
+
+def describe_Tracer():
+
+    def it_ignores_requests_without_the_header_by_default(tracer):
+        # exercise
+        trace = tracer.start(time.perf_counter(), None)
+
+        # verify
+        assert trace is NULL_TRACE
+        assert not trace
+
+    def it_ignores_a_header_that_does_not_ask_for_tracing(tracer):
+        # exercise / verify
+        assert tracer.start(time.perf_counter(), "0") is NULL_TRACE
+
+    def it_samples_requests_at_the_configured_rate(tmp_path):
+        # setup
+        tracer = Tracer(str(tmp_path / "trace.jsonl"), rate=1.0)
+
+        # exercise
+        trace = tracer.start(time.perf_counter(), None)
+
+        # verify
+        assert trace
+        tracer.finish(trace, "GET", "/squirrels", 200)
+
+        # teardown
+        tracer.close()
+
+    def it_writes_one_json_line_per_request(tracer):
+        # setup
+        trace = tracer.start(time.perf_counter(), "1")
+        with trace.phase("db"):
+            pass
+
+        # exercise
+        tracer.finish(trace, "GET", "/squirrels/1", 200)
+
+        # verify
+        [record] = readRecords(tracer.path)
+        assert record["id"] == trace.id
+        assert (record["method"], record["path"], record["status"]) == ("GET", "/squirrels/1", 200)
+        assert set(record["phases"]) == {"db", "other"}
+        assert record["total_ms"] >= record["phases"]["db"]
+
+    def it_makes_the_trace_current_until_finished(tracer):
+        # setup
+        trace = tracer.start(time.perf_counter(), "1")
+
+        # exercise
+        current = currentTrace()
+        tracer.finish(trace, "GET", "/", 200)
+
+        # verify
+        assert current is trace
+        assert currentTrace() is None
+
+    def it_dumps_a_profile_when_asked(tracer):
+        # setup
+        trace = tracer.start(time.perf_counter(), "profile")
+        sum(range(1000))
+
+        # exercise
+        tracer.finish(trace, "GET", "/", 200)
+
+        # verify
+        [record] = readRecords(tracer.path)
+        assert pstats.Stats(record["profile"]).total_calls > 0
+
+    def it_traces_without_profiling_while_another_profile_runs(tracer):
+        # setup
+        first = tracer.start(time.perf_counter(), "profile")
+
+        # exercise
+        second = tracer.start(time.perf_counter(), "profile")
+
+        # verify
+        assert second and second.profiler is None
+        tracer.finish(second, "GET", "/", 200)
+        tracer.finish(first, "GET", "/", 200)